@@ -0,0 +1,126 @@
+"""
+감정 통계 / 감정 타임라인 롤업 재계산
+
+emotion_stats와 emotion_timeline은 emotion_history INSERT 트리거가 같은 트랜잭션에서 갱신하지만,
+emotion_history 행을 직접 고치거나 지웠다면 어긋날 수 있습니다.
+이 스크립트는 emotion_history 전체를 한 번 집계해 두 테이블을 한 트랜잭션에서 다시 채웁니다 (그동안 서버의 쓰기는 기다림).
+--verify를 주면 기록하지 않고 어긋난 항목 수만 확인합니다.
+(affection_timeline은 호감도 변화 기록이 따로 없어 다시 계산할 수 없습니다.)
+
+사용법 (backend 폴더에서):
+    python backfill_emotion_stats.py
+    python backfill_emotion_stats.py --verify
+"""
+
+import argparse
+import sys
+import time
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+
+from database import engine
+from models import TIMELINE_RESOLUTIONS, EmotionHistory, EmotionStats, EmotionTimeline
+
+
+def stats_query():
+    """emotion_history를 (user_id, emotion)별로 집계하는 쿼리"""
+    return (
+        select(
+            EmotionHistory.user_id,
+            EmotionHistory.emotion,
+            func.count().label("emotion_count"),
+            func.coalesce(func.sum(EmotionHistory.intensity), 0).label("intensity_sum"),
+            func.max(EmotionHistory.timestamp).label("last_recorded"),
+        )
+        .group_by(EmotionHistory.user_id, EmotionHistory.emotion)
+    )
+
+
+def timeline_query():
+    """emotion_history를 해상도별 (user_id, bucket_start, emotion)으로 집계하는 쿼리"""
+    selects = []
+    for resolution, fmt in TIMELINE_RESOLUTIONS.items():
+        bucket_start = func.strftime(fmt, EmotionHistory.timestamp)
+        selects.append(
+            select(
+                EmotionHistory.user_id,
+                literal(resolution).label("resolution"),
+                bucket_start.label("bucket_start"),
+                EmotionHistory.emotion,
+                func.count().label("emotion_count"),
+                func.coalesce(func.sum(EmotionHistory.intensity), 0).label("intensity_sum"),
+            )
+            .where(EmotionHistory.timestamp.is_not(None))
+            .group_by(EmotionHistory.user_id, bucket_start, EmotionHistory.emotion)
+        )
+    return union_all(*selects)
+
+
+# (테이블, 집계 쿼리, 비교할 키 열 수) - 집계 쿼리의 열 순서는 테이블에 넣는 열 순서
+ROLLUPS = [
+    (EmotionStats, stats_query, 2),
+    (EmotionTimeline, timeline_query, 4),
+]
+
+
+def rebuild():
+    """롤업 테이블을 비우고 다시 채운 뒤 {테이블 이름: 행 수}를 반환합니다"""
+    counts = {}
+    with engine.begin() as connection:
+        for model, query, _ in ROLLUPS:
+            table = model.__table__
+            rollup = query()
+            connection.execute(delete(table))
+            connection.execute(insert(table).from_select([column.name for column in rollup.selected_columns], rollup))
+            counts[table.name] = connection.execute(select(func.count()).select_from(table)).scalar()
+    return counts
+
+
+def find_mismatches():
+    """다시 집계한 값과 다른 [(테이블 이름, 키, 저장값, 집계값)] (값은 (횟수, 강도 합))"""
+    mismatches = []
+    with engine.connect() as connection:
+        for model, query, key_size in ROLLUPS:
+            rollup = query()
+            key_columns = [column.name for column in rollup.selected_columns][:key_size]
+            expected = {
+                tuple(row[:key_size]): (row.emotion_count, row.intensity_sum)
+                for row in connection.execute(rollup)
+            }
+            stored = {
+                tuple(row[:key_size]): (row.emotion_count, row.intensity_sum)
+                for row in connection.execute(
+                    select(*(getattr(model, name) for name in key_columns), model.emotion_count, model.intensity_sum)
+                    .where(model.emotion_count > 0)
+                )
+            }
+            mismatches.extend(
+                (model.__tablename__, key, stored.get(key), expected.get(key))
+                for key in sorted(set(expected) | set(stored))
+                if stored.get(key) != expected.get(key)
+            )
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="emotion_stats / emotion_timeline 롤업 재계산")
+    parser.add_argument("--verify", action="store_true", help="기록하지 않고 어긋난 항목만 확인")
+    parser.add_argument("--show", type=int, default=20, help="어긋난 항목을 보여 줄 최대 수")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if not args.verify:
+        counts = rebuild()
+        summary = ", ".join(f"{name} {rows}행" for name, rows in counts.items())
+        print(f"롤업 재계산 완료: {summary} ({time.perf_counter() - start:.1f}초)")
+        return 0
+
+    mismatches = find_mismatches()
+    print(f"어긋난 항목: {len(mismatches)}개 ({time.perf_counter() - start:.1f}초)")
+    for table, key, stored, expected in mismatches[:args.show]:
+        print(f"  {table} {key}: 저장 {stored} → 집계 {expected}  (횟수, 강도 합)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
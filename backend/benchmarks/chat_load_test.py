@@ -0,0 +1,95 @@
+"""
+/chat 부하 테스트
+
+기본값은 로컬 대역 LLM(LLM_BACKEND=local)으로 앱을 프로세스 안에서 띄워
+API 키나 네트워크 없이 전체 파이프라인(프롬프트 → LLM → 호감도/감정/기록/이벤트)을 측정합니다.
+--url을 주면 이미 실행 중인 서버에 요청합니다.
+
+사용법 (backend 폴더에서):
+    python benchmarks/chat_load_test.py --requests 500 --concurrency 100
+    python benchmarks/chat_load_test.py --url http://localhost:8001 --endpoint /chat/stream
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+MESSAGES = [
+    "안녕 카오루코! 오늘 하루 어땠어?",
+    "너 정말 예뻐, 진짜 최고야",
+    "요즘 좀 힘들어서 우울해 ㅠㅠ",
+    "같이 케이크 먹으러 갈래?",
+    "저번에 말했던 다도부 이야기 기억나?",
+    "생일 축하해! 선물 준비했어",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(client: httpx.AsyncClient, endpoint: str, total: int, concurrency: int, users: int):
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def one(i: int):
+        nonlocal errors
+        payload = {"message": MESSAGES[i % len(MESSAGES)], "user_name": f"load_user_{i % users}"}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=payload, timeout=120)
+                # 스트리밍 응답도 끝까지 받아야 한 턴이 끝난 것
+                await response.aread()
+                if response.status_code != 200 or b"event: error" in response.content:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+    
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    wall = time.perf_counter() - wall_start
+    
+    print(f"requests={total} concurrency={concurrency} users={users} endpoint={endpoint}")
+    print(f"throughput={total / wall:.1f} req/s  wall={wall:.2f}s  errors={errors}")
+    print("latency ms: p50={:.0f} p95={:.0f} p99={:.0f} max={:.0f}".format(
+        *(percentile(latencies, p) * 1000 for p in (50, 95, 99, 100))
+    ))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="/chat load test")
+    parser.add_argument("--url", help="실행 중인 서버 주소 (생략하면 프로세스 내부에서 앱 실행)")
+    parser.add_argument("--endpoint", default="/chat")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+    
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url) as client:
+            await run_load(client, args.endpoint, args.requests, args.concurrency, args.users)
+        return
+    
+    # 프로세스 내부 실행: 로컬 대역 LLM 사용
+    os.environ.setdefault("LLM_BACKEND", "local")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main as app_module
+    
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with app_module.lifespan(app_module.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            await run_load(client, args.endpoint, args.requests, args.concurrency, args.users)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
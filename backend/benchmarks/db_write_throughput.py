@@ -0,0 +1,151 @@
+"""
+DB 쓰기 처리량 벤치마크 (엔진 프로필 비교)
+
+/chat 한 턴과 같은 트랜잭션(호감도 UPDATE + chat_history/emotion_history INSERT + COMMIT)을
+여러 작업이 동시에 실행하는 동안, 다른 작업들은 일정한 간격으로 최근 대화를 조회합니다.
+--write-behind를 주면 기록 INSERT는 HistoryWriter 큐로 넘겨 여러 턴을 모아서 기록합니다 (턴은 호감도 UPDATE만 커밋).
+프로필마다 새 임시 SQLite 파일을 만들어 턴 처리량, 턴/조회 지연, 실패("database is locked") 수를 비교합니다.
+LLM 호출은 포함하지 않으므로 DB 계층만의 한계를 보여 줍니다.
+
+사용법 (backend 폴더에서):
+    python benchmarks/db_write_throughput.py
+    python benchmarks/db_write_throughput.py --turns 2000 --writers 50 --readers 10
+    python benchmarks/db_write_throughput.py --profile production
+    python benchmarks/db_write_throughput.py --profile production --write-behind
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import crud
+import models
+from database import DATABASE_PROFILES, Base, build_async_engine, build_engine, build_write_lock
+from emotion_system.affection_manager import AffectionManager
+from history_writer import HistoryWriter
+from unit_of_work import TurnUnitOfWork
+from user_directory import user_directory
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_profile(profile: str, turns: int, writers: int, readers: int, read_interval: float, users: int,
+                      write_behind: bool = False):
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        user_names = [f"bench_user_{index}" for index in range(users)]
+        sync_engine = build_engine(url, profile)
+        Base.metadata.create_all(bind=sync_engine)
+        with sync_engine.begin() as connection:
+            connection.execute(insert(models.User), [{"name": name} for name in user_names])
+        sync_engine.dispose()
+        # 프로필마다 새 DB이므로 이전 실행의 이름 → id 캐시를 비움
+        for name in user_names:
+            user_directory.forget(name)
+
+        async_engine = build_async_engine(url, profile)
+        session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        write_lock = build_write_lock(url, profile)
+        history_writer = HistoryWriter(session_factory, write_lock) if write_behind else None
+        if history_writer:
+            history_writer.start()
+
+        latencies, errors = [], 0
+        read_latencies, read_errors = [], 0
+        next_turn = 0
+        writers_done = asyncio.Event()
+
+        async def writer():
+            nonlocal next_turn, errors
+            while next_turn < turns:
+                turn = next_turn
+                next_turn += 1
+                user_name = user_names[turn % users]
+                start = time.perf_counter()
+                try:
+                    async with TurnUnitOfWork(session_factory, write_lock, history_writer) as uow:
+                        await crud.create_chat_history(
+                            uow.session, f"메시지 {turn}", f"답변 {turn}", user_name=user_name, unit_of_work=uow
+                        )
+                        user_id = await user_directory.resolve(uow.session, user_name)
+                        uow.append(models.EmotionHistory, {"user_id": user_id, "emotion": "기쁨", "intensity": 6})
+                        async with uow.writing():
+                            await AffectionManager(uow.session, unit_of_work=uow).apply_triggers(
+                                user_name, [("compliment", 1.0)]
+                            )
+                            await uow.commit()
+                except OperationalError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        async def reader(index: int):
+            nonlocal read_errors
+            while not writers_done.is_set():
+                start = time.perf_counter()
+                try:
+                    async with session_factory() as db:
+                        await crud.get_chat_history(db, user_name=user_names[index % users], limit=20)
+                except OperationalError:
+                    read_errors += 1
+                read_latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(read_interval)
+
+        async def all_writers():
+            await asyncio.gather(*(writer() for _ in range(writers)))
+            writers_done.set()
+
+        wall_start = time.perf_counter()
+        await asyncio.gather(all_writers(), *(reader(i) for i in range(readers)))
+        if history_writer:
+            # 남은 행까지 기록된 시점을 기준으로
+            await history_writer.stop()
+        wall = time.perf_counter() - wall_start
+        await async_engine.dispose()
+
+    mode = " write-behind" if write_behind else ""
+    print(f"[{profile}{mode}] turns={turns} writers={writers} readers={readers} users={users}")
+    print(f"  turns: {turns / wall:.1f}/s  wall={wall:.2f}s  errors={errors}")
+    print("  turn latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}".format(
+        *(percentile(latencies, p) * 1000 for p in (50, 95, 99, 100))
+    ))
+    print("  read latency ms: p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f}  reads={} errors={}".format(
+        *(percentile(read_latencies, p) * 1000 for p in (50, 95, 99, 100)), len(read_latencies), read_errors
+    ))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="DB write throughput benchmark")
+    parser.add_argument("--profile", choices=DATABASE_PROFILES, help="이 프로필만 측정 (생략하면 전부 비교)")
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--writers", type=int, default=20, help="동시에 턴을 쓰는 작업 수")
+    parser.add_argument("--readers", type=int, default=5, help="동시에 최근 대화를 조회하는 작업 수")
+    parser.add_argument("--read-interval-ms", type=float, default=20, help="조회 작업 하나가 조회 사이에 쉬는 시간")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--write-behind", action="store_true", help="기록 INSERT를 HistoryWriter로 모아서 기록")
+    args = parser.parse_args()
+
+    # 변경 전(default) → 변경 후(production) 순서
+    profiles = [args.profile] if args.profile else list(reversed(DATABASE_PROFILES))
+    for profile in profiles:
+        await run_profile(
+            profile, args.turns, args.writers, args.readers, args.read_interval_ms / 1000, args.users, args.write_behind
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""
+장기 기억 검색 벤치마크 (지연 / 재현율)
+
+임시 폴더에 사용자 한 명의 합성 대화 --turns개를 색인한 뒤, 색인된 턴 하나의 단어 일부와 다른 단어를 섞은 검색어로
+MemoryIndex.search를 반복해 검색 지연(검색어 벡터화 포함, DB 조회 제외)과
+원래 턴이 상위 k개에 들어간 비율을 잽니다. 같은 비율을 모든 int8 벡터를 코사인으로 비교한 정확한 검색과도 비교합니다.
+
+사용법 (backend 폴더에서):
+    python benchmarks/memory_recall.py
+    python benchmarks/memory_recall.py --turns 100000 --queries 500 --coarse-candidates 2048 --candidates 128
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from memory_index import MemoryIndex, embed
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class SyntheticChat:
+    """한글 음절로 만든 단어를 Zipf 분포로 뽑아 만든 대화 (자주 쓰는 단어와 드문 단어가 섞이도록)"""
+
+    def __init__(self, seed: int, vocabulary: int = 5000):
+        self.rng = np.random.default_rng(seed)
+        syllables = [chr(0xAC00 + code) for code in self.rng.choice(11172, 400, replace=False)]
+        self.words = np.array(["".join(self.rng.choice(syllables, self.rng.integers(1, 4))) for _ in range(vocabulary)])
+        weights = 1 / np.arange(1, vocabulary + 1)
+        self.weights = weights / weights.sum()
+
+    def sentence(self, low: int, high: int) -> str:
+        count = self.rng.integers(low, high)
+        return " ".join(self.rng.choice(self.words, count, p=self.weights)) + "요"
+
+    def turns(self, count: int):
+        return [(self.sentence(3, 12), self.sentence(5, 20)) for _ in range(count)]
+
+    def query_for(self, user_message: str) -> str:
+        """원래 메시지 단어의 2/3와 관계없는 단어 두 개를 섞은 검색어"""
+        words = user_message.rstrip("요").split()
+        kept = list(self.rng.choice(words, max(1, len(words) * 2 // 3), replace=False))
+        return " ".join(kept + list(self.rng.choice(self.words, 2, p=self.weights)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="장기 기억 검색 지연 / 재현율")
+    parser.add_argument("--turns", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--coarse-candidates", type=int, default=1024)
+    parser.add_argument("--candidates", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    chat = SyntheticChat(args.seed)
+    turns = chat.turns(args.turns)
+    with tempfile.TemporaryDirectory() as directory:
+        index = MemoryIndex(directory, coarse_candidates=args.coarse_candidates, candidates=args.candidates)
+        start = time.perf_counter()
+        batch = 5000
+        for offset in range(0, len(turns), batch):
+            entries = [(offset + row + 1, user_message, bot_reply)
+                       for row, (user_message, bot_reply) in enumerate(turns[offset:offset + batch])]
+            index.add(1, entries, ("2026-01-01 00:00:00", entries[-1][0]))
+        elapsed = time.perf_counter() - start
+        print(f"색인: {args.turns}턴 {elapsed:.1f}초 ({elapsed / args.turns * 1e6:.0f}µs/턴)")
+
+        targets = chat.rng.integers(args.turns, size=args.queries)
+        queries = [chat.query_for(turns[target][0]) for target in targets]
+        latencies, found, found_exact = [], 0, 0
+        index.search(1, "준비", args.top_k)  # 파일 매핑과 작업 버퍼를 미리 준비
+        for target, query in zip(targets, queries):
+            start = time.perf_counter()
+            hits = index.search(1, query, args.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += any(entry_id == target + 1 for entry_id, _ in hits)
+
+        # 정확한 검색 비교 (모든 행의 코사인, 캐시를 밀어내므로 지연 측정이 끝난 뒤에)
+        vectors = np.asarray(index._index(1).vectors[:args.turns], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        for target, query in zip(targets, queries):
+            found_exact += target in np.argsort(-(vectors @ embed(query)))[:args.top_k]
+
+    print(f"검색 지연 ms: p50 {percentile(latencies, 50):.3f}, p95 {percentile(latencies, 95):.3f}, "
+          f"p99 {percentile(latencies, 99):.3f}")
+    print(f"원래 턴이 상위 {args.top_k}개에 든 비율: {found / args.queries:.1%} "
+          f"(전체 코사인 비교 {found_exact / args.queries:.1%}, 후보 {args.coarse_candidates} → {args.candidates}개)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
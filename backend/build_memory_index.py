@@ -0,0 +1,70 @@
+"""
+장기 기억 인덱스 미리 만들기
+
+서버는 검색할 때마다 새 기록을 MEMORY_SYNC_BATCH개씩만 색인하므로, 기존 기록이 긴 사용자는 처음 몇 턴 동안 일부만 검색됩니다.
+이 스크립트는 퇴역하지 않은 모든 사용자의 남은 기록을 한 번에 색인합니다.
+인덱스 파일은 한 프로세스만 써야 하므로 서버를 끈 상태에서 실행하세요.
+--rebuild를 주면 인덱스 폴더를 지우고 처음부터 만듭니다 (DB에 없는 사용자의 폴더도 함께 정리됨).
+
+사용법 (backend 폴더에서):
+    python build_memory_index.py
+    python build_memory_index.py --rebuild
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import time
+
+import dotenv
+from sqlalchemy import select
+
+import models
+from database import AsyncSessionLocal, async_engine
+from memory_index import MemoryIndex
+
+
+async def build(directory: str, batch: int) -> dict:
+    """{user_id: 새로 색인한 행 수}를 반환합니다"""
+    index = MemoryIndex(directory, sync_batch=batch)
+    indexed = {}
+    try:
+        async with AsyncSessionLocal() as db:
+            user_ids = (await db.execute(
+                select(models.User.id).where(models.User.retired_at.is_(None)).order_by(models.User.id)
+            )).scalars().all()
+            for user_id in user_ids:
+                total = 0
+                while True:
+                    added = await index.sync(db, user_id)
+                    total += added
+                    if added < batch:
+                        break
+                indexed[user_id] = total
+    finally:
+        index.close()
+        await async_engine.dispose()
+    return indexed
+
+
+def main():
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description="장기 기억 인덱스 미리 만들기")
+    parser.add_argument("--rebuild", action="store_true", help="인덱스 폴더를 지우고 처음부터 만들기")
+    parser.add_argument("--batch", type=int, default=5000, help="한 번에 읽어 색인할 행 수")
+    args = parser.parse_args()
+
+    directory = os.getenv("MEMORY_INDEX_DIR", "./memory_index")
+    if args.rebuild:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    start = time.perf_counter()
+    indexed = asyncio.run(build(directory, args.batch))
+    print(f"색인 완료: 사용자 {len(indexed)}명, 새 턴 {sum(indexed.values())}개 ({time.perf_counter() - start:.1f}초)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
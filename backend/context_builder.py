@@ -0,0 +1,110 @@
+"""
+토큰 예산 기반 대화 맥락 구성기
+페르소나, 최근 대화, 새 메시지의 토큰 수를 추정해 예산 안에서 최신 대화부터 채웁니다.
+장기 기억 검색으로 찾은 예전 대화는 따로 정한 예산 안에서 최근 대화 앞에 넣습니다.
+"""
+
+import math
+import re
+from typing import Dict, List, Sequence, Tuple
+
+# 한글/한자/가나는 글자당 약 1토큰, 그 외 단어는 4글자당 약 1토큰으로 근사
+_CJK_RANGES = "\u1100-\u11ff\u3040-\u30ff\u3130-\u318f\u4e00-\u9fff\uac00-\ud7af"
+_CJK_PATTERN = re.compile(f"[{_CJK_RANGES}]")
+_WORD_PATTERN = re.compile(f"[^\\s{_CJK_RANGES}]+")
+
+
+def estimate_tokens(text: str) -> int:
+    """LLM 토크나이저 없이 쓰는 빠른 토큰 수 근사 (약간 크게 잡는 쪽으로 추정)"""
+    if not text:
+        return 0
+    cjk_tokens = len(_CJK_PATTERN.findall(text))
+    other_tokens = sum(math.ceil(len(word) / 4) for word in _WORD_PATTERN.findall(text))
+    return cjk_tokens + other_tokens
+
+
+class ContextBuilder:
+    """
+    프롬프트 구성기
+
+    Args:
+        persona: 시스템 페르소나 프롬프트
+        token_budget: 프롬프트 전체 토큰 예산
+        memory_token_budget: 그중 장기 기억(관련된 예전 대화)에 쓸 수 있는 최대 토큰
+    """
+    
+    HISTORY_HEADER = "\n\n최근 우리의 대화 내용:\n"
+    MEMORY_HEADER = "\n\n예전에 나눴던 대화 중 관련된 내용:\n"
+    
+    def __init__(self, persona: str, token_budget: int = 4000, memory_token_budget: int = 600):
+        self.persona = persona
+        self.token_budget = token_budget
+        self.memory_token_budget = memory_token_budget
+        self.persona_tokens = estimate_tokens(persona)  # 페르소나는 고정이므로 한 번만 계산
+    
+    def build(self, speaker: str, user_context: str, history: Sequence, message: str,
+              memories: Sequence = ()) -> Tuple[str, Dict]:
+        """
+        프롬프트와 섹션별 토큰 사용량을 반환합니다
+
+        Args:
+            speaker: 대화 기록에 표시할 사용자 이름
+            user_context: 사용자 이름 안내 등 페르소나 뒤에 붙는 문장
+            history: 최신순 ChatHistory 목록 (user_message, bot_reply 속성)
+            message: 새 메시지
+            memories: 관련도순 예전 대화 목록 (user_message, bot_reply 속성, 최근 대화와 겹치지 않는 것)
+        """
+        message_block = f"\n\n{speaker}의 새 메시지: {message}\n\n카오루코로서 답변해줘:"
+        
+        fixed_tokens = self.persona_tokens + estimate_tokens(user_context) + estimate_tokens(message_block)
+        remaining = self.token_budget - fixed_tokens - estimate_tokens(self.HISTORY_HEADER)
+        
+        # 관련도 높은 기억부터, 넘치는 기억은 건너뛰고 더 짧은 다음 기억을 시도
+        memory_lines: List[str] = []
+        memory_tokens = 0
+        memory_remaining = min(self.memory_token_budget, remaining) - estimate_tokens(self.MEMORY_HEADER)
+        for chat in memories:
+            line = f"{speaker}: {chat.user_message}\n카오루코: {chat.bot_reply}\n"
+            line_tokens = estimate_tokens(line)
+            if memory_tokens + line_tokens > memory_remaining:
+                continue
+            memory_lines.append(line)
+            memory_tokens += line_tokens
+        
+        memory_context = ""
+        if memory_lines:
+            memory_context = self.MEMORY_HEADER + "".join(memory_lines)
+            memory_tokens += estimate_tokens(self.MEMORY_HEADER)
+            remaining -= memory_tokens
+        
+        # 최신 대화부터 예산이 허락하는 만큼 (중간을 건너뛰지 않도록 처음 넘치는 곳에서 멈춤)
+        lines: List[str] = []
+        history_tokens = 0
+        for chat in history:
+            line = f"{speaker}: {chat.user_message}\n카오루코: {chat.bot_reply}\n"
+            line_tokens = estimate_tokens(line)
+            if history_tokens + line_tokens > remaining:
+                break
+            lines.append(line)
+            history_tokens += line_tokens
+        
+        conversation_context = ""
+        if lines:
+            conversation_context = self.HISTORY_HEADER + "".join(reversed(lines))  # Show oldest first
+            history_tokens += estimate_tokens(self.HISTORY_HEADER)
+        
+        prompt = f"{self.persona}{user_context}\n{memory_context}{conversation_context}{message_block}"
+        
+        usage = {
+            "persona": self.persona_tokens,
+            "user_context": estimate_tokens(user_context),
+            "memory": memory_tokens,
+            "history": history_tokens,
+            "message": estimate_tokens(message_block),
+            "total": fixed_tokens + memory_tokens + history_tokens,
+            "budget": self.token_budget,
+            "history_turns": len(lines),
+            "history_turns_available": len(history),
+            "memory_turns": len(memory_lines)
+        }
+        return prompt, usage
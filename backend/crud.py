@@ -1,40 +1,365 @@
-from sqlalchemy.orm import Session
+import base64
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import select, delete, update, func, and_, or_, literal_column, String, tuple_, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
+from user_directory import user_directory
 
-def get_chat_history(db: Session, user_name: str = None, skip: int = 0, limit: int = 10):
+def chat_history_query(user_id: int = None, skip: int = 0, limit: int = 10):
+    """
+    Query for the most recent chat history entries (served by ix_chat_history_user_id_timestamp).
+    """
+    query = select(models.ChatHistory)
+    if user_id is not None:
+        query = query.filter(models.ChatHistory.user_id == user_id)
+    return query.order_by(models.ChatHistory.timestamp.desc()).offset(skip).limit(limit)
+
+async def get_chat_history(db: AsyncSession, user_name: str = None, skip: int = 0, limit: int = 10):
     """
     Retrieve the most recent chat history entries for a specific user.
     """
-    query = db.query(models.ChatHistory)
+    user_id = None
     if user_name:
-        query = query.filter(models.ChatHistory.user_name == user_name)
-    return query.order_by(models.ChatHistory.timestamp.desc()).offset(skip).limit(limit).all()
+        user_id = await user_directory.resolve(db, user_name, create=False)
+        if user_id is None:
+            return []
+    result = await db.execute(chat_history_query(user_id, skip, limit))
+    return result.scalars().all()
+
+# Keyset pagination over (timestamp, id).
+# timestamp is compared as the stored text (CURRENT_TIMESTAMP, second resolution); binding a datetime
+# would render "...SS.000000" and break ties between rows written in the same second.
+_stored_timestamp = type_coerce(models.ChatHistory.timestamp, String)
+
+def encode_history_cursor(timestamp: str, entry_id: int) -> str:
+    """
+    Encode a (stored timestamp, id) position as an opaque URL-safe cursor.
+    """
+    return base64.urlsafe_b64encode(f"{timestamp}|{entry_id}".encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Decode a cursor from encode_history_cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, entry_id = raw.rsplit("|", 1)
+        return timestamp, int(entry_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor!r}") from e
+
+def chat_history_page_query(user_id: int, limit: int, before: Optional[Tuple[str, int]] = None,
+                            since: Optional[Tuple[str, int]] = None):
+    """
+    Query one keyset page of a user's chat history (served by ix_chat_history_user_id_timestamp).
+    Without since: newest first, older than `before` if given. With since: oldest first, newer than `since`.
+    Fetches limit + 1 rows so the caller can tell whether another page follows.
+    """
+    position = tuple_(_stored_timestamp, models.ChatHistory.id)
+    query = select(models.ChatHistory, _stored_timestamp.label("cursor_timestamp")).filter(models.ChatHistory.user_id == user_id)
+    if since is not None:
+        query = query.filter(position > tuple_(*since))
+        order = (models.ChatHistory.timestamp.asc(), models.ChatHistory.id.asc())
+    else:
+        if before is not None:
+            query = query.filter(position < tuple_(*before))
+        order = (models.ChatHistory.timestamp.desc(), models.ChatHistory.id.desc())
+    return query.order_by(*order).limit(limit + 1)
+
+async def get_chat_history_page(db: AsyncSession, user_name: str, limit: int, before: Optional[str] = None,
+                                since: Optional[str] = None) -> dict:
+    """
+    Retrieve one page of a user's chat history with keyset cursors.
+    Every page costs the same regardless of depth (no OFFSET scan).
+
+    Returns a dict with:
+        items: entries, newest first (or oldest first when `since` is given)
+        next_cursor: pass back as the same parameter (`before` or `since`) for the next page; None when done
+        latest_cursor: position of the newest entry seen, to pass as `since` for incremental sync
+    """
+    before_position = decode_history_cursor(before) if before else None
+    since_position = decode_history_cursor(since) if since else None
+
+    user_id = await user_directory.resolve(db, user_name, create=False)
+    if user_id is None:
+        return {"items": [], "next_cursor": None, "latest_cursor": since}
+
+    rows = (await db.execute(
+        chat_history_page_query(user_id, limit, before_position, since_position)
+    )).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    cursors = [encode_history_cursor(timestamp, entry.id) for entry, timestamp in rows]
+    next_cursor = cursors[-1] if has_more else None
+    if since_position is not None:
+        latest_cursor = cursors[-1] if cursors else since
+    elif before_position is None:
+        latest_cursor = cursors[0] if cursors else None
+    else:
+        # Older pages never contain the newest entry; keep the cursor from the first page.
+        latest_cursor = None
+    return {"items": [entry for entry, _ in rows], "next_cursor": next_cursor, "latest_cursor": latest_cursor}
+
+def chat_entry_position_query(user_id: int, entry_id: int):
+    """
+    Query the stored (timestamp, id) position of one of a user's chat history entries (primary key lookup).
+    """
+    return select(_stored_timestamp, models.ChatHistory.id).where(
+        models.ChatHistory.id == entry_id, models.ChatHistory.user_id == user_id
+    )
+
+def chat_entries_query(user_id: int, entry_ids: List[int]):
+    """
+    Query a user's chat history entries by id (primary key lookups).
+    """
+    return select(models.ChatHistory).where(
+        models.ChatHistory.id.in_(entry_ids), models.ChatHistory.user_id == user_id
+    )
+
+# Full-text search over chat_history_fts (FTS5, trigram tokenizer).
+# Trigram tokens are three characters long, so shorter terms cannot use the index;
+# they are matched with LIKE on the rows the index returns, or on the user's rows if every term is short.
+SEARCH_MIN_TERM_LENGTH = 3
+# Only the most recent matches are ranked, which bounds the bm25 cost for terms that appear in most of a long history.
+SEARCH_RANK_WINDOW = 1000
+
+def split_search_terms(q: str) -> List[str]:
+    """
+    Split a search string into whitespace-separated terms (all must match). Raises ValueError if there are none.
+    """
+    terms = q.split()
+    if not terms:
+        raise ValueError("Search query must contain at least one term")
+    return terms
+
+def chat_search_query(user_id: int, terms: List[str], limit: int, offset: int = 0,
+                      rank_window: int = SEARCH_RANK_WINDOW):
+    """
+    Query one page of a user's chat history entries containing every term (substring, case-insensitive).
+    Ranked by bm25 among the rank_window most recent matches when at least one term is indexable,
+    otherwise newest first over all matches.
+    Fetches limit + 1 rows so the caller can tell whether another page follows.
+    """
+    indexed = [term for term in terms if len(term) >= SEARCH_MIN_TERM_LENGTH]
+    short = [term for term in terms if len(term) < SEARCH_MIN_TERM_LENGTH]
+    entry = models.ChatHistory
+    filters = [entry.user_id == user_id]
+    filters.extend(
+        or_(entry.user_message.contains(term, autoescape=True), entry.bot_reply.contains(term, autoescape=True))
+        for term in short
+    )
+
+    if not indexed:
+        query = select(entry, literal_column("NULL").label("score")).filter(and_(*filters))
+        order = (entry.timestamp.desc(), entry.id.desc())
+    else:
+        # Each term as an FTS5 string (a quoted phrase matches as a substring); terms are ANDed and
+        # restricted to the message columns, and the user_key phrase narrows the match to this user.
+        phrases = " ".join('"' + term.replace('"', '""') + '"' for term in indexed)
+        match = f'user_key:"<{user_id}>" AND {{user_message bot_reply}}: ({phrases})'
+        fts = models.chat_history_fts
+        matches = literal_column(fts.name).op("MATCH")(match)
+        # Lowest rowid among the newest rank_window matches (FTS5 walks the doclist backwards and stops)
+        recent = select(fts.c.rowid).filter(matches).order_by(fts.c.rowid.desc()).limit(rank_window).subquery()
+        window_start = select(func.min(recent.c.rowid)).scalar_subquery()
+        # user_key gets no weight so it does not affect the ranking
+        rank = func.bm25(literal_column(fts.name), 0.0, 1.0, 1.0)
+        query = (
+            select(entry, (-rank).label("score"))
+            .join(fts, fts.c.rowid == entry.id)
+            .filter(matches, fts.c.rowid >= func.coalesce(window_start, 0), *filters)
+        )
+        order = (rank, entry.id.desc())
+    return query.order_by(*order).offset(offset).limit(limit + 1)
 
-def create_chat_history(db: Session, user_message: str, bot_reply: str, user_name: str = "사용자"):
+async def search_chat_history(db: AsyncSession, user_name: str, q: str, limit: int, offset: int = 0,
+                              rank_window: int = SEARCH_RANK_WINDOW) -> dict:
+    """
+    Search a user's chat history. Raises ValueError for an empty query
+    and NotImplementedError off SQLite (the index is an FTS5 table).
+
+    Returns a dict with:
+        items: matching entries with a relevance score (higher is better; None for short-term-only queries)
+        next_offset: pass back as `offset` for the next page; None when done
+    """
+    models.require_sqlite(db.get_bind(), "chat search")
+    terms = split_search_terms(q)
+    user_id = await user_directory.resolve(db, user_name, create=False)
+    if user_id is None:
+        return {"items": [], "next_offset": None}
+
+    rows = (await db.execute(chat_search_query(user_id, terms, limit, offset, rank_window))).all()
+    has_more = len(rows) > limit
+    items = [
+        {"id": entry.id, "user_message": entry.user_message, "bot_reply": entry.bot_reply,
+         "timestamp": entry.timestamp, "score": score}
+        for entry, score in rows[:limit]
+    ]
+    return {"items": items, "next_offset": offset + limit if has_more else None}
+
+# Timeline buckets are read from the pre-aggregated emotion_timeline / affection_timeline tables
+# with a range scan on (user_id, resolution, bucket_start), so the cost depends on the window, not the history.
+TIMELINE_STEPS = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+def emotion_timeline_query(user_id: int, resolution: str, start: str, end: str):
+    """
+    Query emotion buckets with start <= bucket_start <= end (served by ix_emotion_timeline_bucket).
+    """
+    timeline = models.EmotionTimeline
+    return (
+        select(timeline.bucket_start, timeline.emotion, timeline.emotion_count, timeline.intensity_sum)
+        .where(timeline.user_id == user_id, timeline.resolution == resolution,
+               timeline.bucket_start.between(start, end))
+        .order_by(timeline.bucket_start)
+    )
+
+def affection_timeline_query(user_id: int, resolution: str, start: str, end: str):
+    """
+    Query affection buckets with start <= bucket_start <= end (served by ix_affection_timeline_bucket).
+    """
+    timeline = models.AffectionTimeline
+    return (
+        select(timeline.bucket_start, timeline.affection_level, timeline.affection_min, timeline.affection_max)
+        .where(timeline.user_id == user_id, timeline.resolution == resolution,
+               timeline.bucket_start.between(start, end))
+        .order_by(timeline.bucket_start)
+    )
+
+def affection_before_query(user_id: int, resolution: str, start: str):
+    """
+    Query the last affection level recorded before a window (carried into buckets without a change).
+    """
+    timeline = models.AffectionTimeline
+    return (
+        select(timeline.affection_level)
+        .where(timeline.user_id == user_id, timeline.resolution == resolution, timeline.bucket_start < start)
+        .order_by(timeline.bucket_start.desc())
+        .limit(1)
+    )
+
+async def get_timeline(db: AsyncSession, user_name: str, resolution: str, buckets: int,
+                       end: Optional[datetime] = None) -> dict:
+    """
+    Build the emotion/affection timeline for the `buckets` buckets ending at `end` (default: now).
+    Only buckets that have data are returned; affection carries forward from the last recorded value.
+    Raises NotImplementedError off SQLite (the buckets are maintained by SQLite triggers).
+    """
+    models.require_sqlite(db.get_bind(), "timeline")
+    if end is None:
+        end = datetime.now()
+    elif end.tzinfo is not None:
+        # Buckets are keyed by naive local time (like EmotionHistory.timestamp)
+        end = end.astimezone().replace(tzinfo=None)
+    fmt = models.TIMELINE_RESOLUTIONS[resolution]
+    step = TIMELINE_STEPS[resolution]
+    last_bucket = datetime.fromisoformat(end.strftime(fmt))
+    first_bucket = last_bucket - step * (buckets - 1)
+    start_key, end_key = first_bucket.strftime(fmt), last_bucket.strftime(fmt)
+    timeline = {"resolution": resolution, "start": first_bucket, "end": last_bucket + step, "buckets": []}
+
+    user_id = await user_directory.resolve(db, user_name, create=False)
+    if user_id is None:
+        return timeline
+
+    emotions = {}
+    for bucket_start, emotion, count, intensity_sum in await db.execute(
+        emotion_timeline_query(user_id, resolution, start_key, end_key)
+    ):
+        emotions.setdefault(bucket_start, []).append((emotion, count, intensity_sum))
+    affections = {
+        row.bucket_start: row
+        for row in await db.execute(affection_timeline_query(user_id, resolution, start_key, end_key))
+    }
+    affection_level = (await db.execute(affection_before_query(user_id, resolution, start_key))).scalar()
+
+    for bucket_start in sorted(set(emotions) | set(affections)):
+        bucket = {"bucket_start": datetime.fromisoformat(bucket_start), "emotion_count": 0}
+        counts = {emotion: count for emotion, count, _ in emotions.get(bucket_start, ()) if count}
+        total = sum(counts.values())
+        if total:
+            bucket.update(
+                emotion_count=total,
+                dominant_emotion=max(counts, key=counts.get),
+                emotion_distribution={emotion: round(count / total * 100, 1) for emotion, count in counts.items()},
+                mean_intensity=round(sum(s for _, _, s in emotions[bucket_start]) / total, 1),
+            )
+        affection = affections.get(bucket_start)
+        if affection is not None:
+            affection_level = affection.affection_level
+            bucket.update(affection_min=affection.affection_min, affection_max=affection.affection_max)
+        elif affection_level is not None:
+            bucket.update(affection_min=affection_level, affection_max=affection_level)
+        bucket["affection_level"] = affection_level
+        timeline["buckets"].append(bucket)
+    return timeline
+
+async def create_chat_history(db: AsyncSession, user_message: str, bot_reply: str, user_name: str = "사용자",
+                              commit: bool = True, unit_of_work=None):
     """
     Create and save a new chat history entry.
+    With commit=False the entry is only added to the session (the caller commits the turn).
+    With a unit_of_work the row is appended to the turn instead (batched by its HistoryWriter
+    if it has one) and None is returned.
     """
-    db_chat_entry = models.ChatHistory(user_message=user_message, bot_reply=bot_reply, user_name=user_name)
+    user_id = await user_directory.resolve(db, user_name)
+    if unit_of_work is not None:
+        unit_of_work.append(models.ChatHistory, {
+            "user_id": user_id,
+            "user_message": user_message,
+            "bot_reply": bot_reply,
+        })
+        return None
+    db_chat_entry = models.ChatHistory(user_message=user_message, bot_reply=bot_reply, user_id=user_id)
     db.add(db_chat_entry)
-    db.commit()
-    db.refresh(db_chat_entry)
+    if commit:
+        await db.commit()
     return db_chat_entry
 
-def clear_user_data(db: Session, user_name: str):
-    """
-    Clear all data for a specific user (chat history, emotions, affection).
-    """
-    # ChatHistory 삭제
-    db.query(models.ChatHistory).filter(models.ChatHistory.user_name == user_name).delete()
-    
-    # UserEmotion 삭제
-    db.query(models.UserEmotion).filter(models.UserEmotion.user_name == user_name).delete()
-    
-    # UserAffection 삭제  
-    db.query(models.UserAffection).filter(models.UserAffection.user_name == user_name).delete()
-    
-    # EmotionHistory 삭제
-    db.query(models.EmotionHistory).filter(models.EmotionHistory.user_name == user_name).delete()
-    
-    db.commit()
-    return True
+async def retire_user_data(db: AsyncSession, user_name: str) -> Optional[int]:
+    """
+    Retire the user's current data generation (a single UPDATE on users) and return its id.
+    Reads resolve the name to a fresh users row from now on, so the old rows disappear at once;
+    UserDataPurger deletes them in the background. Returns None if the user has no data.
+    """
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.name == user_name, models.User.retired_at.is_(None))
+        .values(retired_at=func.now())
+        .returning(models.User.id)
+    )
+    user_id = result.scalar()
+    await db.commit()
+    user_directory.forget(user_name)
+    return user_id
+
+# Per-user tables, emptied in this order before the retired users row itself is deleted
+USER_DATA_TABLES = (models.ChatHistory, models.EmotionHistory, models.EmotionStats, models.EmotionTimeline,
+                    models.AffectionTimeline, models.UserEmotion, models.UserAffection)
+
+def retired_user_ids_query(limit: int = 100):
+    """
+    Query retired users rows, oldest first (served by the partial index ix_users_retired_at).
+    """
+    return (
+        select(models.User.id)
+        .where(models.User.retired_at.is_not(None))
+        .order_by(models.User.retired_at)
+        .limit(limit)
+    )
+
+def delete_user_rows_batch_query(model, user_id: int, batch_size: int):
+    """
+    Delete at most batch_size rows of one user from a per-user table.
+    SQLite has no DELETE ... LIMIT by default, so the rows are picked by rowid in a subquery.
+    """
+    table = model.__table__
+    batch = select(table.c.id).where(table.c.user_id == user_id).limit(batch_size)
+    return delete(table).where(table.c.id.in_(batch.scalar_subquery()))
+
+def delete_retired_user_query(user_id: int):
+    """
+    Delete a retired users row (ON DELETE CASCADE removes rows written after its last batch).
+    """
+    return delete(models.User).where(models.User.id == user_id, models.User.retired_at.is_not(None))
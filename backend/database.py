@@ -1,23 +1,187 @@
-from sqlalchemy import create_engine
+import asyncio
+import os
+
+import dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-# Define the database URL for SQLite
-# The database file will be created in the backend directory
-SQLALCHEMY_DATABASE_URL = "sqlite:///./chat_history.db"
+# Engine settings are read at import time, so load .env before main.py does
+dotenv.load_dotenv()
+
+# Define the database URL
+# Defaults to an SQLite file in the backend directory; set DATABASE_URL to use a server database
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chat_history.db")
+
+# Engine profile
+# production: SQLite in WAL mode with tuned pragmas and a larger connection pool
+# default:    driver defaults (rollback journal, synchronous=FULL, small page cache), foreign keys still enforced
+DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "production").lower()
+DATABASE_PROFILES = ("production", "default")
+
+# SQLite pragmas for the production profile
+SQLITE_CACHE_SIZE_MB = int(os.getenv("SQLITE_CACHE_SIZE_MB", "64"))
+SQLITE_MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pool for the production profile
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Sync driver -> async driver used by the request handlers
+# Only backends with INSERT ... ON CONFLICT and partial unique indexes (users.name per data generation)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# insert() constructs that support on_conflict_do_nothing, per backend
+CONFLICT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def to_async_url(url: str) -> str:
+    """Same database, opened through the async driver (e.g. sqlite -> sqlite+aiosqlite)"""
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver configured for database URL: {parsed.render_as_string()}")
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def conflict_insert(db, table):
+    """INSERT for the session's backend that supports on_conflict_do_nothing (Session or AsyncSession)"""
+    return CONFLICT_INSERTS[db.get_bind().dialect.name](table)
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _is_sqlite_file(url: str) -> bool:
+    return _is_sqlite(url) and make_url(url).database not in (None, "", ":memory:")
+
+
+def sqlite_pragmas(url: str, profile: str):
+    """PRAGMA statements run on every new connection for this URL/profile"""
+    if not _is_sqlite(url):
+        return []
+
+    # Enforce the users.id references (off by default in SQLite) in every profile:
+    # the user purge relies on ON DELETE CASCADE, and without the check a reused users.id
+    # could pick up rows left behind by a deleted user
+    pragmas = ["PRAGMA foreign_keys=ON"]
+    if profile != "production":
+        return pragmas
+
+    pragmas += [
+        # Fail with "database is locked" only after waiting this long for the write lock
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        # Negative cache_size is in KiB
+        f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_MB * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    if _is_sqlite_file(url):
+        pragmas += [
+            # Readers no longer block the writer (and vice versa)
+            "PRAGMA journal_mode=WAL",
+            # In WAL mode NORMAL is still crash-safe; only fsyncs at checkpoints
+            "PRAGMA synchronous=NORMAL",
+            f"PRAGMA mmap_size={SQLITE_MMAP_SIZE_MB * 1024 * 1024}",
+        ]
+    return pragmas
+
+
+def engine_options(url: str, profile: str) -> dict:
+    """Keyword arguments for create_engine / create_async_engine"""
+    if profile not in DATABASE_PROFILES:
+        raise ValueError(f"Unknown DATABASE_PROFILE: {profile} (expected one of {DATABASE_PROFILES})")
+
+    options = {}
+    if _is_sqlite(url):
+        # connect_args is needed only for SQLite to allow multithreading
+        options["connect_args"] = {"check_same_thread": False}
+    if profile == "production" and (_is_sqlite_file(url) or not _is_sqlite(url)):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        if not _is_sqlite(url):
+            # Server connections can be dropped by the server or a proxy while idle
+            options.update(pool_pre_ping=True, pool_recycle=DB_POOL_RECYCLE)
+    return options
+
+
+def _install_pragmas(sync_engine, pragmas):
+    if not pragmas:
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def build_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DATABASE_PROFILE):
+    """Sync engine for startup table creation and the offline scripts"""
+    sync_engine = create_engine(url, **engine_options(url, profile))
+    _install_pragmas(sync_engine, sqlite_pragmas(url, profile))
+    return sync_engine
+
+
+def build_async_engine(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DATABASE_PROFILE):
+    """Async engine for the request handlers (same database as build_engine)"""
+    async_url = to_async_url(url)
+    async_engine = create_async_engine(async_url, **engine_options(url, profile))
+    _install_pragmas(async_engine.sync_engine, sqlite_pragmas(url, profile))
+    return async_engine
+
+
+def build_write_lock(url: str = SQLALCHEMY_DATABASE_URL, profile: str = DATABASE_PROFILE):
+    """
+    In-process lock for write transactions (None when not needed)
+
+    SQLite allows one writer at a time. Writers that collide inside SQLite wait in its busy handler,
+    which sleeps and polls (up to 100ms per try), so under load most of the time goes to sleeping.
+    Queueing write transactions on an asyncio lock hands the write lock over as soon as it is free;
+    busy_timeout then only covers other processes (e.g. the offline scripts).
+    """
+    if profile == "production" and _is_sqlite(url):
+        return asyncio.Lock()
+    return None
+
+
+# Same database, opened through the async driver for the request path
+ASYNC_SQLALCHEMY_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
 
 # Create the SQLAlchemy engine
-# connect_args is needed only for SQLite to allow multithreading
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = build_engine()
+
+# Async engine used by the request handlers so DB I/O never blocks the event loop
+async_engine = build_async_engine()
+
+# Serializes write transactions of the request path (SQLite production profile only)
+async_write_lock = build_write_lock()
 
 # Create a SessionLocal class which will be our actual database session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async session factory (expire_on_commit=False so ORM objects stay usable after commit)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 # Create a Base class for our models to inherit from
 Base = declarative_base()
 
 # Function to create database tables from models
+# and bring existing database files up to date (see migrations.py)
 def create_db_and_tables():
-    Base.metadata.create_all(bind=engine)
+    from migrations import run_migrations
+    run_migrations(engine, Base.metadata)
@@ -3,12 +3,20 @@ from .emotion_manager import EmotionManager
 from .affection_manager import AffectionManager
 from .response_generator import ResponseGenerator
 from .trigger_detector import TriggerDetector
+from .keyword_scanner import KeywordScanner
 from .emotion_analyzer import EmotionAnalyzer
+from .deferred_emotions import DeferredEmotionStore
+from .emotion_cache import EmotionCache
+from .affection_replay import AffectionReplayEngine
 
 __all__ = [
     'EmotionManager',
     'AffectionManager', 
     'ResponseGenerator',
     'TriggerDetector',
-    'EmotionAnalyzer'
+    'KeywordScanner',
+    'EmotionAnalyzer',
+    'DeferredEmotionStore',
+    'EmotionCache',
+    'AffectionReplayEngine'
 ]
\ No newline at end of file
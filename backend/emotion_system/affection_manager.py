@@ -3,10 +3,14 @@
 사용자와 카오루코의 관계 발전을 관리합니다.
 """
 
-from typing import Dict, Tuple, Optional
-from sqlalchemy.orm import Session
+from typing import Dict, List, Tuple, Optional
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, date
 import math
+from database import conflict_insert
+from user_directory import user_directory
 
 # 호감도 단계 정의
 AFFECTION_LEVELS = {
@@ -54,6 +58,13 @@ AFFECTION_LEVELS = {
     }
 }
 
+# 호감도 범위
+MIN_AFFECTION = -100
+MAX_AFFECTION = 100
+
+# compare-and-set 충돌 시 재시도 횟수
+AFFECTION_UPDATE_MAX_RETRIES = 8
+
 # 호감도 변화 트리거
 AFFECTION_TRIGGERS = {
     # 증가 요소
@@ -74,28 +85,52 @@ AFFECTION_TRIGGERS = {
 }
 
 
+def compose_affection_changes(changes: List[int], min_level: int = MIN_AFFECTION,
+                              max_level: int = MAX_AFFECTION) -> Tuple[int, int, int]:
+    """
+    "더한 뒤 범위로 자르기"를 여러 번 적용한 결과를 한 번의 식으로 합칩니다
+    
+    clip(clip(x + a, l, h) + b, L, H) = clip(x + a + b, clip(l + b, L, H), clip(h + b, L, H)) 이므로
+    변화량을 차례로 적용한 결과는 항상 min(high, max(low, x + shift)) 꼴이 됩니다.
+    
+    Returns:
+        (shift, low, high)
+    """
+    shift, low, high = 0, min_level, max_level
+    for change in changes:
+        shift += change
+        low = max(min_level, min(max_level, low + change))
+        high = max(min_level, min(max_level, high + change))
+    return shift, low, high
+
+
 class AffectionManager:
     """호감도를 관리하는 클래스"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession, session_store=None, unit_of_work=None):
         self.db = db
+        # SessionStateStore가 주어지면 호감도를 메모리에서 읽고, 변경은 DB에 바로 쓴 뒤 메모리에도 반영
+        self.session_store = session_store
+        # TurnUnitOfWork가 주어지면 커밋하지 않고 턴 전체와 함께 커밋되도록 맡김
+        self.unit_of_work = unit_of_work
     
-    def get_user_affection(self, user_name: str) -> Tuple[int, str, int]:
+    async def get_user_affection(self, user_name: str) -> Tuple[int, str, int]:
         """
         사용자의 호감도 정보를 가져옵니다
         
         Returns:
             (affection_level, relationship_stage, days_since_first_met)
         """
-        from models import UserAffection
+        if self.session_store is not None:
+            state = await self.session_store.get(user_name)
+            days_since_first_met = (date.today() - state.first_met_date).days
+            return state.affection_level, self.get_relationship_stage(state.affection_level), days_since_first_met
         
-        affection_record = self.db.query(UserAffection).filter(
-            UserAffection.user_name == user_name
-        ).first()
+        affection_record = await self._get_affection_record(user_name)
         
         if not affection_record:
             # 새 사용자인 경우 초기화
-            return self.initialize_user_affection(user_name)
+            return await self.initialize_user_affection(user_name)
         
         # 첫 만남부터 경과일 계산
         days_since_first_met = (date.today() - affection_record.first_met_date).days
@@ -103,23 +138,40 @@ class AffectionManager:
         
         return affection_record.affection_level, relationship_stage, days_since_first_met
     
-    def initialize_user_affection(self, user_name: str) -> Tuple[int, str, int]:
+    async def _get_affection_record(self, user_name: str):
+        """사용자의 UserAffection 레코드를 조회합니다 (없으면 None)"""
+        from models import UserAffection
+        
+        user_id = await user_directory.resolve(self.db, user_name, create=False)
+        if user_id is None:
+            return None
+        result = await self.db.execute(
+            select(UserAffection).filter(UserAffection.user_id == user_id)
+        )
+        return result.scalars().first()
+    
+    async def initialize_user_affection(self, user_name: str) -> Tuple[int, str, int]:
         """새 사용자의 호감도를 초기화합니다"""
         from models import UserAffection
         
         new_affection = UserAffection(
-            user_name=user_name,
+            user_id=await user_directory.resolve(self.db, user_name),
             affection_level=0,  # 0부터 시작
             total_conversations=0,
             first_met_date=date.today()
         )
         
         self.db.add(new_affection)
-        self.db.commit()
+        try:
+            await self.db.commit()
+        except IntegrityError:
+            # 같은 사용자의 첫 대화가 동시에 들어와 다른 요청이 먼저 만든 경우
+            await self.db.rollback()
+            return await self.get_user_affection(user_name)
         
         return 0, "낯선사람", 0
     
-    def update_affection(self, user_name: str, trigger: str, 
+    async def update_affection(self, user_name: str, trigger: str, 
                         multiplier: float = 1.0) -> Tuple[int, int, bool]:
         """
         트리거에 따라 호감도를 업데이트합니다
@@ -127,39 +179,121 @@ class AffectionManager:
         Returns:
             (new_affection_level, affection_change, level_up_occurred)
         """
-        from models import UserAffection, EmotionHistory
+        old_level, new_level, level_up_occurred = await self.apply_triggers(user_name, [(trigger, multiplier)])
+        return new_level, new_level - old_level, level_up_occurred
+    
+    async def apply_triggers(self, user_name: str,
+                             triggers: List[Tuple[str, float]]) -> Tuple[int, int, bool]:
+        """
+        한 턴에 감지된 트리거들을 UPDATE 한 번으로 원자적으로 적용합니다
         
-        current_level, _, _ = self.get_user_affection(user_name)
+        트리거마다 ceil(가중치 × 배수)를 더하고 -100 ~ 100으로 자르는 규칙을 하나의 식으로 합쳐
+        SQL 안에서 계산하며, WHERE에 기대하는 현재 호감도를 함께 걸어(compare-and-set)
+        다른 요청이 먼저 바꾼 경우 최신 값을 다시 읽고 재시도합니다.
+        새 사용자는 레코드를 최종 호감도로 바로 INSERT하고, 트리거가 없으면 UPDATE하지 않습니다.
         
-        # 호감도 변화량 계산
-        base_change = AFFECTION_TRIGGERS.get(trigger, 0)
-        affection_change = math.ceil(base_change * multiplier)
+        Returns:
+            (old_affection_level, new_affection_level, level_up_occurred)
+        """
+        from models import UserAffection
         
-        # 새로운 호감도 계산 (-100 ~ 100 사이로 제한)
-        new_affection_level = max(-100, min(100, current_level + affection_change))
-
-        # 레벨 변화 여부 확인 (증가/감소 모두 감지)
-        old_stage = self.get_relationship_stage(current_level)
-        new_stage = self.get_relationship_stage(new_affection_level)
-        level_up_occurred = (old_stage != new_stage)
-        
-        # 데이터베이스 업데이트
-        affection_record = self.db.query(UserAffection).filter(
-            UserAffection.user_name == user_name
-        ).first()
-        
-        if affection_record:
-            affection_record.affection_level = new_affection_level
-            affection_record.total_conversations += 1
-            affection_record.last_interaction = datetime.now()
+        changes = [math.ceil(AFFECTION_TRIGGERS.get(trigger, 0) * multiplier) for trigger, multiplier in triggers]
+        shift, low, high = compose_affection_changes(changes)
+        affection_table = UserAffection.__table__
+        shifted = affection_table.c.affection_level + shift
+        now = datetime.now()
+        
+        user_id = await user_directory.resolve(self.db, user_name)
+        state = await self.session_store.get(user_name) if self.session_store is not None else None
+        expected = state.affection_level if state is not None and state.affection_persisted else None
+        
+        for _ in range(AFFECTION_UPDATE_MAX_RETRIES):
+            if expected is None:
+                current = await self._read_affection_row(user_name, user_id)
+                if current is None:
+                    # 새 사용자: 0에서 변화량을 적용한 값으로 레코드 생성 (동시에 다른 요청이 만들었으면 다시 시도)
+                    row = (await self.db.execute(
+                        conflict_insert(self.db, affection_table)
+                        .values(
+                            user_id=user_id,
+                            affection_level=max(low, min(high, shift)),
+                            total_conversations=len(changes),
+                            first_met_date=date.today(),
+                            last_interaction=now
+                        )
+                        .on_conflict_do_nothing(index_elements=["user_id"])
+                        .returning(affection_table.c.affection_level, affection_table.c.total_conversations)
+                    )).first()
+                    if row is not None:
+                        old_level = 0
+                        break
+                    continue
+                expected = current.affection_level
+            
+            old_level = expected
+            if not changes:
+                row = None
+                break
             
-            # 호감도 변화 기록은 EmotionAnalyzer에서 처리
-            # emotion_history는 새로운 모델로 EmotionAnalyzer가 담당
-            pass
+            row = (await self.db.execute(
+                update(affection_table)
+                .where(
+                    affection_table.c.user_id == user_id,
+                    affection_table.c.affection_level == expected
+                )
+                .values(
+                    affection_level=case((shifted < low, low), (shifted > high, high), else_=shifted),
+                    total_conversations=func.coalesce(affection_table.c.total_conversations, 0) + len(changes),
+                    last_interaction=now
+                )
+                .returning(affection_table.c.affection_level, affection_table.c.total_conversations)
+            )).first()
+            if row is not None:
+                break
+            # 다른 요청(또는 다른 프로세스)이 먼저 바꿈 → 최신 값으로 다시 시도
+            expected = None
+        else:
+            raise RuntimeError(f"호감도 업데이트 충돌이 계속되어 포기했습니다: {user_name}")
+        
+        new_level = old_level if row is None else row.affection_level
+        
+        if row is not None:
+            if self.unit_of_work is None:
+                await self.db.commit()
+            if state is not None:
+                self._after_commit(lambda: state.set_affection(new_level, row.total_conversations, now))
         
-        self.db.commit()
+        # 레벨 변화 여부 확인 (증가/감소 모두 감지)
+        level_up_occurred = self.get_relationship_stage(old_level) != self.get_relationship_stage(new_level)
         
-        return new_affection_level, affection_change, level_up_occurred
+        return old_level, new_level, level_up_occurred
+    
+    async def _read_affection_row(self, user_name: str, user_id: int):
+        """
+        DB의 현재 호감도 값을 읽고 세션 상태에도 반영합니다 (레코드가 없으면 None)
+        
+        ORM 객체는 세션에 캐시되어 UPDATE 이후에도 옛 값을 돌려주므로 컬럼 값을 직접 읽습니다.
+        """
+        from models import UserAffection
+        
+        row = (await self.db.execute(
+            select(UserAffection.affection_level, UserAffection.total_conversations, UserAffection.last_interaction)
+            .filter(UserAffection.user_id == user_id)
+        )).first()
+        
+        if row is not None and self.session_store is not None:
+            state = await self.session_store.get(user_name)
+            self._after_commit(lambda: state.set_affection(
+                row.affection_level, row.total_conversations or 0, row.last_interaction
+            ))
+        return row
+    
+    def _after_commit(self, callback):
+        """작업 단위가 있으면 커밋 후로 미루고, 없으면 바로 실행합니다 (롤백된 값이 캐시에 남지 않도록)"""
+        if self.unit_of_work is None:
+            callback()
+        else:
+            self.unit_of_work.after_commit(callback)
     
     def get_relationship_stage(self, affection_level: int) -> str:
         """호감도에 따른 관계 단계를 반환합니다"""
@@ -191,20 +325,20 @@ class AffectionManager:
         
         return f"{user_name}{title}"
     
-    def check_daily_bonus(self, user_name: str) -> int:
+    async def check_daily_bonus(self, user_name: str) -> int:
         """일일 보너스 호감도를 확인하고 지급합니다"""
-        from models import UserAffection
-        
-        affection_record = self.db.query(UserAffection).filter(
-            UserAffection.user_name == user_name
-        ).first()
+        if self.session_store is not None:
+            last_interaction = (await self.session_store.get(user_name)).last_interaction
+        else:
+            affection_record = await self._get_affection_record(user_name)
+            last_interaction = affection_record.last_interaction if affection_record else None
         
-        if not affection_record:
+        if not last_interaction:
             return 0
         
         # 마지막 상호작용이 어제 이전인지 확인
-        if affection_record.last_interaction.date() < date.today():
-            return self.update_affection(user_name, "daily_chat")[1]
+        if last_interaction.date() < date.today():
+            return (await self.update_affection(user_name, "daily_chat"))[1]
         
         return 0
     
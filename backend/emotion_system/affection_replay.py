@@ -0,0 +1,116 @@
+"""
+호감도 재계산(리플레이) 엔진
+AFFECTION_TRIGGERS 가중치나 트리거 패턴이 바뀌었을 때, 저장된 대화 기록 전체를 다시 훑어
+update_affection과 같은 규칙(ceil 후 -100 ~ 100 clamp)으로 사용자별 호감도를 다시 계산합니다.
+"""
+
+import math
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .affection_manager import AFFECTION_TRIGGERS, MAX_AFFECTION, MIN_AFFECTION
+from .trigger_detector import DEFAULT_BATCH_CHUNK_SIZE, TriggerDetector
+
+
+class AffectionReplayEngine:
+    """
+    대화 기록으로부터 사용자별 호감도를 다시 계산하는 클래스
+
+    턴마다 감지된 호감도 트리거 하나가 update_affection 호출 한 번에 해당하며,
+    변화량 ceil(가중치 × 배수)를 더한 뒤 매번 범위로 자릅니다. 자르기 때문에 결과가 순서에 의존하므로
+    단순 누적합 대신, 모든 사용자의 i번째 변화를 한 번에 적용하는 벡터 연산을 단계 수만큼 반복합니다.
+
+    대화 길이 보너스(long_conversation)는 실제 대화에서도 적용되지 않으므로(대화 시작 시각 = 현재)
+    리플레이에서도 제외합니다.
+    """
+
+    def __init__(self, triggers: Optional[Dict[str, int]] = None,
+                 min_level: int = MIN_AFFECTION, max_level: int = MAX_AFFECTION):
+        self.triggers = AFFECTION_TRIGGERS if triggers is None else triggers
+        self.min_level = min_level
+        self.max_level = max_level
+        self.detector = TriggerDetector()
+        self._change_cache: Dict[Tuple[str, float], int] = {}
+
+    def affection_changes(self, affection_triggers: List[Tuple[str, float]]) -> List[int]:
+        """감지된 (트리거, 배수) 목록을 update_affection과 같은 방식의 변화량 목록으로 바꿉니다"""
+        changes = []
+        for trigger, multiplier in affection_triggers:
+            change = self._change_cache.get((trigger, multiplier))
+            if change is None:
+                change = math.ceil(self.triggers.get(trigger, 0) * multiplier)
+                self._change_cache[(trigger, multiplier)] = change
+            changes.append(change)
+        return changes
+
+    def replay(self, rows: Iterable[Tuple[str, str]], workers: int = 1,
+               chunk_size: int = DEFAULT_BATCH_CHUNK_SIZE) -> Dict[str, int]:
+        """
+        (사용자 이름, 사용자 메시지) 행들을 시간 순서대로 받아 사용자별 최종 호감도를 계산합니다
+
+        사용자별 순서만 지켜지면 되며, 여러 사용자의 행이 섞여 있어도 됩니다.
+        트리거 감지는 TriggerDetector.analyze_messages로 일괄 처리합니다 (workers > 1이면 프로세스 풀).
+
+        Returns:
+            {user_name: 재계산한 호감도}
+        """
+        # analyze_messages가 앞서 읽어 간 만큼만 사용자 이름을 보관해 결과와 짝지음
+        user_names = deque()
+
+        def messages():
+            for user_name, message in rows:
+                user_names.append(user_name)
+                yield message
+
+        changes_by_user: Dict[str, List[int]] = {}
+        for analysis in self.detector.analyze_messages(messages(), workers, chunk_size):
+            changes = self.affection_changes(analysis["affection_triggers"])
+            changes_by_user.setdefault(user_names.popleft(), []).extend(changes)
+
+        names = list(changes_by_user)
+        lengths = np.fromiter((len(changes_by_user[name]) for name in names), dtype=np.int64, count=len(names))
+        changes = np.fromiter(
+            (change for name in names for change in changes_by_user[name]),
+            dtype=np.int64, count=int(lengths.sum())
+        )
+        levels = self.accumulate(changes, lengths, self.min_level, self.max_level)
+        return dict(zip(names, levels.tolist()))
+
+    @staticmethod
+    def accumulate(changes: np.ndarray, lengths: np.ndarray, min_level: int, max_level: int,
+                   initial: int = 0) -> np.ndarray:
+        """
+        사용자별 변화량 수열에 "더한 뒤 범위로 자르기"를 차례로 적용한 최종값을 구합니다
+
+        Args:
+            changes: 모든 사용자의 변화량을 사용자 순서대로 이어 붙인 1차원 배열
+            lengths: 사용자별 변화량 개수 (changes를 나누는 길이)
+
+        Returns:
+            사용자별 최종 호감도 (lengths와 같은 순서)
+        """
+        count = len(lengths)
+        levels = np.full(count, initial, dtype=np.int64)
+        if count == 0 or not lengths.any():
+            return levels
+
+        offsets = np.zeros(count, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+
+        # 변화량이 많은 사용자부터 정렬하면 step번째 변화가 남아 있는 사용자는 항상 앞쪽 구간이 됨
+        order = np.argsort(-lengths, kind="stable")
+        sorted_lengths = lengths[order]
+        sorted_offsets = offsets[order]
+        sorted_levels = levels[order]
+        # step별 남아 있는 사용자 수 = sorted_lengths > step 인 개수
+        active_counts = np.searchsorted(-sorted_lengths, -np.arange(sorted_lengths[0]), side="left")
+
+        for step, active in enumerate(active_counts.tolist()):
+            current = sorted_levels[:active]
+            current += changes[sorted_offsets[:active] + step]
+            np.clip(current, min_level, max_level, out=current)
+
+        levels[order] = sorted_levels
+        return levels
@@ -0,0 +1,70 @@
+"""
+지연 감정 분석 저장소
+답변을 먼저 돌려준 뒤 백그라운드에서 끝난 감정 분석 결과를 턴 ID별로 보관합니다.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Dict, Optional
+
+
+class DeferredEmotionStore:
+    """턴 ID → 감정 분석 상태(pending/done/failed)를 보관하는 메모리 저장소"""
+    
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._tasks = set()  # 실행 중인 태스크가 GC되지 않도록 참조 유지
+    
+    def submit(self, turn_id: str, analysis: Awaitable[Dict], placeholder: Dict):
+        """감정 분석 코루틴을 백그라운드에서 실행하고 결과를 turn_id로 기록합니다"""
+        self._evict_expired()
+        self._entries[turn_id] = {
+            "status": "pending",
+            "emotion": placeholder,
+            "created_at": time.monotonic()
+        }
+        
+        task = asyncio.ensure_future(self._run(turn_id, analysis))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def _run(self, turn_id: str, analysis: Awaitable[Dict]):
+        try:
+            result = await analysis
+            status = "done"
+        except Exception as e:
+            print(f"지연 감정 분석 오류 ({turn_id}): {e}")
+            result, status = None, "failed"
+        
+        entry = self._entries.get(turn_id)
+        if entry is not None:
+            entry["status"] = status
+            if result is not None:
+                entry["emotion"] = result
+    
+    def get(self, turn_id: str) -> Optional[Dict]:
+        """turn_id의 상태를 반환합니다 (없거나 만료되었으면 None)"""
+        self._evict_expired()
+        entry = self._entries.get(turn_id)
+        if entry is None:
+            return None
+        return {"status": entry["status"], "emotion": entry["emotion"]}
+    
+    async def drain(self, timeout: float = 10.0):
+        """종료 시 진행 중인 분석이 감정 기록을 마칠 때까지 기다립니다"""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+    
+    def _evict_expired(self):
+        """만료되었거나 용량을 넘는 오래된 항목을 정리합니다 (삽입 순서 = 생성 순서)"""
+        now = time.monotonic()
+        while self._entries:
+            turn_id, entry = next(iter(self._entries.items()))
+            expired = now - entry["created_at"] > self.ttl_seconds
+            if not expired and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)
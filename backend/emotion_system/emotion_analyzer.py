@@ -7,8 +7,10 @@ import json
 import re
 from datetime import datetime
 from typing import Dict, List, Tuple, Optional
-from sqlalchemy.orm import Session
-import google.generativeai as genai
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from user_directory import user_directory
+from .keyword_scanner import KeywordScanner
 
 class EmotionAnalyzer:
     """
@@ -56,14 +58,35 @@ class EmotionAnalyzer:
         }
     }
     
-    def __init__(self, db_session: Session, genai_model):
+    # 로컬 키워드 분류 결과를 그대로 쓰기 위한 기본 확신도 기준 (1.0 초과면 항상 LLM 사용)
+    DEFAULT_LOCAL_CONFIDENCE_THRESHOLD = 0.7
+    
+    # 로컬/LLM 분류 카운터 (요청마다 인스턴스가 새로 만들어지므로 클래스 단위로 누적)
+    # shadow_buckets: LLM으로 넘어간 턴에서 로컬 추정이 LLM 라벨과 일치했는지를 확신도 구간별로 기록
+    _classifier_stats = {
+        "local_hits": 0,
+        "llm_escalations": 0,
+        "no_keyword_matches": 0,
+        "shadow_buckets": {}
+    }
+    
+    def __init__(self, db_session: AsyncSession, llm_backend,
+                 local_confidence_threshold: float = DEFAULT_LOCAL_CONFIDENCE_THRESHOLD,
+                 emotion_cache=None, unit_of_work=None, history_writer=None):
         self.db = db_session
-        self.model = genai_model
+        # TurnUnitOfWork가 주어지면 감정 기록을 턴에 등록만 하고 커밋은 턴 전체와 함께
+        self.unit_of_work = unit_of_work
+        # 턴 밖(지연 감정 분석)에서는 HistoryWriter가 있으면 그 큐에 넣어 다른 기록과 모아서 INSERT
+        self.history_writer = history_writer
+        self.llm = llm_backend  # llm_system.LLMBackend
+        self.local_confidence_threshold = local_confidence_threshold
+        self.emotion_cache = emotion_cache  # EmotionCache (없으면 캐시 사용 안 함)
         self.current_emotion = "수줍음"  # 기본 감정
         self.emotion_intensity = 5  # 1-10 강도
         self.emotion_history = []
     
-    def analyze_emotion(self, user_message: str, bot_reply: str, user_name: str) -> Dict:
+    async def analyze_emotion(self, user_message: str, bot_reply: str, user_name: str,
+                              emotion_data: Optional[Dict] = None) -> Dict:
         """
         대화 내용을 분석하여 카오루코의 감정 상태를 추출
         
@@ -71,19 +94,29 @@ class EmotionAnalyzer:
             user_message: 사용자의 메시지
             bot_reply: 카오루코의 답변
             user_name: 사용자 이름
+            emotion_data: 단일 호출 모드에서 답변과 함께 받은 감정 정보
+                          (주어지면 별도의 Gemini 호출을 하지 않음)
             
         Returns:
             감정 분석 결과 딕셔너리
         """
         try:
-            # Gemini API를 이용한 감정 분석
-            emotion_prompt = self._create_emotion_prompt(user_message, bot_reply, user_name)
-            
-            response = self.model.generate_content(emotion_prompt)
-            emotion_data = self._parse_emotion_response(response.text)
+            if emotion_data is None:
+                # 1단계: 답변을 키워드 표로 로컬 채점, 확신도가 충분하면 LLM 호출 생략
+                local_data = self.classify_locally(bot_reply)
+                
+                if local_data and local_data["confidence"] >= self.local_confidence_threshold:
+                    self._classifier_stats["local_hits"] += 1
+                    emotion_data = local_data
+                else:
+                    # 2단계: 애매한 턴만 Gemini API를 이용한 감정 분석 (같은 입력 쌍은 캐시 사용)
+                    emotion_data = await self._analyze_with_llm(user_message, bot_reply, user_name)
+                    self._record_escalation(local_data, emotion_data)
+            else:
+                emotion_data = self._normalize_emotion_data(dict(emotion_data))
             
             # 감정 히스토리에 저장
-            self._save_emotion_history(user_name, emotion_data)
+            await self._save_emotion_history(user_name, emotion_data)
             
             # 현재 감정 상태 업데이트
             self.current_emotion = emotion_data.get("emotion", "수줍음")
@@ -102,6 +135,86 @@ class EmotionAnalyzer:
             print(f"감정 분석 오류: {e}")
             return self._get_default_emotion()
     
+    def classify_locally(self, bot_reply: str) -> Optional[Dict]:
+        """
+        EMOTIONS의 keywords로 답변을 채점하는 로컬 분류기
+        
+        확신도 = (최다 감정의 적중 비율) × (1 - 0.5^적중수)
+        예) 한 감정만 2번 적중 → 0.75, 두 감정이 1번씩 적중 → 0.25
+        적중은 LOCAL_KEYWORD_SCANNER로 겹치지 않게 셉니다 ("화나요"는 "화나" 한 번).
+        
+        Returns:
+            감정 정보 딕셔너리 (적중 키워드가 없으면 None)
+        """
+        scores = {emotion: count for emotion, count in LOCAL_KEYWORD_SCANNER.scan(bot_reply).items() if count}
+        if not scores:
+            return None
+        
+        best_emotion = max(scores, key=scores.get)
+        best_count = scores[best_emotion]
+        share = best_count / sum(scores.values())
+        confidence = round(share * (1 - 0.5 ** best_count), 3)
+        matched = [keyword for keyword in LOCAL_KEYWORDS[best_emotion] if keyword in bot_reply]
+        
+        return {
+            "emotion": best_emotion,
+            "intensity": min(10, 4 + best_count * 2),
+            "reason": f"키워드 매칭: {', '.join(matched)}",
+            "confidence": confidence
+        }
+    
+    async def _analyze_with_llm(self, user_message: str, bot_reply: str, user_name: str) -> Dict:
+        """LLM 감정 분석 (정규화한 입력 쌍이 캐시에 있으면 호출 생략)"""
+        cache_key = None
+        if self.emotion_cache is not None:
+            cache_key = self.emotion_cache.make_key(user_message, bot_reply)
+            cached = self.emotion_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        emotion_prompt = self._create_emotion_prompt(user_message, bot_reply, user_name)
+        
+        response_text = await self.llm.generate_async(emotion_prompt)
+        emotion_data = self._parse_emotion_response(response_text)
+        
+        # 파싱 실패로 나온 기본값은 캐시하지 않음
+        if cache_key is not None and emotion_data.get("reason") != "기본 감정":
+            self.emotion_cache.set(cache_key, emotion_data)
+        
+        return emotion_data
+    
+    def _record_escalation(self, local_data: Optional[Dict], llm_data: Dict):
+        """LLM으로 넘어간 턴을 기록하고, 로컬 추정과 LLM 라벨의 일치 여부를 확신도 구간별로 집계"""
+        stats = self._classifier_stats
+        stats["llm_escalations"] += 1
+        
+        if local_data is None:
+            stats["no_keyword_matches"] += 1
+            return
+        
+        lower = min(int(local_data["confidence"] * 10), 9) / 10
+        bucket = stats["shadow_buckets"].setdefault(f"{lower:.1f}-{lower + 0.1:.1f}", {"agree": 0, "total": 0})
+        bucket["total"] += 1
+        if local_data["emotion"] == llm_data.get("emotion"):
+            bucket["agree"] += 1
+    
+    @classmethod
+    def get_classifier_stats(cls) -> Dict:
+        """로컬 분류기 적중/LLM 위임 카운터와 확신도 구간별 LLM 라벨 일치율을 반환"""
+        stats = cls._classifier_stats
+        total = stats["local_hits"] + stats["llm_escalations"]
+        
+        return {
+            "local_hits": stats["local_hits"],
+            "llm_escalations": stats["llm_escalations"],
+            "no_keyword_matches": stats["no_keyword_matches"],
+            "local_hit_rate": round(stats["local_hits"] / total, 3) if total else 0.0,
+            "shadow_agreement": {
+                bucket: {**counts, "rate": round(counts["agree"] / counts["total"], 3)}
+                for bucket, counts in sorted(stats["shadow_buckets"].items())
+            }
+        }
+    
     def _create_emotion_prompt(self, user_message: str, bot_reply: str, user_name: str) -> str:
         """감정 분석을 위한 프롬프트 생성"""
         
@@ -137,17 +250,9 @@ class EmotionAnalyzer:
             if json_match:
                 json_str = json_match.group()
                 emotion_data = json.loads(json_str)
-                
-                # 유효성 검사
-                if emotion_data.get("emotion") not in self.EMOTIONS:
-                    emotion_data["emotion"] = "수줍음"
-                
-                emotion_data["intensity"] = max(1, min(10, emotion_data.get("intensity", 5)))
-                emotion_data["confidence"] = max(0.0, min(1.0, emotion_data.get("confidence", 0.8)))
-                
-                return emotion_data
+                return self._normalize_emotion_data(emotion_data)
             
-        except (json.JSONDecodeError, AttributeError) as e:
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
             print(f"감정 파싱 오류: {e}")
         
         # 기본값 반환
@@ -158,22 +263,87 @@ class EmotionAnalyzer:
             "confidence": 0.5
         }
     
-    def _save_emotion_history(self, user_name: str, emotion_data: Dict):
+    def _normalize_emotion_data(self, emotion_data: Dict) -> Dict:
+        """감정 정보의 유효성을 검사하고 범위를 보정"""
+        if emotion_data.get("emotion") not in self.EMOTIONS:
+            emotion_data["emotion"] = "수줍음"
+        
+        emotion_data["intensity"] = max(1, min(10, int(emotion_data.get("intensity", 5))))
+        emotion_data["confidence"] = max(0.0, min(1.0, float(emotion_data.get("confidence", 0.8))))
+        
+        return emotion_data
+    
+    @classmethod
+    def create_structured_reply_instructions(cls) -> str:
+        """
+        단일 호출 모드용 지시문
+        본 답변 프롬프트 뒤에 붙여 답변과 감정 정보를 한 번의 JSON 응답으로 받습니다.
+        """
+        emotions_list = ", ".join([f"{name}({data['emoji']})" for name, data in cls.EMOTIONS.items()])
+        
+        return f"""
+
+답변과 함께, 그 답변을 할 때 카오루코의 감정을 다음 6가지 중에서 골라주세요:
+{emotions_list}
+
+다음 JSON 형식으로만 답변해주세요:
+{{
+    "reply": "카오루코로서의 답변",
+    "emotion": "감정이름",
+    "intensity": 강도(1-10),
+    "reason": "감정선택이유",
+    "confidence": 확신도(0.0-1.0)
+}}
+"""
+    
+    @classmethod
+    def parse_structured_reply(cls, response_text: str) -> Tuple[str, Optional[Dict]]:
+        """
+        단일 호출 모드 응답에서 (답변, 감정 정보)를 분리
+        
+        JSON이 아니거나 reply가 없으면 (원문, None)을 반환하며,
+        이 경우 analyze_emotion이 기존처럼 별도 호출로 감정을 분석합니다.
+        """
+        try:
+            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+            if json_match:
+                data = json.loads(json_match.group())
+                reply = data.get("reply")
+                if isinstance(reply, str) and reply.strip():
+                    emotion_data = {
+                        key: data[key]
+                        for key in ("emotion", "intensity", "reason", "confidence")
+                        if key in data
+                    }
+                    return reply, (emotion_data if "emotion" in emotion_data else None)
+        
+        except (json.JSONDecodeError, AttributeError) as e:
+            print(f"구조화 응답 파싱 오류: {e}")
+        
+        return response_text, None
+    
+    async def _save_emotion_history(self, user_name: str, emotion_data: Dict):
         """감정 히스토리를 데이터베이스에 저장"""
         try:
             from models import EmotionHistory
             
-            emotion_entry = EmotionHistory(
-                user_name=user_name,
-                emotion=emotion_data["emotion"],
-                intensity=emotion_data["intensity"],
-                reason=emotion_data.get("reason", ""),
-                confidence=emotion_data.get("confidence", 0.8),
-                timestamp=datetime.now()
-            )
+            row = {
+                "user_id": await user_directory.resolve(self.db, user_name),
+                "emotion": emotion_data["emotion"],
+                "intensity": emotion_data["intensity"],
+                "reason": emotion_data.get("reason", ""),
+                "confidence": emotion_data.get("confidence", 0.8),
+                "timestamp": datetime.now()
+            }
             
-            self.db.add(emotion_entry)
-            self.db.commit()
+            if self.unit_of_work is not None:
+                self.unit_of_work.append(EmotionHistory, row)
+            elif self.history_writer is not None:
+                await self.history_writer.wait_for_room()
+                self.history_writer.append(EmotionHistory, row)
+            else:
+                self.db.add(EmotionHistory(**row))
+                await self.db.commit()
             
             # 메모리에도 저장 (최근 10개만)
             self.emotion_history.append({
@@ -199,19 +369,30 @@ class EmotionAnalyzer:
             "confidence": 0.5
         }
     
-    def get_emotion_stats(self, user_name: str) -> Dict:
-        """사용자별 감정 통계 반환"""
+    @staticmethod
+    def emotion_stats_query(user_id: int):
+        """사용자의 감정별 통계 조회 (emotion_stats 롤업, 감정 종류 수만큼의 행)"""
+        from models import EmotionStats
+        
+        return (
+            select(EmotionStats.emotion, EmotionStats.emotion_count, EmotionStats.intensity_sum)
+            .filter(EmotionStats.user_id == user_id)
+        )
+    
+    async def get_emotion_stats(self, user_name: str) -> Dict:
+        """사용자별 감정 통계 반환 (emotion_history 전체를 집계하지 않고 롤업 테이블에서 읽음)"""
+        from models import require_sqlite
+        
+        require_sqlite(self.db.get_bind(), "감정 통계")
         try:
-            from models import EmotionHistory
-            from sqlalchemy import func
+            user_id = await user_directory.resolve(self.db, user_name, create=False)
+            if user_id is None:
+                return {"dominant_emotion": "수줍음", "emotion_distribution": {}}
             
-            # 최근 감정 분포 계산
-            recent_emotions = self.db.query(EmotionHistory.emotion, func.count(EmotionHistory.emotion)) \
-                .filter(EmotionHistory.user_name == user_name) \
-                .group_by(EmotionHistory.emotion) \
-                .all()
+            result = await self.db.execute(self.emotion_stats_query(user_id))
+            rows = [(emotion, count, intensity_sum) for emotion, count, intensity_sum in result.all() if count]
             
-            emotion_counts = {emotion: count for emotion, count in recent_emotions}
+            emotion_counts = {emotion: count for emotion, count, _ in rows}
             total_count = sum(emotion_counts.values())
             
             if total_count == 0:
@@ -229,6 +410,9 @@ class EmotionAnalyzer:
             return {
                 "dominant_emotion": dominant_emotion,
                 "emotion_distribution": emotion_distribution,
+                "average_intensity": {
+                    emotion: round(intensity_sum / count, 1) for emotion, count, intensity_sum in rows
+                },
                 "total_interactions": total_count
             }
             
@@ -236,6 +420,50 @@ class EmotionAnalyzer:
             print(f"감정 통계 오류: {e}")
             return {"dominant_emotion": "수줍음", "emotion_distribution": {}}
     
+    @staticmethod
+    def last_emotion_query(user_id: int):
+        """사용자의 가장 최근 감정 기록 조회 (ix_emotion_history_user_id_timestamp 사용)"""
+        from models import EmotionHistory
+        
+        return (
+            select(EmotionHistory)
+            .filter(EmotionHistory.user_id == user_id)
+            .order_by(EmotionHistory.timestamp.desc(), EmotionHistory.id.desc())
+            .limit(1)
+        )
+    
+    async def get_last_emotion(self, user_name: str) -> Dict:
+        """가장 최근에 기록된 감정 상태를 반환 (기록이 없으면 기본 감정)"""
+        try:
+            user_id = await user_directory.resolve(self.db, user_name, create=False)
+            result = await self.db.execute(self.last_emotion_query(user_id))
+            last_entry = result.scalars().first()
+            
+            if last_entry and last_entry.emotion in self.EMOTIONS:
+                return self.build_emotion_result(
+                    last_entry.emotion, last_entry.intensity, last_entry.reason or "", last_entry.confidence
+                )
+        
+        except Exception as e:
+            print(f"최근 감정 조회 오류: {e}")
+        
+        return self._get_default_emotion()
+    
+    @classmethod
+    def build_emotion_result(cls, emotion: str, intensity: int, reason: str = "",
+                             confidence: float = 0.8) -> Dict:
+        """감정 이름과 강도로 analyze_emotion과 같은 형태의 결과를 만듭니다"""
+        if emotion not in cls.EMOTIONS:
+            emotion = "수줍음"
+        return {
+            "emotion": emotion,
+            "intensity": intensity,
+            "emoji": cls.EMOTIONS[emotion]["emoji"],
+            "color": cls.EMOTIONS[emotion]["color"],
+            "reason": reason,
+            "confidence": confidence
+        }
+    
     def get_current_emotion(self) -> Dict:
         """현재 감정 상태 반환"""
         return {
@@ -244,4 +472,15 @@ class EmotionAnalyzer:
             "emoji": self.EMOTIONS[self.current_emotion]["emoji"],
             "color": self.EMOTIONS[self.current_emotion]["color"],
             "description": self.EMOTIONS[self.current_emotion]["description"]
-        }
\ No newline at end of file
+        }
+
+
+# 로컬 분류기가 세는 키워드 (감정별, 긴 키워드 우선)
+# 한 글자 키워드("화", "와", "울", "웃", "좋")는 영화/대화/와주셔서/서울/겨울처럼 평범한 단어 안에 흔히 들어 있어
+# 로컬 판정에 쓰지 않습니다 (그런 답변은 LLM 분석으로 넘어감).
+# 같은 위치에서는 먼저 적힌 키워드가 골라지므로 길이 순으로 정렬해 "화나요"가 "화나" 한 번으로 세어지게 합니다.
+LOCAL_KEYWORDS = {
+    emotion: sorted((keyword for keyword in data["keywords"] if len(keyword) >= 2), key=len, reverse=True)
+    for emotion, data in EmotionAnalyzer.EMOTIONS.items()
+}
+LOCAL_KEYWORD_SCANNER = KeywordScanner(LOCAL_KEYWORDS)
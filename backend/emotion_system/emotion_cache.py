@@ -0,0 +1,120 @@
+"""
+감정 분석 결과 캐시
+같은 (사용자 메시지, 카오루코 답변) 쌍은 재시도/인사/고정 답변으로 자주 반복되므로
+LLM 감정 분석 결과를 크기·시간 제한이 있는 LRU 캐시에 보관합니다.
+"""
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class EmotionCache:
+    """크기(LRU)와 시간(TTL) 기준으로 만료되는 감정 분석 캐시"""
+    
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (cached_at, emotion_data)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def _normalize(text: str) -> str:
+        """공백/대소문자/반복 문장부호 차이를 없앱니다 ("안녕!!  " → "안녕!")"""
+        text = " ".join(text.split()).lower()
+        return re.sub(r"([!?.~…])\1+", r"\1", text)
+    
+    @classmethod
+    def make_key(cls, user_message: str, bot_reply: str) -> str:
+        """정규화한 입력 쌍의 해시 키"""
+        raw = f"{cls._normalize(user_message)}\x1f{cls._normalize(bot_reply)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        cached_at, emotion_data = entry
+        if time.time() - cached_at > self.ttl_seconds:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(emotion_data)
+    
+    def set(self, key: str, emotion_data: Dict, cached_at: Optional[float] = None):
+        self._entries[key] = (cached_at or time.time(), dict(emotion_data))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+    
+    # --- 재시작 간 유지 (SQLite) ---
+    
+    async def load(self, db: AsyncSession) -> int:
+        """저장된 항목 중 만료되지 않은 것을 오래된 순으로 불러옵니다"""
+        from models import EmotionCacheEntry
+        
+        cutoff = time.time() - self.ttl_seconds
+        result = await db.execute(
+            select(EmotionCacheEntry)
+            .filter(EmotionCacheEntry.cached_at >= cutoff)
+            .order_by(EmotionCacheEntry.cached_at)
+        )
+        loaded = 0
+        for row in result.scalars():
+            self.set(row.cache_key, {
+                "emotion": row.emotion,
+                "intensity": row.intensity,
+                "reason": row.reason or "",
+                "confidence": row.confidence
+            }, cached_at=row.cached_at)
+            loaded += 1
+        return loaded
+    
+    async def save(self, db: AsyncSession) -> int:
+        """현재 캐시 내용으로 저장 테이블을 교체합니다"""
+        from models import EmotionCacheEntry
+        
+        now = time.time()
+        await db.execute(delete(EmotionCacheEntry))
+        db.add_all([
+            EmotionCacheEntry(
+                cache_key=key,
+                emotion=data["emotion"],
+                intensity=data["intensity"],
+                reason=data.get("reason", ""),
+                confidence=data.get("confidence", 0.8),
+                cached_at=cached_at
+            )
+            for key, (cached_at, data) in self._entries.items()
+            if now - cached_at <= self.ttl_seconds
+        ])
+        await db.commit()
+        return len(self._entries)
@@ -6,6 +6,7 @@
 from typing import Dict, Tuple, Optional
 from sqlalchemy.orm import Session
 from datetime import datetime
+from user_directory import user_directory
 
 # 감정 정의 및 설정
 EMOTIONS = {
@@ -81,7 +82,7 @@ class EmotionManager:
         from models import UserEmotion
         
         emotion_record = self.db.query(UserEmotion).filter(
-            UserEmotion.user_name == user_name
+            UserEmotion.user_id == user_directory.resolve_sync(self.db, user_name, create=False)
         ).first()
         
         if not emotion_record:
@@ -95,7 +96,7 @@ class EmotionManager:
         from models import UserEmotion
         
         new_emotion = UserEmotion(
-            user_name=user_name,
+            user_id=user_directory.resolve_sync(self.db, user_name),
             current_emotion="수줍음",  # 첫 만남은 수줍음으로 시작
             emotion_intensity=0.5
         )
@@ -126,7 +127,7 @@ class EmotionManager:
         
         # 데이터베이스 업데이트
         emotion_record = self.db.query(UserEmotion).filter(
-            UserEmotion.user_name == user_name
+            UserEmotion.user_id == user_directory.resolve_sync(self.db, user_name, create=False)
         ).first()
         
         if emotion_record:
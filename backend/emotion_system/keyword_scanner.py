@@ -0,0 +1,97 @@
+"""
+키워드 스캐너
+여러 카테고리의 키워드를 Aho-Corasick 오토마톤 하나로 묶어 메시지를 한 번만 훑습니다.
+패턴 수와 관계없이 메시지 길이에 비례하는 시간으로 카테고리별 적중 횟수를 셉니다.
+"""
+
+from collections import deque
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+
+class KeywordScanner:
+    """
+    카테고리별 키워드 목록을 한 번에 매칭하는 스캐너
+
+    카테고리 하나는 정규식 "키워드1|키워드2|..." 와 같게 취급합니다.
+    즉 scan()이 돌려주는 횟수는 re.findall(카테고리 패턴, text)의 결과 개수와 같습니다
+    (가장 왼쪽 매치 우선, 같은 위치에서는 먼저 적힌 키워드 우선, 겹치는 매치는 세지 않음).
+
+    오토마톤은 뒤집은 키워드로 만들고 메시지를 뒤에서부터 훑습니다. 그러면 각 상태의 출력이
+    "이 위치에서 시작하는 키워드들"이 되어, 시작 위치 순서로 정규식의 선택 규칙을 그대로 적용할 수 있습니다.
+    """
+
+    def __init__(self, categories: Dict[Hashable, Sequence[str]]):
+        self.categories = list(categories)
+
+        # 트라이: 상태별 전이와 실패 링크, 그 상태에서 끝나는 (뒤집은) 키워드의 (카테고리 번호, 순서, 길이)
+        goto: List[Dict[str, int]] = [{}]
+        matches: List[List[Tuple[int, int, int]]] = [[]]
+        for category_index, category in enumerate(self.categories):
+            for keyword_index, keyword in enumerate(categories[category]):
+                if not keyword:
+                    continue
+                state = 0
+                for char in reversed(keyword):
+                    if char not in goto[state]:
+                        goto[state][char] = len(goto)
+                        goto.append({})
+                        matches.append([])
+                    state = goto[state][char]
+                matches[state].append((category_index, keyword_index, len(keyword)))
+
+        # 실패 링크를 미리 풀어 둔 전이표(DFA): 문자 하나당 사전 조회 한 번으로 다음 상태가 정해짐
+        # (표에 없는 문자는 루트로 돌아감)
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [{} for _ in goto[1:]]
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                if state:
+                    fail[next_state] = delta[fail[state]].get(char, 0)
+                # 실패 링크 쪽(더 짧은 접두사 키워드)의 매치도 이 상태에서 함께 적중
+                matches[next_state] = matches[next_state] + matches[fail[next_state]]
+            # 너비 우선 순서라 실패 링크 대상의 전이표는 이미 완성되어 있음
+            if state:
+                delta[state] = {**delta[fail[state]], **goto[state]}
+
+        # 상태마다 카테고리별로 정규식이 고를 키워드(가장 먼저 적힌 것)의 길이만 남김
+        self._emits: List[Tuple[Tuple[int, int], ...]] = []
+        for state_matches in matches:
+            chosen: Dict[int, Tuple[int, int]] = {}
+            for category_index, keyword_index, length in state_matches:
+                current = chosen.get(category_index)
+                if current is None or keyword_index < current[0]:
+                    chosen[category_index] = (keyword_index, length)
+            self._emits.append(tuple((category_index, length) for category_index, (_, length) in chosen.items()))
+
+        self._delta = delta
+
+    def scan(self, text: str) -> Dict[Hashable, int]:
+        """
+        text를 한 번 훑어 카테고리별 적중 횟수를 반환합니다
+
+        Returns:
+            {카테고리: 적중 횟수} (적중이 없는 카테고리도 0으로 포함)
+        """
+        delta, emits = self._delta, self._emits
+
+        # 뒤에서부터 훑으며 키워드가 시작되는 위치의 상태만 모음
+        hits = []
+        state = 0
+        last = len(text) - 1
+        for offset, char in enumerate(reversed(text)):
+            state = delta[state].get(char, 0)
+            if emits[state]:
+                hits.append((last - offset, state))
+
+        # 시작 위치 오름차순으로 카테고리별 겹침 제외 (정규식 findall과 같은 규칙)
+        counts = [0] * len(self.categories)
+        next_free = [0] * len(self.categories)
+        for start, hit_state in reversed(hits):
+            for category_index, length in emits[hit_state]:
+                if start >= next_free[category_index]:
+                    counts[category_index] += 1
+                    next_free[category_index] = start + length
+        return dict(zip(self.categories, counts))
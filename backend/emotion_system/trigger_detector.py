@@ -3,97 +3,109 @@
 사용자의 메시지를 분석해서 감정과 호감도 변화 트리거를 감지합니다.
 """
 
-import re
-from typing import List, Dict, Tuple, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
 from datetime import datetime, timedelta
 
+from .keyword_scanner import KeywordScanner
+
+# analyze_messages가 한 번에 처리(또는 워커에 전달)하는 메시지 수
+DEFAULT_BATCH_CHUNK_SIZE = 2000
+
 
 class TriggerDetector:
     """사용자 메시지에서 감정/호감도 트리거를 감지하는 클래스"""
     
-    def __init__(self):
-        self.setup_patterns()
+    # 감정 트리거 패턴
+    emotion_patterns = {
+        "수줍음": [
+            r"부끄러|수줍|부끄|숨고싶|얼굴이빨개|부끄러워",
+            r"창피|민망|부끄러움"
+        ],
+        "기쁨": [
+            r"기쁘|좋아|행복|즐거|신나|웃음|하하|히히|ㅋㅋ|ㅎㅎ",
+            r"최고|완전|대박|굉장|좋네|멋지|예뻐|사랑해"
+        ],
+        "슬픔": [
+            r"슬프|우울|눈물|울|힘들|외로|아프|상처|속상|마음이",
+            r"ㅠㅠ|ㅜㅜ|흑흑|안좋|걱정"
+        ],
+        "화남": [
+            r"화나|짜증|분노|열받|빡치|뭐야|이상해|싫어|최악|별로",
+            r"그만|하지마|안해|기분나쁘"
+        ],
+        "놀람": [
+            r"어|헉|와|우와|대박|놀라|진짜|정말|어떻게|믿을수없|신기|wow",
+            r"어머|깜짝|놀랐"
+        ],
+        "설렘": [
+            r"설레|두근|심장|떨려|기대|멋져|예뻐|좋아해|사랑|로맨틱",
+            r"달콤|따뜻|포근|특별|소중"
+        ]
+    }
     
-    def setup_patterns(self):
-        """감지 패턴들을 초기화합니다"""
-        
-        # 감정 트리거 패턴
-        self.emotion_patterns = {
-            "수줍음": [
-                r"부끄러|수줍|부끄|숨고싶|얼굴이빨개|부끄러워",
-                r"창피|민망|부끄러움"
-            ],
-            "기쁨": [
-                r"기쁘|좋아|행복|즐거|신나|웃음|하하|히히|ㅋㅋ|ㅎㅎ",
-                r"최고|완전|대박|굉장|좋네|멋지|예뻐|사랑해"
-            ],
-            "슬픔": [
-                r"슬프|우울|눈물|울|힘들|외로|아프|상처|속상|마음이",
-                r"ㅠㅠ|ㅜㅜ|흑흑|안좋|걱정"
-            ],
-            "화남": [
-                r"화나|짜증|분노|열받|빡치|뭐야|이상해|싫어|최악|별로",
-                r"그만|하지마|안해|기분나쁘"
-            ],
-            "놀람": [
-                r"어|헉|와|우와|대박|놀라|진짜|정말|어떻게|믿을수없|신기|wow",
-                r"어머|깜짝|놀랐"
-            ],
-            "설렘": [
-                r"설레|두근|심장|떨려|기대|멋져|예뻐|좋아해|사랑|로맨틱",
-                r"달콤|따뜻|포근|특별|소중"
-            ]
-        }
-        
-        # 호감도 증가 트리거 패턴
-        self.positive_affection_patterns = {
-            "compliment": [
-                r"예뻐|이쁘|귀여|멋져|좋아|사랑해|완벽|최고|대단|훌륭",
-                r"멋있|아름다|매력|특별|소중|따뜻|친절|착해"
-            ],
-            "remember_details": [
-                r"기억|생각|알아|저번에|전에 말한|말했던|얘기했던",
-                r"카오루코|와구리|17살|고등학생|다도부"
-            ],
-            "romantic_gesture": [
-                r"사랑|데이트|만나|보고싶|그리워|함께|같이|키스|포옹|안아",
-                r"선물|꽃|반지|목걸이|편지"
-            ],
-            "gift_mention": [
-                r"선물|줄게|사줄|받아|드릴|가져다|챙겨|준비했",
-                r"꽃|케이크|초콜릿|반지|목걸이|인형|책"
-            ],
-            "daily_chat": [
-                r"안녕|좋은아침|잠깐|하루|오늘|어떻게|지내|인사",
-                r"일어났어|자러가|굿나잇|잘자|또봐"
-            ]
-        }
-        
-        # 호감도 감소 트리거 패턴
-        self.negative_affection_patterns = {
-            "rude_behavior": [
-                r"바보|멍청|짜증|꺼져|닥쳐|시끄러|죽어|미워|싫어|최악",
-                r"못생|더러|추해|별로|그만|하지마"
-            ],
-            "inappropriate_content": [
-                r"섹스|야동|19금|음란|변태|몸|가슴|다리|속옷",
-                r"벗어|만져|키스해|자자|침대|모텔"
-            ],
-            "harsh_words": [
-                r"실망|화나|짜증나|상처|아프게|슬프게|기분나쁘",
-                r"왜그래|이상해|문제|틀렸|잘못"
-            ]
-        }
-        
-        # 특수 상황 패턴
-        self.special_patterns = {
-            "long_conversation": None,  # 시간 기반으로 판단
-            "ignore_long_time": None,   # 마지막 대화 시간 기반
-            "special_occasion": [
-                r"생일|크리스마스|발렌타인|화이트데이|새해|졸업|입학|시험",
-                r"축하|기념일|특별한날|중요한날"
-            ]
-        }
+    # 호감도 증가 트리거 패턴
+    positive_affection_patterns = {
+        "compliment": [
+            r"예뻐|이쁘|귀여|멋져|좋아|사랑해|완벽|최고|대단|훌륭",
+            r"멋있|아름다|매력|특별|소중|따뜻|친절|착해"
+        ],
+        "remember_details": [
+            r"기억|생각|알아|저번에|전에 말한|말했던|얘기했던",
+            r"카오루코|와구리|17살|고등학생|다도부"
+        ],
+        "romantic_gesture": [
+            r"사랑|데이트|만나|보고싶|그리워|함께|같이|키스|포옹|안아",
+            r"선물|꽃|반지|목걸이|편지"
+        ],
+        "gift_mention": [
+            r"선물|줄게|사줄|받아|드릴|가져다|챙겨|준비했",
+            r"꽃|케이크|초콜릿|반지|목걸이|인형|책"
+        ],
+        "daily_chat": [
+            r"안녕|좋은아침|잠깐|하루|오늘|어떻게|지내|인사",
+            r"일어났어|자러가|굿나잇|잘자|또봐"
+        ]
+    }
+    
+    # 호감도 감소 트리거 패턴
+    negative_affection_patterns = {
+        "rude_behavior": [
+            r"바보|멍청|짜증|꺼져|닥쳐|시끄러|죽어|미워|싫어|최악",
+            r"못생|더러|추해|별로|그만|하지마"
+        ],
+        "inappropriate_content": [
+            r"섹스|야동|19금|음란|변태|몸|가슴|다리|속옷",
+            r"벗어|만져|키스해|자자|침대|모텔"
+        ],
+        "harsh_words": [
+            r"실망|화나|짜증나|상처|아프게|슬프게|기분나쁘",
+            r"왜그래|이상해|문제|틀렸|잘못"
+        ]
+    }
+    
+    # 특수 상황 패턴
+    special_patterns = {
+        "long_conversation": None,  # 시간 기반으로 판단
+        "ignore_long_time": None,   # 마지막 대화 시간 기반
+        "special_occasion": [
+            r"생일|크리스마스|발렌타인|화이트데이|새해|졸업|입학|시험",
+            r"축하|기념일|특별한날|중요한날"
+        ]
+    }
+    
+    # 배수/상황 판단용 표현 (부분 문자열 포함 여부로 판단)
+    modifier_words = {
+        "joy_boost": ["정말", "너무", "완전"],
+        "sadness_boost": ["많이", "너무", "정말"],
+        "emphasis": ["정말", "너무", "완전", "진짜"],
+        "softener": ["좀", "조금", "약간"],
+        "first_meeting": ["처음", "첫", "안녕하세요", "반가워"],
+        "goodbye": ["안녕", "잘가", "나중에", "또봐", "굿바이"],
+        "question": ["?", "？", "뭐", "어떻게", "왜", "언제", "어디"]
+    }
     
     def analyze_message(self, message: str, user_name: str, 
                        conversation_start_time: datetime, 
@@ -110,54 +122,112 @@ class TriggerDetector:
             }
         """
         
-        result = {
-            "emotion_triggers": [],
-            "affection_triggers": [],
-            "conversation_length": 0,
-            "special_context": {}
-        }
-        
-        message_lower = message.lower()
-        
-        # 1. 감정 트리거 분석
-        result["emotion_triggers"] = self._detect_emotion_triggers(message_lower)
+        result = self.analyze_text(message)
         
-        # 2. 호감도 트리거 분석
-        result["affection_triggers"] = self._detect_affection_triggers(message_lower)
-        
-        # 3. 대화 길이 계산
+        # 대화 길이 계산
         result["conversation_length"] = self._calculate_conversation_length(
             conversation_start_time
         )
         
-        # 4. 장기간 무시 체크
+        # 장기간 무시 체크
         if last_interaction_time:
             result["ignore_duration"] = self._check_ignore_duration(last_interaction_time)
         
-        # 5. 특별한 상황 체크
-        result["special_context"] = self._detect_special_context(message_lower)
-        
         return result
     
-    def _detect_emotion_triggers(self, message: str) -> List[Tuple[str, float]]:
+    def analyze_text(self, message: str) -> Dict:
+        """
+        메시지 내용만으로 정해지는 트리거들을 찾습니다 (시간 정보 불필요)
+        
+        Returns:
+            {
+                "emotion_triggers": [("emotion_name", confidence), ...],
+                "affection_triggers": [("trigger_name", multiplier), ...],
+                "special_context": {...},
+                "keyword_hits": {...}
+            }
+        """
+        message_lower = message.lower()
+        
+        # 모든 패턴을 한 번의 스캔으로 카테고리별 적중 횟수로 집계
+        keyword_hits = self.scan_keywords(message_lower)
+        
+        return {
+            # 1. 감정 트리거 분석
+            "emotion_triggers": self._detect_emotion_triggers(keyword_hits),
+            # 2. 호감도 트리거 분석
+            "affection_triggers": self._detect_affection_triggers(keyword_hits),
+            # 3. 특별한 상황 체크
+            "special_context": self._detect_special_context(keyword_hits),
+            "keyword_hits": keyword_hits
+        }
+    
+    def analyze_messages(self, messages: Iterable[str], workers: int = 1,
+                         chunk_size: int = DEFAULT_BATCH_CHUNK_SIZE) -> Iterator[Dict]:
+        """
+        여러 메시지를 일괄 분석해 입력 순서대로 결과를 흘려보냅니다 (패턴 변경 후 재채점용)
+        
+        messages는 chunk_size개씩 끊어 처리하므로 전체를 메모리에 올리지 않습니다.
+        workers가 2 이상이면 청크를 프로세스 풀에 나눠 보내며, 동시에 처리 중인 청크는
+        workers * 2개로 제한해 결과를 읽는 속도보다 앞서 나가지 않게 합니다.
+        
+        Yields:
+            메시지마다 analyze_text()의 결과
+        """
+        chunks = _chunked(messages, chunk_size)
+        
+        if workers <= 1:
+            for chunk in chunks:
+                yield from _analyze_chunk(chunk)
+            return
+        
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(_analyze_chunk, chunk))
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            # 소비자가 중간에 멈춰도 남은 청크는 버리고 워커를 정리
+            executor.shutdown(cancel_futures=True)
+    
+    def scan_keywords(self, message: str) -> Dict[str, Dict[str, int]]:
+        """
+        컴파일된 스캐너로 메시지를 한 번 훑어 카테고리별 적중 횟수를 반환합니다
+        
+        적중 횟수는 패턴 줄마다 re.findall로 센 개수의 합과 같습니다.
+        
+        Returns:
+            {
+                "emotion": {"기쁨": 2, ...},
+                "affection": {"compliment": 1, ...},
+                "special": {"special_occasion": 0},
+                "modifier": {"emphasis": 1, ...}
+            }
+        """
+        keyword_hits = {"emotion": {}, "affection": {}, "special": {}, "modifier": {}}
+        for (group, name, _), count in TRIGGER_SCANNER.scan(message).items():
+            keyword_hits[group][name] = keyword_hits[group].get(name, 0) + count
+        return keyword_hits
+    
+    def _detect_emotion_triggers(self, keyword_hits: Dict) -> List[Tuple[str, float]]:
         """감정 트리거를 감지합니다"""
         detected_emotions = []
+        modifiers = keyword_hits["modifier"]
         
-        for emotion, patterns in self.emotion_patterns.items():
-            confidence = 0.0
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, message)
-                if matches:
-                    # 매치 횟수와 길이에 따라 신뢰도 계산
-                    confidence += len(matches) * 0.3
+        for emotion, count in keyword_hits["emotion"].items():
+            # 매치 횟수에 따라 신뢰도 계산
+            confidence = count * 0.3
             
             # 특정 키워드 조합으로 신뢰도 조정
             if emotion == "기쁨":
-                if any(word in message for word in ["정말", "너무", "완전"]):
+                if modifiers["joy_boost"]:
                     confidence *= 1.5
             elif emotion == "슬픔":
-                if any(word in message for word in ["많이", "너무", "정말"]):
+                if modifiers["sadness_boost"]:
                     confidence *= 1.5
             
             # 신뢰도가 일정 수준 이상이면 추가
@@ -168,39 +238,31 @@ class TriggerDetector:
         detected_emotions.sort(key=lambda x: x[1], reverse=True)
         return detected_emotions[:2]  # 최대 2개까지
     
-    def _detect_affection_triggers(self, message: str) -> List[Tuple[str, float]]:
+    def _detect_affection_triggers(self, keyword_hits: Dict) -> List[Tuple[str, float]]:
         """호감도 트리거를 감지합니다"""
         detected_triggers = []
+        affection_hits = keyword_hits["affection"]
+        modifiers = keyword_hits["modifier"]
         
         # 긍정적 트리거 체크
-        for trigger, patterns in self.positive_affection_patterns.items():
-            if patterns:
-                for pattern in patterns:
-                    if re.search(pattern, message):
-                        multiplier = 1.0
-                        
-                        # 강조 표현에 따른 배수 조정
-                        if any(word in message for word in ["정말", "너무", "완전", "진짜"]):
-                            multiplier = 1.5
-                        elif any(word in message for word in ["좀", "조금", "약간"]):
-                            multiplier = 0.8
-                        
-                        detected_triggers.append((trigger, multiplier))
-                        break
+        for trigger in self.positive_affection_patterns:
+            if affection_hits[trigger]:
+                multiplier = 1.0
+                
+                # 강조 표현에 따른 배수 조정
+                if modifiers["emphasis"]:
+                    multiplier = 1.5
+                elif modifiers["softener"]:
+                    multiplier = 0.8
+                
+                detected_triggers.append((trigger, multiplier))
         
         # 부정적 트리거 체크
-        for trigger, patterns in self.negative_affection_patterns.items():
-            if patterns:
-                for pattern in patterns:
-                    if re.search(pattern, message):
-                        multiplier = 1.0
-                        
-                        # 강한 부정 표현 체크
-                        if any(word in message for word in ["진짜", "정말", "완전", "너무"]):
-                            multiplier = 1.5
-                        
-                        detected_triggers.append((trigger, multiplier))
-                        break
+        for trigger in self.negative_affection_patterns:
+            if affection_hits[trigger]:
+                # 강한 부정 표현 체크
+                multiplier = 1.5 if modifiers["emphasis"] else 1.0
+                detected_triggers.append((trigger, multiplier))
         
         return detected_triggers
     
@@ -214,26 +276,25 @@ class TriggerDetector:
         duration = datetime.now() - last_interaction
         return int(duration.total_seconds() / 3600)  # 시간 단위
     
-    def _detect_special_context(self, message: str) -> Dict:
+    def _detect_special_context(self, keyword_hits: Dict) -> Dict:
         """특별한 상황을 감지합니다"""
         special_context = {}
+        modifiers = keyword_hits["modifier"]
         
         # 특별한 날 언급 체크
-        for pattern in self.special_patterns["special_occasion"]:
-            if re.search(pattern, message):
-                special_context["special_occasion"] = True
-                break
+        if keyword_hits["special"]["special_occasion"]:
+            special_context["special_occasion"] = True
         
         # 첫 만남인지 체크
-        if any(word in message for word in ["처음", "첫", "안녕하세요", "반가워"]):
+        if modifiers["first_meeting"]:
             special_context["first_meeting"] = True
         
         # 작별 인사 체크
-        if any(word in message for word in ["안녕", "잘가", "나중에", "또봐", "굿바이"]):
+        if modifiers["goodbye"]:
             special_context["goodbye"] = True
         
         # 질문 패턴 체크
-        if any(char in message for char in ["?", "？"]) or any(word in message for word in ["뭐", "어떻게", "왜", "언제", "어디"]):
+        if modifiers["question"]:
             special_context["question"] = True
         
         return special_context
@@ -269,4 +330,49 @@ class TriggerDetector:
             modifiers["기쁨"] = 1.5
             modifiers["설렘"] = 1.3
         
-        return modifiers
\ No newline at end of file
+        return modifiers
+
+
+def _build_trigger_scanner() -> KeywordScanner:
+    """
+    TriggerDetector의 모든 패턴을 하나의 KeywordScanner로 컴파일합니다
+    
+    패턴은 "키워드|키워드" 형태의 리터럴 선택만 쓰므로 "|"로 나눠 키워드 목록으로 바꿉니다.
+    패턴 줄마다 카테고리 (그룹, 이름, 줄 번호)를 따로 두어 줄별 findall 결과와 같은 횟수를 셉니다.
+    """
+    categories = {}
+    pattern_groups = [
+        ("emotion", TriggerDetector.emotion_patterns),
+        ("affection", TriggerDetector.positive_affection_patterns),
+        ("affection", TriggerDetector.negative_affection_patterns),
+        ("special", {"special_occasion": TriggerDetector.special_patterns["special_occasion"]}),
+    ]
+    for group, patterns in pattern_groups:
+        for name, lines in patterns.items():
+            for index, pattern in enumerate(lines):
+                categories[(group, name, index)] = pattern.split("|")
+    
+    for name, words in TriggerDetector.modifier_words.items():
+        categories[("modifier", name, 0)] = words
+    
+    return KeywordScanner(categories)
+
+
+# import 시 한 번만 컴파일 (요청마다 패턴 표를 다시 만들지 않음)
+TRIGGER_SCANNER = _build_trigger_scanner()
+
+
+def _chunked(messages: Iterable[str], size: int) -> Iterator[List[str]]:
+    """iterable을 size개씩 끊은 리스트로 나눕니다"""
+    iterator = iter(messages)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _analyze_chunk(messages: List[str]) -> List[Dict]:
+    """청크 하나를 분석합니다 (프로세스 풀 워커에서 호출되므로 모듈 최상위 함수)"""
+    detector = TriggerDetector()
+    return [detector.analyze_text(message) for message in messages]
@@ -0,0 +1,217 @@
+"""
+대화/감정 기록 write-behind 큐 (group commit)
+턴마다 ChatHistory / EmotionHistory를 턴 트랜잭션에서 INSERT하는 대신, 커밋된 턴의 행을 메모리 큐에 모았다가
+flush_interval마다(또는 batch_rows개가 모이면 바로) 모든 사용자의 행을 테이블별 executemany INSERT로
+한 트랜잭션에 기록합니다. SQLite의 단일 writer가 턴마다 처리하던 문장이 배치 하나로 합쳐지는 대신,
+기록이 DB에서 보이기까지 최대 flush_interval만큼 늦습니다 (최근 대화는 세션 상태의 링 버퍼가 바로 반영하고,
+상태를 DB에서 다시 불러올 때는 snapshot()으로 아직 기록되지 않은 행을 합침).
+종료 시 stop()이 남은 행을 모두 기록합니다.
+"""
+
+import asyncio
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+# (ORM 모델, INSERT할 열 값) - 같은 모델의 행은 같은 키를 같은 순서로 넣어야 executemany 하나로 묶임
+PendingRow = Tuple[type, Dict]
+
+# 종료 시 남은 행 기록을 시도하는 횟수
+SHUTDOWN_FLUSH_RETRIES = 5
+
+
+class HistoryWriter:
+    """
+    기록 행을 모아 주기적으로 한 트랜잭션에 INSERT하는 큐
+
+    Args:
+        session_factory: AsyncSession 팩토리
+        write_lock: 턴 커밋과 쓰기 트랜잭션을 직렬화하는 잠금 (database.async_write_lock)
+        flush_interval: 모인 행을 기록하는 주기 (초)
+        batch_rows: 이만큼 모이면 주기를 기다리지 않고 바로 기록
+        max_pending: 큐가 이만큼 차 있으면 (기록이 계속 실패하는 경우) 자리가 날 때까지 추가를 기다림
+    """
+
+    def __init__(self, session_factory, write_lock=None, flush_interval: float = 0.05,
+                 batch_rows: int = 500, max_pending: int = 20000):
+        self.session_factory = session_factory
+        self.write_lock = write_lock
+        self.flush_interval = flush_interval
+        self.batch_rows = batch_rows
+        self.max_pending = max_pending
+        self._pending: List[PendingRow] = []
+        # 큐에서 꺼냈지만 아직 커밋되지도 버려지지도 않은 행 (큐의 행보다 오래됨)
+        self._writing: List[PendingRow] = []
+        # 쓰기 트랜잭션 번호 (쓰기 잠금을 잡을 때 증가) / 트랜잭션이 진행 중이 아닐 때 set
+        self.writes = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self.failures = 0
+        self.largest_batch = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def unwritten(self, model, user_id: int) -> List[Dict]:
+        """아직 커밋되지 않은 사용자의 model 행 값 (오래된 순, 기록 중인 배치 포함)"""
+        return [
+            values for row_model, values in self._writing + self._pending
+            if row_model is model and values.get("user_id") == user_id
+        ]
+
+    async def snapshot(self, model, user_id: int) -> Tuple[int, List[Dict]]:
+        """
+        (쓰기 번호, unwritten 행)을 반환합니다
+        그 뒤에 DB에서 읽은 행과 합칠 때, 읽기가 끝난 시점의 writes가 같으면 빠지거나 겹치는 행이 없습니다
+        (다르면 그 사이에 커밋된 배치가 있을 수 있으므로 다시 읽음).
+        진행 중인 트랜잭션은 쓰기 잠금을 쥐고 있으므로, 쓰기 잠금을 쥔 채로 불러도 기다리지 않습니다.
+        """
+        await self._idle.wait()
+        return self.writes, self.unwritten(model, user_id)
+
+    async def wait_for_room(self):
+        """
+        큐가 max_pending만큼 차 있으면 (기록이 계속 실패하는 경우) 자리가 날 때까지 기다립니다
+        flush가 쓰기 잠금을 잡아야 하므로 잠금을 쥔 채로 부르면 안 됩니다.
+        """
+        while len(self._pending) >= self.max_pending:
+            if self._task is None:
+                # 주기적 flush 없이 쓰는 경우 (스크립트 등) 직접 기록
+                await self.flush()
+                return
+            self._room.clear()
+            self._wakeup.set()
+            await self._room.wait()
+
+    def append(self, model, values: Dict):
+        """INSERT할 행 하나를 큐에 넣습니다"""
+        self.extend([(model, values)])
+
+    def extend(self, rows: List[PendingRow]):
+        """INSERT할 행들을 큐에 넣습니다 (한 턴의 행은 같은 배치에 함께 들어감)"""
+        self._pending.extend(rows)
+        if len(self._pending) >= self.batch_rows:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """모인 행을 한 트랜잭션으로 기록하고 기록한 행 수를 반환합니다 (실패하면 큐에 되돌려 다음 주기에 재시도)"""
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            self._writing = rows
+            try:
+                await self._write(rows)
+                written = len(rows)
+                self._written([])
+            except IntegrityError as e:
+                # 이미 지워진 사용자의 행 등 한 행 때문에 배치 전체가 막히지 않도록 행마다 다시 시도
+                print(f"기록 배치 무결성 오류, 행 단위로 재시도: {e}")
+                written = await self._write_each(rows)
+            except Exception as e:
+                print(f"기록 flush 오류: {e}")
+                self.failures += 1
+                # 순서를 지키도록 그동안 들어온 행보다 앞에 되돌림
+                self._pending[:0] = rows
+                self._written([])
+                return 0
+            finally:
+                # 취소 등으로 위에서 맞추지 못했어도 snapshot()을 기다리는 조회가 멈추지 않도록
+                self._idle.set()
+
+            self.rows_written += written
+            self.flushes += 1
+            self.largest_batch = max(self.largest_batch, len(rows))
+            if len(self._pending) < self.max_pending:
+                self._room.set()
+            return written
+
+    async def _write(self, rows: List[PendingRow]):
+        # 테이블(과 열 구성)별로 묶어 executemany INSERT 한 번씩, 커밋은 한 번
+        batches: Dict[Tuple, List[Dict]] = {}
+        for model, values in rows:
+            batches.setdefault((model.__table__, tuple(values)), []).append(values)
+        async with self.write_lock or nullcontext(), self.session_factory() as db:
+            self.writes += 1
+            self._idle.clear()
+            for (table, _), values in batches.items():
+                await db.execute(insert(table), values)
+            await db.commit()
+
+    def _written(self, remaining: List[PendingRow]):
+        """트랜잭션이 끝난 뒤 (커밋했거나 행을 버리거나 큐에 되돌린 뒤) 아직 기록되지 않은 꺼낸 행을 맞춤"""
+        self._writing = remaining
+        self._idle.set()
+
+    async def _write_each(self, rows: List[PendingRow]) -> int:
+        """행마다 따로 기록하고 무결성 오류가 나는 행만 버립니다 (다른 오류면 남은 행을 큐에 되돌림)"""
+        written = 0
+        for index, row in enumerate(rows):
+            try:
+                await self._write([row])
+                written += 1
+            except IntegrityError as e:
+                self.rows_dropped += 1
+                print(f"기록할 수 없는 행을 버림 ({row[0].__tablename__}): {e}")
+            except Exception as e:
+                print(f"기록 flush 오류: {e}")
+                self.failures += 1
+                self._pending[:0] = rows[index:]
+                self._written([])
+                break
+            self._written(rows[index + 1:])
+        return written
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """주기적 flush 태스크를 시작합니다"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """주기적 flush를 멈추고 남은 행을 모두 기록합니다"""
+        if self._task is not None:
+            # 진행 중인 flush가 끝난 뒤 취소 (쓰기 도중 취소하면 커넥션이 쓰기 잠금을 쥔 채 남음)
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(SHUTDOWN_FLUSH_RETRIES):
+            await self.flush()
+            if not self._pending:
+                return
+            await asyncio.sleep(0.1 * (attempt + 1))
+        print(f"종료 시 기록하지 못한 행: {len(self._pending)}개")
+
+    def stats(self) -> Dict:
+        return {
+            "pending_rows": len(self._pending),
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "average_batch": round(self.rows_written / self.flushes, 1) if self.flushes else 0.0,
+            "largest_batch": self.largest_batch,
+        }
@@ -0,0 +1,36 @@
+# LLM 백엔드 패키지 초기화
+import os
+from typing import Optional
+
+from .base import LLMBackend, LLMBackendError
+from .local_backend import LocalStandInBackend
+
+
+def create_llm_backend(backend_name: Optional[str] = None) -> Optional[LLMBackend]:
+    """
+    LLM_BACKEND 환경 변수(gemini | local)에 맞는 백엔드를 만듭니다.
+    gemini인데 GOOGLE_API_KEY가 없으면 None을 반환합니다.
+    """
+    backend_name = (backend_name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    
+    if backend_name == "local":
+        return LocalStandInBackend.from_env()
+    
+    if backend_name == "gemini":
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key or api_key == "YOUR_API_KEY_HERE":
+            print("Warning: GOOGLE_API_KEY not found or not set in .env file.")
+            return None
+        # google-generativeai는 Gemini를 쓸 때만 import
+        from .gemini_backend import GeminiBackend, DEFAULT_GEMINI_MODEL
+        return GeminiBackend(api_key, os.getenv("GEMINI_MODEL", DEFAULT_GEMINI_MODEL))
+    
+    raise ValueError(f"Unknown LLM_BACKEND: {backend_name}")
+
+
+__all__ = [
+    'LLMBackend',
+    'LLMBackendError',
+    'LocalStandInBackend',
+    'create_llm_backend'
+]
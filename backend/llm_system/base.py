@@ -0,0 +1,32 @@
+"""
+LLM 백엔드 공통 인터페이스
+엔드포인트와 감정 분석기는 이 인터페이스만 사용하므로 제공자를 바꿔도 코드를 고칠 필요가 없습니다.
+"""
+
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+
+class LLMBackendError(Exception):
+    """LLM 호출 실패 (네트워크 오류, 차단된 응답, 주입된 장애 등)"""
+
+
+class LLMBackend(ABC):
+    """텍스트 생성 백엔드"""
+    
+    name = "base"
+    
+    @abstractmethod
+    def generate(self, prompt: str, json_mode: bool = False) -> str:
+        """프롬프트에 대한 전체 응답 텍스트를 동기적으로 생성합니다"""
+    
+    @abstractmethod
+    async def generate_async(self, prompt: str, json_mode: bool = False) -> str:
+        """프롬프트에 대한 전체 응답 텍스트를 비동기로 생성합니다
+
+        json_mode가 True이면 JSON 문서만 응답하도록 요청합니다 (단일 호출 모드).
+        """
+    
+    @abstractmethod
+    def stream(self, prompt: str) -> AsyncIterator[str]:
+        """응답 텍스트 조각을 생성되는 대로 내보내는 async iterator를 반환합니다"""
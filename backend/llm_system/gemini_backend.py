@@ -0,0 +1,52 @@
+"""
+Google Gemini 백엔드
+"""
+
+from typing import AsyncIterator, Optional
+import google.generativeai as genai
+
+from .base import LLMBackend, LLMBackendError
+
+DEFAULT_GEMINI_MODEL = "gemini-2.5-flash"
+
+
+class GeminiBackend(LLMBackend):
+    """google.generativeai.GenerativeModel을 감싼 백엔드"""
+    
+    name = "gemini"
+    
+    def __init__(self, api_key: str, model_name: str = DEFAULT_GEMINI_MODEL):
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+    
+    @staticmethod
+    def _generation_config(json_mode: bool) -> Optional[dict]:
+        return {"response_mime_type": "application/json"} if json_mode else None
+    
+    def generate(self, prompt: str, json_mode: bool = False) -> str:
+        try:
+            response = self.model.generate_content(
+                prompt, generation_config=self._generation_config(json_mode)
+            )
+            return response.text
+        except Exception as e:
+            raise LLMBackendError(f"Gemini 호출 실패: {e}") from e
+    
+    async def generate_async(self, prompt: str, json_mode: bool = False) -> str:
+        try:
+            response = await self.model.generate_content_async(
+                prompt, generation_config=self._generation_config(json_mode)
+            )
+            return response.text
+        except Exception as e:
+            raise LLMBackendError(f"Gemini 호출 실패: {e}") from e
+    
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        try:
+            response = await self.model.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            raise LLMBackendError(f"Gemini 스트리밍 실패: {e}") from e
@@ -0,0 +1,156 @@
+"""
+로컬 대역(stand-in) 백엔드
+API 키나 네트워크 없이 /chat 전체 파이프라인을 벤치마크/소크 테스트하기 위한 결정적 모델입니다.
+응답 내용은 프롬프트 해시로, 지연/장애는 시드로 결정되므로 같은 설정이면 같은 결과가 나옵니다.
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+from typing import AsyncIterator, List
+
+from .base import LLMBackend, LLMBackendError
+
+# 프롬프트 해시로 고르는 카오루코 답변 (답변 키워드가 감정 분류에 골고루 걸리도록 구성)
+CANNED_REPLIES = [
+    ("안녕하세요! 오늘도 와주셔서 정말 기뻐요. 하루는 어떠셨어요?", "기쁨"),
+    ("어.. 그런 말씀을... 하시면... 부끄러워요. *얼굴이 빨개졌어요*", "수줍음"),
+    ("...얼마나 힘들었어요? 제가 옆에 있을게요. 너무 슬퍼하지 마세요.", "슬픔"),
+    ("그런 식으로 말하지 마세요. 저는 제 눈으로 본 것만 믿어요.", "화남"),
+    ("와, 정말요?! 깜짝 놀랐어요. 그런 일이 있었군요!", "놀람"),
+    ("같이 케이크 먹으러 가요! 벌써 두근거리고 기대돼요. *설레요...*", "설렘"),
+    ("그렇군요. 좋은 생각이네요. 조금 더 이야기해 주실래요?", "기쁨"),
+]
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+
+class LocalStandInBackend(LLMBackend):
+    """
+    결정적인 로컬 대역 모델
+
+    Args:
+        latency_ms: 첫 토큰까지의 평균 지연 (밀리초)
+        latency_jitter_ms: 지연 분포의 폭 (uniform: ±폭, normal: 표준편차, lognormal: 시그마 × 평균)
+        latency_distribution: fixed, uniform, normal, lognormal 중 하나
+        tokens_per_second: 토큰 생성 속도 (0이면 즉시 전체 응답)
+        failure_rate: 호출이 LLMBackendError로 실패할 확률 (0.0-1.0)
+        seed: 지연/장애 난수 시드
+    """
+    
+    name = "local"
+    CHARS_PER_TOKEN = 2  # 한국어 기준 대략적인 토큰당 글자 수
+    
+    def __init__(self, latency_ms: float = 300.0, latency_jitter_ms: float = 0.0,
+                 latency_distribution: str = "fixed", tokens_per_second: float = 0.0,
+                 failure_rate: float = 0.0, seed: int = 0):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"latency_distribution must be one of {LATENCY_DISTRIBUTIONS}")
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.latency_distribution = latency_distribution
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+    
+    @classmethod
+    def from_env(cls) -> "LocalStandInBackend":
+        """LOCAL_LLM_* 환경 변수로 대역 모델을 만듭니다"""
+        return cls(
+            latency_ms=float(os.getenv("LOCAL_LLM_LATENCY_MS", "300")),
+            latency_jitter_ms=float(os.getenv("LOCAL_LLM_LATENCY_JITTER_MS", "0")),
+            latency_distribution=os.getenv("LOCAL_LLM_LATENCY_DIST", "fixed"),
+            tokens_per_second=float(os.getenv("LOCAL_LLM_TOKENS_PER_SEC", "0")),
+            failure_rate=float(os.getenv("LOCAL_LLM_FAILURE_RATE", "0")),
+            seed=int(os.getenv("LOCAL_LLM_SEED", "0")),
+        )
+    
+    # --- 지연/장애 시뮬레이션 ---
+    
+    def _sample_latency(self) -> float:
+        """첫 토큰까지의 지연(초)을 분포에서 뽑습니다"""
+        mean, jitter = self.latency_ms, self.latency_jitter_ms
+        if self.latency_distribution == "uniform":
+            value = self.rng.uniform(mean - jitter, mean + jitter)
+        elif self.latency_distribution == "normal":
+            value = self.rng.gauss(mean, jitter)
+        elif self.latency_distribution == "lognormal" and mean > 0:
+            sigma = jitter / mean
+            # 평균이 latency_ms가 되도록 mu 보정
+            value = self.rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+        else:
+            value = mean
+        return max(0.0, value) / 1000.0
+    
+    def _start_call(self) -> float:
+        """호출 1회를 기록하고, 장애를 주입하거나 지연(초)을 반환합니다"""
+        self.calls += 1
+        latency = self._sample_latency()
+        if self.failure_rate and self.rng.random() < self.failure_rate:
+            self.failures += 1
+            raise LLMBackendError("local stand-in: injected failure")
+        return latency
+    
+    def _generation_seconds(self, text: str) -> float:
+        if not self.tokens_per_second:
+            return 0.0
+        return len(self._tokenize(text)) / self.tokens_per_second
+    
+    def _tokenize(self, text: str) -> List[str]:
+        size = self.CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    
+    # --- 결정적 응답 ---
+    
+    def _respond(self, prompt: str, json_mode: bool) -> str:
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        reply, emotion = CANNED_REPLIES[digest % len(CANNED_REPLIES)]
+        emotion_fields = {
+            "emotion": emotion,
+            "intensity": 3 + digest % 7,
+            "reason": "로컬 대역 모델의 결정적 응답",
+            "confidence": 0.8
+        }
+        
+        if json_mode and '"reply"' in prompt:
+            # 단일 호출 모드: 답변 + 감정
+            return json.dumps({"reply": reply, **emotion_fields}, ensure_ascii=False)
+        if '"emotion"' in prompt and '"confidence"' in prompt:
+            # EmotionAnalyzer 감정 분석 프롬프트: 분석 대상 답변이 대역 답변이면 그 감정으로 라벨링
+            for canned_reply, canned_emotion in CANNED_REPLIES:
+                if canned_reply in prompt:
+                    emotion_fields["emotion"] = canned_emotion
+                    break
+            return json.dumps(emotion_fields, ensure_ascii=False)
+        return reply
+    
+    # --- LLMBackend 구현 ---
+    
+    def generate(self, prompt: str, json_mode: bool = False) -> str:
+        latency = self._start_call()
+        text = self._respond(prompt, json_mode)
+        time.sleep(latency + self._generation_seconds(text))
+        return text
+    
+    async def generate_async(self, prompt: str, json_mode: bool = False) -> str:
+        latency = self._start_call()
+        text = self._respond(prompt, json_mode)
+        await asyncio.sleep(latency + self._generation_seconds(text))
+        return text
+    
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        latency = self._start_call()
+        text = self._respond(prompt, False)
+        await asyncio.sleep(latency)
+        
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second else 0.0
+        for token in self._tokenize(text):
+            yield token
+            if interval:
+                await asyncio.sleep(interval)
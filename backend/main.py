@@ -1,21 +1,35 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
-from sqlalchemy.orm import Session
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager, nullcontext
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
+import json
+import uuid
 import dotenv
-import google.generativeai as genai
+from typing import Literal, Optional
 
 # Import models, database session, and crud functions
-from models import ChatRequest, ChatResponse
-from database import create_db_and_tables, SessionLocal
+from models import ChatRequest, ChatResponse, TurnEmotion, ChatHistoryPage, ChatSearchPage, Timeline, ChatHistory
+from database import create_db_and_tables, AsyncSessionLocal, async_engine, async_write_lock
 import crud
 
 # Import emotion system
-from emotion_system import AffectionManager, TriggerDetector, EmotionAnalyzer
+from emotion_system import AffectionManager, TriggerDetector, EmotionAnalyzer, DeferredEmotionStore, EmotionCache
 # Import event system
 from event_system import EventManager
+from task_graph import TaskGraph
+from context_builder import ContextBuilder
+from session_state import SessionStateStore
+from user_directory import user_directory
+from user_data_purger import UserDataPurger
+from history_writer import HistoryWriter
+from memory_index import MemoryIndex
+from unit_of_work import TurnUnitOfWork
+# Import LLM backends
+from llm_system import create_llm_backend
 from datetime import datetime
 
 # Load environment variables from .env file
@@ -28,8 +42,28 @@ async def lifespan(app: FastAPI):
     print("Application startup: Creating database and tables...")
     create_db_and_tables()
     print("Database and tables check/creation complete.")
+    session_states.start()
+    if history_writer:
+        history_writer.start()
+    user_data_purger.start()
+    if EMOTION_CACHE_PERSIST:
+        async with AsyncSessionLocal() as db:
+            print(f"Loaded {await emotion_cache.load(db)} emotion cache entries.")
     yield
     # Shutdown
+    await deferred_emotions.drain()
+    if history_writer:
+        await history_writer.stop()
+        print(f"Flushed chat/emotion history ({history_writer.rows_written} rows written).")
+    await user_data_purger.stop()
+    await session_states.stop()
+    print("Flushed session state.")
+    if memory_index:
+        memory_index.close()
+    if EMOTION_CACHE_PERSIST:
+        async with AsyncSessionLocal() as db:
+            print(f"Saved {await emotion_cache.save(db)} emotion cache entries.")
+    await async_engine.dispose()
     print("Application shutdown")
 
 # Create the FastAPI app
@@ -44,33 +78,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dependency to get a DB session for each request
-def get_db():
-    db = SessionLocal()
-    try:
+# Dependency to get an async DB session for each request
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-# Configure the Gemini API
+# 단일 호출 모드: 답변과 감정 정보를 한 번의 구조화(JSON) 응답으로 받습니다 (opt-in)
+SINGLE_CALL_MODE = os.getenv("KAORUKO_SINGLE_CALL_MODE", "false").lower() in ("1", "true", "yes")
+
+# 로컬 키워드 감정 분류를 그대로 쓰는 확신도 기준 (이보다 낮으면 Gemini로 감정 분석)
+EMOTION_LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv(
+    "EMOTION_LOCAL_CONFIDENCE_THRESHOLD", EmotionAnalyzer.DEFAULT_LOCAL_CONFIDENCE_THRESHOLD
+))
+
+# 감정 분석 결과 캐시 (크기/TTL 제한, EMOTION_CACHE_PERSIST=true면 재시작 간 SQLite에 유지)
+emotion_cache = EmotionCache(
+    max_entries=int(os.getenv("EMOTION_CACHE_SIZE", "4096")),
+    ttl_seconds=float(os.getenv("EMOTION_CACHE_TTL_SECONDS", "3600"))
+)
+EMOTION_CACHE_PERSIST = os.getenv("EMOTION_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+# 지연 감정 분석 모드: 답변을 먼저 돌려주고 감정 분석은 백그라운드에서 마칩니다 (opt-in)
+DEFERRED_EMOTION_MODE = os.getenv("KAORUKO_DEFERRED_EMOTION", "false").lower() in ("1", "true", "yes")
+deferred_emotions = DeferredEmotionStore()
+
+# 트리거 감지기는 상태가 없으므로 하나를 공유 (패턴 스캐너는 import 시 한 번만 컴파일)
+trigger_detector = TriggerDetector()
+
+# Initialize the LLM backend (LLM_BACKEND=gemini | local)
+# gemini는 GOOGLE_API_KEY가 있을 때만 만들어지고, local은 오프라인 대역 모델입니다
+llm_backend = None
 try:
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key or api_key == "YOUR_API_KEY_HERE":
-        print("Warning: GOOGLE_API_KEY not found or not set in .env file.")
-    else:
-        genai.configure(api_key=api_key)
+    llm_backend = create_llm_backend()
 except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
+    print(f"Error configuring LLM backend: {e}")
 
-# Initialize the model if the API key is available
-generative_model = None
-if api_key != "YOUR_API_KEY_HERE":
-    # Use the latest Gemini model name
-    generative_model = genai.GenerativeModel('gemini-2.5-flash')
+LLM_NOT_CONFIGURED = "LLM backend not configured. Please set GOOGLE_API_KEY in .env (or LLM_BACKEND=local)"
 
 # Root endpoint for basic testing
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Backend server is running."}
 
 # 와구리 카오루코 페르소나 시스템 프롬프트
@@ -105,155 +152,493 @@ KAORUKO_PERSONA = """
 
 # New user endpoint to clear user data
 @app.post("/new-user")
-def new_user_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
+async def new_user_endpoint(request: ChatRequest, db: AsyncSession = Depends(get_db)):
     """
     Clear all data for a user when starting a new session.
+    The user's current data generation is retired right away (one UPDATE);
+    the old rows are deleted in small batches by user_data_purger in the background.
     """
     try:
         user_name = request.user_name or "사용자"
         print(f"Clearing data for user: {user_name}")
         
-        success = crud.clear_user_data(db, user_name)
+        if history_writer:
+            # 이전 세대의 기록이 정리된 뒤에 도착해 외래 키 오류가 나지 않도록 큐부터 비움
+            await history_writer.flush()
+        async with async_write_lock or nullcontext():
+            retired_id = await crud.retire_user_data(db, user_name)
+            # 퇴역을 커밋하고 이름 캐시를 지운 뒤에 버림 (그 전에 버리면 겹친 /chat이 퇴역할 id로 다시 캐시함)
+            session_states.discard(user_name)
+        if retired_id is not None:
+            user_data_purger.wake()
         
-        if success:
-            return {"message": f"Successfully cleared data for {user_name}", "status": "success"}
-        else:
-            return {"message": "Failed to clear user data", "status": "error"}
+        return {"message": f"Successfully cleared data for {user_name}", "status": "success"}
     
     except Exception as e:
         print(f"Error in /new-user: {e}")
         raise HTTPException(status_code=500, detail=f"Error clearing user data: {e}")
 
-# Updated chat endpoint with DB session dependency  
-@app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(request: ChatRequest, db: Session = Depends(get_db)):
-    if not generative_model:
-        raise HTTPException(status_code=503, detail="Gemini API not configured. Please set GOOGLE_API_KEY in .env")
+# 프롬프트 구성 (/chat, /chat/stream 공용)
+# 프롬프트 토큰 예산과, 예산 안에서 채울 후보로 불러올 최근 대화 수
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+CONTEXT_MAX_HISTORY_TURNS = int(os.getenv("CONTEXT_MAX_HISTORY_TURNS", "30"))
+# 장기 기억: 최근 대화보다 오래된 턴 중 새 메시지와 관련된 턴을 이 수만큼, 이 토큰 예산 안에서 함께 넣음 (0이면 사용 안 함)
+MEMORY_RECALL_TURNS = int(os.getenv("MEMORY_RECALL_TURNS", "3"))
+MEMORY_MIN_SIMILARITY = float(os.getenv("MEMORY_MIN_SIMILARITY", "0.2"))
+context_builder = ContextBuilder(
+    KAORUKO_PERSONA, CONTEXT_TOKEN_BUDGET, memory_token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", "600"))
+)
+
+# 사용자별 로컬 벡터 인덱스 (chat_history에서 만드는 파생 데이터, 사용자 데이터 세대마다 폴더 하나)
+memory_index = MemoryIndex(
+    os.getenv("MEMORY_INDEX_DIR", "./memory_index"),
+    coarse_candidates=int(os.getenv("MEMORY_COARSE_CANDIDATES", "1024")),
+    candidates=int(os.getenv("MEMORY_CANDIDATES", "64")),
+    sync_batch=int(os.getenv("MEMORY_SYNC_BATCH", "200"))
+) if MEMORY_RECALL_TURNS > 0 else None
+
+# 대화/감정 기록 write-behind 큐 (여러 턴의 행을 모아 주기마다 한 트랜잭션으로 INSERT)
+# HISTORY_FLUSH_MS=0이면 큐 없이 턴 트랜잭션에서 바로 기록
+HISTORY_FLUSH_MS = float(os.getenv("HISTORY_FLUSH_MS", "50"))
+history_writer = HistoryWriter(
+    AsyncSessionLocal,
+    write_lock=async_write_lock,
+    flush_interval=HISTORY_FLUSH_MS / 1000,
+    batch_rows=int(os.getenv("HISTORY_FLUSH_ROWS", "500"))
+) if HISTORY_FLUSH_MS > 0 else None
+
+# 사용자별 세션 상태 (호감도/감정/최근 대화를 메모리에 두고 주기적으로 모아서 기록)
+session_states = SessionStateStore(
+    AsyncSessionLocal,
+    memory_budget_bytes=int(float(os.getenv("SESSION_STATE_MEMORY_MB", "64")) * 1024 * 1024),
+    history_size=CONTEXT_MAX_HISTORY_TURNS,
+    flush_interval=float(os.getenv("SESSION_STATE_FLUSH_SECONDS", "2")),
+    write_lock=async_write_lock,
+    history_writer=history_writer
+)
+
+# /new-user로 퇴역한 사용자 데이터를 작은 배치로 나눠 지우는 백그라운드 작업
+user_data_purger = UserDataPurger(
+    AsyncSessionLocal,
+    write_lock=async_write_lock,
+    batch_size=int(os.getenv("USER_PURGE_BATCH_SIZE", "500")),
+    batch_pause=float(os.getenv("USER_PURGE_PAUSE_MS", "10")) / 1000,
+    on_purge=memory_index.drop if memory_index else None
+)
+
+async def build_chat_prompt(request: ChatRequest) -> str:
+    """페르소나, 관련된 예전 대화, 최근 대화 기록, 새 메시지를 토큰 예산 안에서 합쳐 LLM 프롬프트를 만듭니다."""
+    # Recent chat history (user-specific), served from the in-memory ring buffer
+    state = await session_states.get(request.user_name or "사용자")
+    chat_history = list(state.recent_history)
     
-    try:
-        print(f"Received message from {request.user_name or 'Unknown'}: {request.message}")
-        
-        # Retrieve recent chat history from DB to provide context (user-specific)
-        chat_history = crud.get_chat_history(db, user_name=request.user_name or "사용자", skip=0, limit=5)
-        
-        # Build conversation context
-        conversation_context = ""
-        if chat_history:
-            conversation_context = "\n\n최근 우리의 대화 내용:\n"
-            for chat in reversed(chat_history):  # Show oldest first
-                conversation_context += f"{request.user_name or '사용자'}: {chat.user_message}\n카오루코: {chat.bot_reply}\n"
-        
-        # 사용자 이름이 있으면 페르소나에 추가
-        user_context = ""
-        if request.user_name:
-            user_context = f"\n\n상대방의 이름은 '{request.user_name}'입니다. 대화할 때 이름을 자연스럽게 사용해주세요."
-        
-        # Combine persona, conversation history, and new message
-        full_prompt = f"{KAORUKO_PERSONA}{user_context}\n{conversation_context}\n\n{request.user_name or '사용자'}의 새 메시지: {request.message}\n\n카오루코로서 답변해줘:"
-        
-        # API call with full context
-        response = generative_model.generate_content(full_prompt)
-        reply_text = response.text
+    # 최근 대화에 이미 들어간 턴을 빼고 새 메시지와 관련된 예전 턴 검색 (실패해도 최근 대화만으로 답변)
+    memories = []
+    if memory_index and state.user_id is not None:
+        # 최근 대화 중 아직 기록 큐에 있는 턴은 DB와 인덱스에 없으므로 제외할 수에서 뺌
+        unwritten = len(history_writer.unwritten(ChatHistory, state.user_id)) if history_writer else 0
+        try:
+            async with AsyncSessionLocal() as db:
+                memories = await memory_index.recall(
+                    db, state.user_id, request.message, MEMORY_RECALL_TURNS,
+                    exclude_recent=max(0, len(chat_history) - unwritten), min_similarity=MEMORY_MIN_SIMILARITY
+                )
+        except Exception as e:
+            print(f"기억 검색 오류: {e}")
+        # 세는 사이에 큐의 배치가 커밋되어 색인되었으면 최근 대화의 턴이 다시 나올 수 있으므로 뺌
+        recent = {(turn.user_message, turn.bot_reply) for turn in chat_history}
+        memories = [memory for memory in memories if (memory.user_message, memory.bot_reply) not in recent]
+    
+    # 사용자 이름이 있으면 페르소나에 추가
+    user_context = ""
+    if request.user_name:
+        user_context = f"\n\n상대방의 이름은 '{request.user_name}'입니다. 대화할 때 이름을 자연스럽게 사용해주세요."
+    
+    # Combine persona, recalled memories, conversation history (newest first, within budget), and new message
+    full_prompt, usage = context_builder.build(
+        request.user_name or "사용자", user_context, chat_history, request.message, memories
+    )
+    print(f"Prompt tokens (estimated): {usage}")
+    return full_prompt
+
+def emotion_response_fields(emotion_result: dict) -> dict:
+    """EmotionAnalyzer 결과를 응답 모델의 emotion_* 필드로 변환합니다."""
+    return {
+        "emotion": emotion_result["emotion"],
+        "emotion_intensity": emotion_result["intensity"],
+        "emotion_emoji": emotion_result["emoji"],
+        "emotion_color": emotion_result["color"],
+        "emotion_reason": emotion_result["reason"],
+        "emotion_confidence": emotion_result["confidence"]
+    }
+
+# 답변 이후 단계 (/chat, /chat/stream 공용)
+async def process_chat_turn(request: ChatRequest, reply_text: str, emotion_data: dict = None) -> dict:
+    """
+    답변이 만들어진 뒤의 단계(호감도, 감정 분석, 기록 저장, 이벤트)를 처리하고
+    ChatResponse 형태의 딕셔너리를 반환합니다.
+    emotion_data가 주어지면(단일 호출 모드) 감정 분석 LLM 호출을 생략합니다.
+    지연 감정 분석 모드에서는 직전 감정을 임시값으로 돌려주고 분석은 백그라운드에서 진행합니다.
+
+    서로 독립적인 세 갈래를 동시에 실행하고, 턴의 쓰기를 한 번에 커밋한 뒤 이벤트를 처리합니다:
+        affection (트리거 감지)       ─┐
+        emotion   (감정 분석 LLM 호출) ─┼─→ commit (호감도 UPDATE + INSERT들, 커밋 1회) ─→ events
+        history   (대화 기록 등록)     ─┘
+    갈래들은 작업 단위 세션에 INSERT할 행만 등록하고 그 세션으로 DB를 실행하지 않으며, DB 실행은 commit 단계에서만 하므로
+    세션 하나를 공유해도 동시 작업이 생기지 않습니다. 실패하면 턴 전체가 롤백됩니다.
+    사용자 이름 → id는 그래프 전에 이름 캐시에 올려 두므로 갈래 안에서 users를 조회/생성하지 않습니다
+    (감정 분석 LLM 호출과 지연 모드의 직전 감정 조회는 공유 세션을 쓰지 않는 I/O입니다).
+    history_writer가 있으면 대화/감정 기록 INSERT는 커밋 뒤 그 큐로 넘어가 다른 턴들과 모아서 기록됩니다.
+    """
+    user_name = request.user_name or "사용자"
+    turn_id = uuid.uuid4().hex
+    defer_emotion = DEFERRED_EMOTION_MODE and emotion_data is None
+    
+    async with TurnUnitOfWork(AsyncSessionLocal, async_write_lock, history_writer) as uow:
+        state = await session_states.get(user_name)
+        # 이름 캐시에서 밀려났으면 공유 세션 대신 별도 세션으로 미리 채움
+        await user_directory.preload(AsyncSessionLocal, user_name)
         
-        # 호감도 시스템 처리
-        affection_manager = AffectionManager(db)
-        trigger_detector = TriggerDetector()
+        async def affection_branch():
+            # 메시지 분석해서 호감도 트리거 찾기
+            conversation_start = datetime.now()  # 실제로는 세션 시작 시간을 사용해야 함
+            analysis = trigger_detector.analyze_message(
+                request.message, 
+                user_name, 
+                conversation_start
+            )
+            
+            # 감지된 트리거와 대화 길이 보너스 (commit 단계에서 UPDATE 한 번으로 함께 적용)
+            triggers = list(analysis.get("affection_triggers", []))
+            if analysis.get("conversation_length", 0) >= 5:  # 5분 이상 대화
+                triggers.append((
+                    "long_conversation",
+                    trigger_detector.get_conversation_bonus_multiplier(analysis["conversation_length"])
+                ))
+            return triggers
         
-        # 현재 호감도 상태 가져오기
-        current_affection, current_stage, days_since_first_met = affection_manager.get_user_affection(request.user_name or "사용자")
+        async def emotion_branch():
+            if not defer_emotion:
+                # 🎭 감정 분석 시스템 (Stage 2): EmotionHistory는 턴과 함께 커밋
+                emotion_analyzer = EmotionAnalyzer(
+                    uow.session, llm_backend, EMOTION_LOCAL_CONFIDENCE_THRESHOLD, emotion_cache, unit_of_work=uow
+                )
+                emotion_result = await emotion_analyzer.analyze_emotion(
+                    request.message, 
+                    reply_text, 
+                    user_name,
+                    emotion_data
+                )
+                uow.after_commit(lambda: state.set_emotion(emotion_result["emotion"], emotion_result["intensity"]))
+                return emotion_result
+            
+            # 직전 감정을 임시값으로 쓰고, 실제 분석과 EmotionHistory 기록은 백그라운드에서 (별도 트랜잭션)
+            if state.current_emotion:
+                placeholder = EmotionAnalyzer.build_emotion_result(state.current_emotion, state.emotion_intensity, "직전 감정")
+            else:
+                async with AsyncSessionLocal() as db:
+                    placeholder = await EmotionAnalyzer(db, llm_backend).get_last_emotion(user_name)
+            deferred_emotions.submit(turn_id, analyze_emotion_later(), placeholder)
+            return placeholder
         
-        # 메시지 분석해서 호감도 트리거 찾기
-        conversation_start = datetime.now()  # 실제로는 세션 시작 시간을 사용해야 함
-        analysis = trigger_detector.analyze_message(
-            request.message, 
-            request.user_name or "사용자", 
-            conversation_start
-        )
+        async def analyze_emotion_later():
+            async with AsyncSessionLocal() as db:
+                emotion_analyzer = EmotionAnalyzer(
+                    db, llm_backend, EMOTION_LOCAL_CONFIDENCE_THRESHOLD, emotion_cache, history_writer=history_writer
+                )
+                emotion_result = await emotion_analyzer.analyze_emotion(request.message, reply_text, user_name)
+            state.set_emotion(emotion_result["emotion"], emotion_result["intensity"])
+            return emotion_result
         
-        # 호감도 변화 적용
-        affection_change = 0
-        for trigger, multiplier in analysis.get("affection_triggers", []):
-            new_level, change, level_up = affection_manager.update_affection(
-                request.user_name or "사용자", 
-                trigger, 
-                multiplier
+        async def history_branch():
+            # Save the new conversation (user_name 포함, 턴이 커밋되면 기록 큐로)
+            await crud.create_chat_history(
+                db=uow.session, 
+                user_message=request.message, 
+                bot_reply=reply_text,
+                user_name=user_name,
+                unit_of_work=uow
             )
-            affection_change += change
-            current_affection = new_level  # 최신 호감도로 업데이트
-        
-        # 대화 길이 보너스 적용
-        if analysis.get("conversation_length", 0) >= 5:  # 5분 이상 대화
-            bonus_change = affection_manager.update_affection(
-                request.user_name or "사용자", 
-                "long_conversation",
-                trigger_detector.get_conversation_bonus_multiplier(analysis["conversation_length"])
-            )[1]
-            affection_change += bonus_change
-            current_affection = affection_manager.get_user_affection(request.user_name or "사용자")[0]
-
-        # 🎭 감정 분석 시스템 (Stage 2)
-        emotion_analyzer = EmotionAnalyzer(db, generative_model)
-        emotion_result = emotion_analyzer.analyze_emotion(
-            request.message, 
-            reply_text, 
-            request.user_name or "사용자"
-        )
-
-        # Save the new conversation to the database (user_name 포함)
-        crud.create_chat_history(
-            db=db, 
-            user_message=request.message, 
-            bot_reply=reply_text,
-            user_name=request.user_name or "사용자"
-        )
-        print("Saved conversation to database.")
+            uow.after_commit(lambda: state.append_history(request.message, reply_text))
         
-        # 🎮 이벤트 시스템 처리
-        event_manager = EventManager(db)
+        async def commit_node(triggers, _emotion_result, _history):
+            # 호감도 UPDATE를 같은 트랜잭션에서 실행하고, 등록된 INSERT들과 함께 한 번에 커밋
+            affection_manager = AffectionManager(uow.session, session_states, unit_of_work=uow)
+            async with uow.writing():
+                old_affection, current_affection, _ = await affection_manager.apply_triggers(user_name, triggers)
+                await uow.commit()
+            print("Saved conversation to database.")
+            
+            # 호감도 변화 데이터 준비
+            return {
+                'current_affection': current_affection,
+                'old_affection': old_affection,
+                'affection_change': current_affection - old_affection,
+                'relationship_stage': affection_manager.get_relationship_stage(current_affection)
+            }
         
-        # 호감도 변화 데이터 준비
-        old_affection = current_affection - affection_change
-        affection_data = {
-            'current_affection': current_affection,
-            'old_affection': old_affection,
-            'affection_change': affection_change,
-            'relationship_stage': affection_manager.get_relationship_stage(current_affection)
-        }
+        async def events_node(affection_data, emotion_result):
+            # 🎮 이벤트 시스템 처리 (DB를 쓰지 않음)
+            event_manager = EventManager(None)
+            events = event_manager.process_conversation_events(
+                user_name,
+                request.message,
+                reply_text,
+                emotion_result,
+                affection_data
+            )
+            return [event_manager.format_event_for_ui(event) for event in events]
         
-        # 이벤트 처리 및 체크
-        events = event_manager.process_conversation_events(
-            request.user_name or "사용자",
-            request.message,
-            reply_text,
-            emotion_result,
-            affection_data
-        )
+        graph = TaskGraph()
+        graph.add("affection", affection_branch)
+        graph.add("emotion", emotion_branch)
+        graph.add("history", history_branch)
+        graph.add("commit", commit_node, deps=("affection", "emotion", "history"))
+        graph.add("events", events_node, deps=("commit", "emotion"))
+        results = await graph.run()
+    
+    affection_data = results["commit"]
+    emotion_result = results["emotion"]
+    
+    # 감정 정보와 호감도 정보 응답 반환
+    response_data = {
+        "reply": reply_text,
+        # 감정 시스템 2단계
+        **emotion_response_fields(emotion_result),
+        # 호감도 시스템
+        "affection_level": affection_data["current_affection"],
+        "affection_change": affection_data["affection_change"],
+        # 지연 감정 분석
+        "turn_id": turn_id,
+        "emotion_pending": defer_emotion
+    }
+    
+    # 이벤트가 있으면 추가
+    if results["events"]:
+        response_data["events"] = results["events"]
+    
+    return response_data
+
+# Updated chat endpoint with DB session dependency  
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest):
+    if not llm_backend:
+        raise HTTPException(status_code=503, detail=LLM_NOT_CONFIGURED)
+    
+    try:
+        print(f"Received message from {request.user_name or 'Unknown'}: {request.message}")
         
-        # 감정 정보와 호감도 정보 응답 반환
-        response_data = {
-            "reply": reply_text,
-            # 감정 시스템 2단계
-            "emotion": emotion_result["emotion"],
-            "emotion_intensity": emotion_result["intensity"],
-            "emotion_emoji": emotion_result["emoji"],
-            "emotion_color": emotion_result["color"],
-            "emotion_reason": emotion_result["reason"],
-            "emotion_confidence": emotion_result["confidence"],
-            # 호감도 시스템
-            "affection_level": current_affection,
-            "affection_change": affection_change
-        }
+        full_prompt = await build_chat_prompt(request)
         
-        # 이벤트가 있으면 추가
-        if events:
-            response_data["events"] = [event_manager.format_event_for_ui(event) for event in events]
+        # API call with full context (awaited so the worker can serve other turns meanwhile)
+        emotion_data = None
+        if SINGLE_CALL_MODE:
+            # 답변과 감정을 한 번에 받아 두 번째 감정 분석 호출을 생략
+            response_text = await llm_backend.generate_async(
+                full_prompt + EmotionAnalyzer.create_structured_reply_instructions(),
+                json_mode=True
+            )
+            reply_text, emotion_data = EmotionAnalyzer.parse_structured_reply(response_text)
+        else:
+            reply_text = await llm_backend.generate_async(full_prompt)
         
+        response_data = await process_chat_turn(request, reply_text, emotion_data)
         return ChatResponse(**response_data)
 
     except Exception as e:
         print(f"An error occurred in /chat: {e}")
         raise HTTPException(status_code=500, detail=f"An error occurred while processing the chat: {e}")
 
+# 대화 기록 조회 (keyset 페이지네이션)
+# 페이지 크기 기본값과 한 번에 요청할 수 있는 최대값
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "200"))
+
+@app.get("/users/{user_name}/history", response_model=ChatHistoryPage)
+async def user_history_endpoint(
+    user_name: str,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    before: str = Query(None, description="이 커서보다 오래된 턴 (이전 페이지의 next_cursor)"),
+    since: str = Query(None, description="이 커서보다 새로운 턴만 오래된 순으로 (latest_cursor로 증분 동기화)"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    사용자의 대화 기록을 (timestamp, id) 커서로 페이지 단위 조회합니다.
+    OFFSET을 쓰지 않으므로 긴 대화의 어느 페이지든 비용이 같습니다.
+    - 커서 없이: 최신 limit개 (최신 순), next_cursor를 before로 넘기면 그 이전 페이지
+    - since: 그 이후에 추가된 턴만 (오래된 순), next_cursor가 있으면 since로 이어서 요청
+    """
+    if before and since:
+        raise HTTPException(status_code=400, detail="before and since cannot be used together")
+    if history_writer:
+        # 방금 끝난 턴도 보이도록 큐에 남은 기록부터 INSERT
+        await history_writer.flush()
+    try:
+        return await crud.get_chat_history_page(db, user_name, limit, before=before, since=since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# 대화 검색 (FTS5 trigram 인덱스)
+# 페이지 크기 기본값과 한 번에 요청할 수 있는 최대값
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+# 관련도 순위를 매기는 최근 일치 항목 수 (아주 흔한 단어도 비용이 기록 길이에 비례하지 않도록)
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "1000"))
+
+@app.get("/users/{user_name}/search", response_model=ChatSearchPage)
+async def user_search_endpoint(
+    user_name: str,
+    q: str = Query(..., min_length=1, description="검색어 (공백으로 나눈 단어를 모두 포함하는 턴을 찾음)"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, description="이전 페이지의 next_offset"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    사용자의 대화 기록에서 검색어가 들어간 턴을 관련도 순으로 찾습니다 (사용자 메시지와 답변 모두).
+    세 글자 이상인 단어는 trigram 인덱스로 찾으므로 LIKE처럼 기록 전체를 훑지 않고,
+    두 글자 이하 단어는 인덱스로 찾은 턴 안에서 거릅니다 (모든 단어가 짧으면 그 사용자의 기록을 최신 순으로 훑음).
+    순위는 가장 최근에 일치한 SEARCH_RANK_WINDOW개 안에서 매깁니다.
+    """
+    if history_writer:
+        await history_writer.flush()
+    try:
+        return await crud.search_chat_history(db, user_name, q, limit, offset, SEARCH_RANK_WINDOW)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+# 감정/호감도 타임라인 (미리 집계한 버킷)
+# 버킷 수 기본값과 한 번에 요청할 수 있는 최대값
+TIMELINE_BUCKETS = int(os.getenv("TIMELINE_BUCKETS", "48"))
+TIMELINE_MAX_BUCKETS = int(os.getenv("TIMELINE_MAX_BUCKETS", "500"))
+
+@app.get("/users/{user_name}/timeline", response_model=Timeline)
+async def user_timeline_endpoint(
+    user_name: str,
+    resolution: Literal["minute", "hour", "day"] = "hour",
+    buckets: int = Query(TIMELINE_BUCKETS, ge=1, le=TIMELINE_MAX_BUCKETS),
+    end: Optional[datetime] = Query(None, description="마지막 버킷이 포함할 시각 (생략하면 현재)"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    감정 분포, 평균 감정 강도, 호감도를 분/시/일 버킷으로 반환합니다.
+    턴마다 미리 집계해 둔 버킷을 범위로 읽으므로 응답 크기와 비용은 기록 길이가 아니라 버킷 수에 비례합니다.
+    """
+    if history_writer:
+        await history_writer.flush()
+    try:
+        return await crud.get_timeline(db, user_name, resolution, buckets, end)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+# 지연 감정 분석 결과 조회
+@app.get("/chat/turns/{turn_id}/emotion", response_model=TurnEmotion)
+async def turn_emotion_endpoint(turn_id: str):
+    """
+    지연 감정 분석 모드에서 ChatResponse.turn_id로 해당 턴의 감정을 조회합니다.
+    status가 pending이면 직전 감정(임시값)이 담겨 있으므로 잠시 후 다시 요청하면 됩니다.
+    """
+    entry = deferred_emotions.get(turn_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired turn_id")
+    
+    return TurnEmotion(
+        turn_id=turn_id,
+        status=entry["status"],
+        **emotion_response_fields(entry["emotion"])
+    )
+
+# 감정 분류기 적중률 (로컬 키워드 vs LLM)
+@app.get("/stats/emotion-classifier")
+async def emotion_classifier_stats_endpoint():
+    """
+    로컬 키워드 분류기의 적중/LLM 위임 횟수와, LLM으로 넘어간 턴에서
+    로컬 추정이 LLM 라벨과 일치한 비율(확신도 구간별)을 반환합니다.
+    EMOTION_LOCAL_CONFIDENCE_THRESHOLD 조정에 사용합니다.
+    """
+    return {
+        "threshold": EMOTION_LOCAL_CONFIDENCE_THRESHOLD,
+        **EmotionAnalyzer.get_classifier_stats()
+    }
+
+# 감정 분석 캐시 적중률
+@app.get("/stats/emotion-cache")
+async def emotion_cache_stats_endpoint():
+    """감정 분석 캐시의 크기, 적중률, 만료/축출 횟수를 반환합니다."""
+    return emotion_cache.stats()
+
+# 세션 상태 캐시 현황
+@app.get("/stats/session-state")
+async def session_state_stats_endpoint():
+    """메모리에 올라온 사용자 수, 기록 대기 중인 사용자 수, 적중률, 메모리 사용량을 반환합니다."""
+    return session_states.stats()
+
+# 기록 큐 현황
+@app.get("/stats/history-writer")
+async def history_writer_stats_endpoint():
+    """대화/감정 기록 큐에 남은 행 수, 기록한 행 수, flush 횟수와 평균 배치 크기를 반환합니다."""
+    if not history_writer:
+        return {"enabled": False}
+    return {"enabled": True, **history_writer.stats()}
+
+# 장기 기억 인덱스 현황
+@app.get("/stats/memory-index")
+async def memory_index_stats_endpoint():
+    """장기 기억 인덱스의 열린 사용자 수, 색인한 행 수, 검색 횟수와 평균 검색 시간을 반환합니다."""
+    if not memory_index:
+        return {"enabled": False}
+    return {"enabled": True, **memory_index.stats()}
+
+# 퇴역 사용자 데이터 정리 현황
+@app.get("/stats/user-purge")
+async def user_purge_stats_endpoint():
+    """백그라운드에서 정리한 퇴역 사용자 수, 지운 행 수, 배치 수를 반환합니다."""
+    return user_data_purger.stats()
+
+def format_sse(event: str, data: dict) -> str:
+    """Server-Sent Events 한 건을 직렬화합니다."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Streaming chat endpoint (SSE)
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    답변 토큰을 도착하는 대로 SSE로 전송합니다.
+    토큰을 그대로 흘려보내야 하므로 단일 호출 모드와 관계없이 감정은 별도로 분석합니다.
+
+    이벤트 순서:
+      - token: {"text": "..."} (답변 조각, 여러 번)
+      - done:  ChatResponse 전체 (감정/호감도/이벤트 트레일러)
+      - error: {"detail": "..."} (처리 중 오류)
+    """
+    if not llm_backend:
+        raise HTTPException(status_code=503, detail=LLM_NOT_CONFIGURED)
+    
+    print(f"Received streaming message from {request.user_name or 'Unknown'}: {request.message}")
+
+    async def event_stream():
+        try:
+            full_prompt = await build_chat_prompt(request)
+            
+            reply_parts = []
+            async for text in llm_backend.stream(full_prompt):
+                reply_parts.append(text)
+                yield format_sse("token", {"text": text})
+            
+            response_data = await process_chat_turn(request, "".join(reply_parts))
+            yield format_sse("done", jsonable_encoder(ChatResponse(**response_data)))
+        
+        except Exception as e:
+            print(f"An error occurred in /chat/stream: {e}")
+            yield format_sse("error", {"detail": f"An error occurred while processing the chat: {e}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # It's good practice to have a main block to run the server
 if __name__ == "__main__":
     print("Starting FastAPI server...")
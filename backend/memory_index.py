@@ -0,0 +1,429 @@
+"""
+장기 기억 검색 (사용자별 로컬 벡터 인덱스)
+프롬프트의 최근 대화(세션 상태의 링 버퍼)보다 오래된 턴 중 새 메시지와 관련된 턴을 찾아 함께 넣기 위한 인덱스입니다.
+외부 임베딩 서비스 없이 각 턴을 글자 2/3-gram 해시 벡터로 만들어 사용자별 메모리 매핑 파일에 쌓고, 두 단계로 검색합니다:
+    1. 모든 턴의 256비트 SimHash 서명 중 앞 128비트와의 해밍 거리를 numpy로 한 번에 계산해 가까운 후보를 넉넉히 고르고
+       (턴당 16바이트만 읽음), 그 후보만 256비트 전체 거리로 다시 좁힘
+    2. 남은 후보의 int8 벡터로 정확한 코사인 유사도를 계산해 상위 k개를 고름
+인덱스는 chat_history에서 만든 파생 데이터입니다. 새 기록은 검색 전에 (timestamp, id) 커서 이후의 행을 읽어 따라잡고,
+파일이 없거나 DB와 맞지 않으면 지우고 처음부터 다시 만듭니다.
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+from models import ChatHistory
+
+# 파일 형식 (바뀌면 기존 인덱스를 지우고 다시 만듦)
+INDEX_VERSION = 1
+VECTOR_DIM = 512        # 해시 벡터 차원 (int8로 저장, 턴당 512바이트)
+SIGNATURE_BITS = 256    # SimHash 서명 비트 수 (턴당 32바이트)
+COARSE_BITS = 128       # 모든 턴과 비교하는 앞부분 비트 수 (해밍 거리가 uint8에 들어가도록 255 이하)
+NGRAM_SIZES = (2, 3)
+BOT_REPLY_WEIGHT = 0.5  # 검색어는 사용자 메시지이므로 턴 벡터에서 답변 쪽은 절반 가중치
+SAMPLE_STRIDE = 16      # 후보를 자를 거리 기준을 추정할 때 쓰는 표본 간격
+INITIAL_CAPACITY = 1024
+
+SIGNATURE_WORDS = SIGNATURE_BITS // 64
+COARSE_WORDS = COARSE_BITS // 64
+_NON_WORD = re.compile(r"[^\w]+")
+_FNV_PRIME = np.uint64(0x100000001B3)
+_MIX = np.uint64(0xFF51AFD7ED558CCD)
+_MIX_SHIFT = np.uint64(33)
+_SIGN_SHIFT = np.uint64(63)
+# 서명용 고정 랜덤 투영 (시드가 바뀌면 저장된 서명과 비교할 수 없으므로 INDEX_VERSION도 올릴 것)
+_PROJECTION = np.random.default_rng(20240611).standard_normal((VECTOR_DIM, SIGNATURE_BITS)).astype(np.float32)
+
+
+def _ngram_hashes(text: str) -> np.ndarray:
+    """소문자로 바꾸고 문장부호를 공백으로 합친 텍스트의 글자 n-gram 64비트 해시 (프로세스와 무관하게 같은 값)"""
+    words = _NON_WORD.sub(" ", text.lower()).strip()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    codes = np.frombuffer(f" {words} ".encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = []
+    for size in NGRAM_SIZES:
+        count = len(codes) - size + 1
+        if count <= 0:
+            continue
+        ngram = np.full(count, size, dtype=np.uint64)
+        for offset in range(size):
+            ngram = (ngram * _FNV_PRIME) ^ codes[offset:offset + count]
+        hashes.append(ngram)
+    mixed = np.concatenate(hashes)
+    mixed ^= mixed >> _MIX_SHIFT
+    mixed *= _MIX
+    mixed ^= mixed >> _MIX_SHIFT
+    return mixed
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _hash_vector(text: str) -> np.ndarray:
+    """n-gram 해시를 VECTOR_DIM개 버킷에 부호를 붙여 더한 단위 벡터 (feature hashing)"""
+    hashes = _ngram_hashes(text)
+    signs = np.where(hashes >> _SIGN_SHIFT, -1.0, 1.0)
+    return _unit(np.bincount((hashes % VECTOR_DIM).astype(np.intp), weights=signs, minlength=VECTOR_DIM))
+
+
+def embed(user_message: str, bot_reply: str = "") -> np.ndarray:
+    """턴(또는 검색어)의 단위 해시 벡터 (float32)"""
+    vector = _hash_vector(user_message)
+    if bot_reply:
+        vector = vector + BOT_REPLY_WEIGHT * _hash_vector(bot_reply)
+    return _unit(vector).astype(np.float32)
+
+
+def signature(vector: np.ndarray) -> np.ndarray:
+    """SimHash 서명: 고정 랜덤 투영의 부호 비트 (uint64 SIGNATURE_WORDS개, 해밍 거리가 각도에 비례)"""
+    nonzero = np.flatnonzero(vector)
+    projected = vector[nonzero] @ _PROJECTION[nonzero]
+    return np.packbits(projected > 0, bitorder="little").view(np.uint64)
+
+
+def quantize(vector: np.ndarray) -> np.ndarray:
+    """단위 벡터를 최댓값 기준 int8로 양자화 (코사인 계산 시 행마다 다시 정규화하므로 배율은 저장하지 않음)"""
+    peak = np.abs(vector).max()
+    if not peak:
+        return np.zeros(VECTOR_DIM, dtype=np.int8)
+    return np.round(vector * (127 / peak)).astype(np.int8)
+
+
+def coarse_candidates(distances: np.ndarray, count: int) -> np.ndarray:
+    """
+    해밍 거리가 작은 행을 적어도 count개 (같은 거리의 행은 함께) 고른 행 번호
+    전체 정렬 대신 SAMPLE_STRIDE행마다 하나씩 뽑은 표본의 거리 분포로 기준 거리를 추정하고,
+    기준 이하인 행이 모자라면 기준을 하나씩 올립니다.
+    """
+    rows = len(distances)
+    if rows <= count:
+        return np.arange(rows)
+    cumulative = np.cumsum(np.bincount(distances[::SAMPLE_STRIDE], minlength=COARSE_BITS + 1)) * SAMPLE_STRIDE
+    threshold = int(np.searchsorted(cumulative, count))
+    while True:
+        within = distances <= threshold
+        if threshold >= COARSE_BITS or np.count_nonzero(within) >= count:
+            return np.flatnonzero(within)
+        threshold += 1
+
+
+class _UserIndex:
+    """
+    사용자 한 명(users 행 하나)의 인덱스 파일
+    signatures는 해밍 거리를 서명 단어별로 연속 메모리에서 계산하도록 (SIGNATURE_WORDS, capacity) 열 우선으로,
+    vectors/entry_ids는 (capacity, ...) 행 우선으로 저장합니다. 파일은 capacity만큼 미리 잡고 두 배씩 늘리며,
+    유효한 행 수와 커서는 닫을 때(와 파일을 늘릴 때) 행을 디스크에 쓴 뒤 meta.json에 함께 기록합니다.
+    그 전에 프로세스가 죽으면 meta.json 뒤의 행은 무시되고, 같은 행을 커서부터 DB에서 다시 읽어 덮어씁니다.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self.capacity = 0
+        self.cursor: Optional[Tuple[str, int]] = None  # 마지막으로 색인한 (저장된 timestamp, id)
+        self.verified = False  # 디스크에서 연 커서가 현재 DB의 행과 맞는지 확인했는지
+        self.dirty = False  # meta.json에 기록하지 않은 행이 있는지
+        self.signatures = self.vectors = self.entry_ids = None
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if (meta["version"], meta["vector_dim"], meta["signature_bits"]) != (INDEX_VERSION, VECTOR_DIM, SIGNATURE_BITS):
+                raise ValueError("index format changed")
+            self.rows, self.capacity = meta["rows"], meta["capacity"]
+            self.cursor = tuple(meta["cursor"]) if meta["cursor"] else None
+            # 파일을 늘리는 도중 멈춘 경우 등
+            expected_sizes = {"signatures.u64": SIGNATURE_WORDS * 8, "vectors.i8": VECTOR_DIM, "ids.i64": 8}
+            if self.capacity and any(os.path.getsize(self._file(name)) != row_bytes * self.capacity
+                                     for name, row_bytes in expected_sizes.items()):
+                raise ValueError("file sizes do not match meta.json")
+            if self.capacity:
+                self._map()
+        except FileNotFoundError:
+            self.reset()
+        except Exception as e:
+            print(f"기억 인덱스를 다시 만듭니다 ({self.path}): {e}")
+            self.reset()
+
+    def _map(self):
+        self.signatures = np.memmap(self._file("signatures.u64"), dtype=np.uint64, mode="r+",
+                                    shape=(SIGNATURE_WORDS, self.capacity))
+        self.vectors = np.memmap(self._file("vectors.i8"), dtype=np.int8, mode="r+", shape=(self.capacity, VECTOR_DIM))
+        self.entry_ids = np.memmap(self._file("ids.i64"), dtype=np.int64, mode="r+", shape=(self.capacity,))
+
+    def close(self):
+        """행을 디스크에 쓰고 meta.json을 갱신한 뒤 매핑을 닫습니다"""
+        for array in (self.signatures, self.vectors, self.entry_ids):
+            if array is not None:
+                array.flush()
+        if self.dirty:
+            self._save_meta()
+        self._unmap()
+
+    def _unmap(self):
+        # 매핑을 닫아야 (Windows에서도) 파일 크기를 바꾸거나 지울 수 있음
+        self.signatures = self.vectors = self.entry_ids = None
+
+    def reset(self):
+        """파일을 모두 지우고 빈 인덱스로 시작합니다"""
+        self._unmap()
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self.rows, self.capacity, self.cursor = 0, 0, None
+        self.verified = True
+        self._save_meta()
+
+
+    def _save_meta(self):
+        meta = {
+            "version": INDEX_VERSION,
+            "vector_dim": VECTOR_DIM,
+            "signature_bits": SIGNATURE_BITS,
+            "rows": self.rows,
+            "capacity": self.capacity,
+            "cursor": list(self.cursor) if self.cursor else None,
+        }
+        temp_path = self._file("meta.json.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self._file("meta.json"))
+        self.dirty = False
+
+    def _grow(self, needed: int):
+        capacity = max(INITIAL_CAPACITY, self.capacity * 2, needed)
+        old_signatures = np.array(self.signatures[:, :self.rows]) if self.rows else None
+        self.close()
+        # 행 우선 파일은 뒤를 늘리기만 하면 되고, 열 우선인 서명은 새 배치로 옮겨 씀
+        for name, row_bytes in (("vectors.i8", VECTOR_DIM), ("ids.i64", 8)):
+            with open(self._file(name), "ab") as f:
+                f.truncate(capacity * row_bytes)
+        temp_path = self._file("signatures.u64.tmp")
+        signatures = np.memmap(temp_path, dtype=np.uint64, mode="w+", shape=(SIGNATURE_WORDS, capacity))
+        if old_signatures is not None:
+            signatures[:, :self.rows] = old_signatures
+        signatures.flush()
+        del signatures
+        os.replace(temp_path, self._file("signatures.u64"))
+        self.capacity = capacity
+        self._map()
+        self._save_meta()
+
+    def append(self, entry_ids: np.ndarray, signatures: np.ndarray, vectors: np.ndarray, cursor: Tuple[str, int]):
+        """색인한 행들을 뒤에 붙이고 커서를 옮깁니다 (signatures: (n, SIGNATURE_WORDS), vectors: (n, VECTOR_DIM) int8)"""
+        count = len(entry_ids)
+        if self.rows + count > self.capacity:
+            self._grow(self.rows + count)
+        end = self.rows + count
+        self.signatures[:, self.rows:end] = signatures.T
+        self.vectors[self.rows:end] = vectors
+        self.entry_ids[self.rows:end] = entry_ids
+        self.rows = end
+        self.cursor = cursor
+        self.dirty = True
+
+
+class MemoryIndex:
+    """
+    사용자별 장기 기억 인덱스
+
+    Args:
+        directory: 인덱스 파일을 둘 폴더 (users.id마다 하위 폴더 하나, /new-user 뒤의 새 세대는 새 폴더)
+        coarse_candidates: 앞 COARSE_BITS비트 거리로 고른 뒤 전체 서명 거리로 다시 비교할 후보 수
+        candidates: 전체 서명 거리로 고른 뒤 정확한 코사인 유사도를 다시 계산할 후보 수
+        sync_batch: 검색 한 번에 새로 색인할 최대 행 수 (긴 기존 기록은 여러 턴에 걸쳐 따라잡음)
+        max_open_users: 파일을 열어 둘 최대 사용자 수 (오래 안 쓴 사용자부터 닫음)
+    """
+
+    def __init__(self, directory: str, coarse_candidates: int = 1024, candidates: int = 64,
+                 sync_batch: int = 200, max_open_users: int = 64):
+        self.directory = directory
+        self.coarse_candidates = coarse_candidates
+        self.candidates = candidates
+        self.sync_batch = sync_batch
+        self.max_open_users = max_open_users
+        self._open: "OrderedDict[int, _UserIndex]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # 턴마다 실행하는 쿼리는 한 번만 만들어 두고 값만 바꿔 실행 (쿼리 객체를 만드는 비용이 검색 자체보다 큼)
+        # ORM 객체 없이 필요한 열만 읽음
+        turn_columns = (ChatHistory.id, ChatHistory.user_message, ChatHistory.bot_reply)
+        page_query = crud.chat_history_page_query(
+            bindparam("user_id"), sync_batch, since=(bindparam("cursor_timestamp"), bindparam("cursor_id"))
+        )
+        self._sync_query = page_query.with_only_columns(*turn_columns, page_query.selected_columns.cursor_timestamp)
+        self._entries_query = crud.chat_entries_query(
+            bindparam("user_id"), bindparam("entry_ids", expanding=True)
+        ).with_only_columns(*turn_columns)
+        # 해밍 거리 계산용 작업 버퍼 (이벤트 루프 하나에서만 쓰므로 공유)
+        self._xor = np.empty(0, dtype=np.uint64)
+        self._distances = np.empty(0, dtype=np.uint8)
+        self._bit_counts = np.empty(0, dtype=np.uint8)
+        self.rows_indexed = 0
+        self.rebuilds = 0
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    def _index(self, user_id: int) -> _UserIndex:
+        index = self._open.get(user_id)
+        if index is None:
+            index = _UserIndex(os.path.join(self.directory, str(user_id)))
+            self._open[user_id] = index
+            while len(self._open) > self.max_open_users:
+                self._open.popitem(last=False)[1].close()
+        else:
+            self._open.move_to_end(user_id)
+        return index
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        return self._locks.setdefault(user_id, asyncio.Lock())
+
+    def add(self, user_id: int, entries: Sequence[Tuple[int, str, str]], cursor: Tuple[str, int]) -> int:
+        """(chat_history id, 사용자 메시지, 답변) 목록을 색인하고 커서를 옮깁니다"""
+        if not entries:
+            return 0
+        vectors = [embed(user_message, bot_reply) for _, user_message, bot_reply in entries]
+        self._index(user_id).append(
+            np.array([entry_id for entry_id, _, _ in entries], dtype=np.int64),
+            np.stack([signature(vector) for vector in vectors]),
+            np.stack([quantize(vector) for vector in vectors]),
+            cursor,
+        )
+        self.rows_indexed += len(entries)
+        return len(entries)
+
+    async def sync(self, db: AsyncSession, user_id: int) -> int:
+        """커서 이후의 chat_history 행을 최대 sync_batch개 색인하고 색인한 행 수를 반환합니다"""
+        async with self._lock(user_id):
+            index = self._index(user_id)
+            if not index.verified:
+                # DB 파일을 새로 만들어 id가 다시 쓰인 경우 등 커서 행이 그대로 있는지 확인
+                if index.cursor and tuple(
+                    (await db.execute(crud.chat_entry_position_query(user_id, index.cursor[1]))).first() or ()
+                ) != index.cursor:
+                    print(f"기억 인덱스가 DB와 맞지 않아 다시 만듭니다 (user_id={user_id})")
+                    self.rebuilds += 1
+                    index.reset()
+                index.verified = True
+            cursor_timestamp, cursor_id = index.cursor or ("", 0)
+            rows = (await db.execute(
+                self._sync_query, {"user_id": user_id, "cursor_timestamp": cursor_timestamp, "cursor_id": cursor_id}
+            )).all()[:self.sync_batch]
+            if not rows:
+                return 0
+            # DB를 기다리는 동안 다른 사용자 때문에 파일이 닫혔을 수 있으므로 다시 가져옴
+            return self.add(
+                user_id,
+                [(row.id, row.user_message, row.bot_reply) for row in rows],
+                (rows[-1].cursor_timestamp, rows[-1].id),
+            )
+
+    def _coarse_hamming(self, signatures: np.ndarray, query: np.ndarray, rows: int) -> np.ndarray:
+        """앞 rows개 턴과 서명 앞 COARSE_BITS비트의 해밍 거리 (uint8, 작업 버퍼를 재사용하므로 다음 호출 전까지만 유효)"""
+        if len(self._xor) < rows:
+            size = max(rows, 2 * len(self._xor))
+            self._xor = np.empty(size, dtype=np.uint64)
+            self._distances = np.empty(size, dtype=np.uint8)
+            self._bit_counts = np.empty(size, dtype=np.uint8)
+        xor, distances, bit_counts = self._xor[:rows], self._distances[:rows], self._bit_counts[:rows]
+        distances[:] = 0
+        for word in range(COARSE_WORDS):
+            np.bitwise_xor(signatures[word, :rows], query[word], out=xor)
+            np.bitwise_count(xor, out=bit_counts)
+            np.add(distances, bit_counts, out=distances)
+        return distances
+
+    def search(self, user_id: int, text: str, limit: int, exclude_recent: int = 0,
+               min_similarity: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        색인된 턴 중 text와 코사인 유사도가 높은 순으로 [(chat_history id, 유사도)]를 반환합니다
+
+        Args:
+            exclude_recent: 가장 최근에 색인한 행 중 제외할 수 (이미 프롬프트에 들어가는 최근 대화)
+            min_similarity: 이보다 유사도가 낮은 턴은 제외
+        """
+        started = time.perf_counter()
+        index = self._index(user_id)
+        rows = index.rows - exclude_recent
+        query = embed(text)
+        if rows <= 0 or not query.any():
+            return []
+        query_signature = signature(query)
+        coarse = self._coarse_hamming(index.signatures, query_signature, rows)
+        candidates = coarse_candidates(coarse, self.coarse_candidates)
+        # 후보만 나머지 서명 비트까지 더한 전체 거리로 좁힘
+        distances = coarse[candidates].astype(np.uint16)
+        for word in range(COARSE_WORDS, SIGNATURE_WORDS):
+            distances += np.bitwise_count(index.signatures[word, candidates] ^ query_signature[word])
+        if len(candidates) > self.candidates:
+            candidates = candidates[np.argpartition(distances, self.candidates - 1)[:self.candidates]]
+        vectors = index.vectors[candidates].astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        similarities = (vectors @ query) / norms
+        order = np.argsort(-similarities)[:limit]
+        hits = [
+            (int(index.entry_ids[candidates[position]]), float(similarities[position]))
+            for position in order
+            if similarities[position] >= min_similarity
+        ]
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return hits
+
+    async def recall(self, db: AsyncSession, user_id: int, text: str, limit: int, exclude_recent: int = 0,
+                     min_similarity: float = 0.0) -> List:
+        """새 기록을 따라잡은 뒤 관련도 순으로 (id, user_message, bot_reply) 행 목록을 반환합니다"""
+        await self.sync(db, user_id)
+        hits = self.search(user_id, text, limit, exclude_recent, min_similarity)
+        if not hits:
+            return []
+        entries = {
+            chat.id: chat
+            for chat in (await db.execute(
+                self._entries_query, {"user_id": user_id, "entry_ids": [entry_id for entry_id, _ in hits]}
+            )).all()
+        }
+        return [entries[entry_id] for entry_id, _ in hits if entry_id in entries]
+
+    async def drop(self, user_id: int):
+        """사용자 데이터 세대의 인덱스 파일을 지웁니다 (퇴역 사용자 정리 시)"""
+        async with self._lock(user_id):
+            index = self._open.pop(user_id, None)
+            if index is not None:
+                index.close()
+            shutil.rmtree(os.path.join(self.directory, str(user_id)), ignore_errors=True)
+        self._locks.pop(user_id, None)
+
+    def close(self):
+        """열린 인덱스 파일을 모두 닫습니다"""
+        while self._open:
+            self._open.popitem()[1].close()
+
+    def stats(self) -> Dict:
+        return {
+            "open_users": len(self._open),
+            "rows_indexed": self.rows_indexed,
+            "rebuilds": self.rebuilds,
+            "searches": self.searches,
+            "average_search_ms": round(self.search_seconds / self.searches * 1000, 3) if self.searches else 0.0,
+            "coarse_candidates": self.coarse_candidates,
+            "candidates": self.candidates,
+        }
@@ -0,0 +1,530 @@
+"""
+스키마 마이그레이션
+
+create_all은 없는 테이블만 만들 뿐, 이미 있는 chat_history.db의 테이블과 인덱스는 바꾸지 않습니다.
+스키마 변경은 MIGRATIONS에 버전 번호를 붙여 추가하고, create_db_and_tables가
+schema_migrations 테이블에 기록되지 않은 것만 버전 순서로 적용합니다.
+
+- 새 DB: create_all로 최신 스키마를 만들고 모든 마이그레이션을 적용된 것으로 기록
+- 기존 DB: 밀린 마이그레이션을 하나씩 각자의 트랜잭션에서 적용한 뒤 create_all (새로 생긴 테이블만 생성)
+
+마이그레이션은 작성 당시의 SQL로 고정합니다 (이후 models.py가 바뀌어도 같은 결과가 나오도록).
+
+사용법 (backend 폴더에서):
+    python migrations.py             # 밀린 마이그레이션 적용
+    python migrations.py --status
+    python migrations.py --explain   # 자주 쓰는 쿼리가 인덱스를 쓰는지 실행 계획 확인 (SQLite)
+"""
+
+import argparse
+import sys
+from contextlib import contextmanager
+from typing import Callable, List, Set, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+
+# --- 마이그레이션 ---
+
+def _table_names(connection: Connection) -> Set[str]:
+    return set(inspect(connection).get_table_names())
+
+
+def _hot_query_indexes(connection: Connection):
+    """사용자별 조회에 (user_name, timestamp) 복합 인덱스를 추가하고 중복 인덱스를 정리"""
+    tables = _table_names(connection)
+    for table, statement in (
+        ("chat_history", "CREATE INDEX IF NOT EXISTS ix_chat_history_user_name_timestamp ON chat_history (user_name, timestamp)"),
+        ("emotion_history", "CREATE INDEX IF NOT EXISTS ix_emotion_history_user_name_timestamp ON emotion_history (user_name, timestamp)"),
+        # 복합 인덱스의 앞부분과 같은 인덱스
+        (None, "DROP INDEX IF EXISTS ix_emotion_history_user_name"),
+        # INTEGER PRIMARY KEY(rowid)와 같은 인덱스 (INSERT마다 B-tree 하나를 더 갱신할 뿐)
+        (None, "DROP INDEX IF EXISTS ix_chat_history_id"),
+        (None, "DROP INDEX IF EXISTS ix_emotion_history_id"),
+        (None, "DROP INDEX IF EXISTS ix_user_emotions_id"),
+        (None, "DROP INDEX IF EXISTS ix_user_affection_id"),
+    ):
+        if table is None or table in tables:
+            connection.exec_driver_sql(statement)
+
+
+# 0002에서 user_id 참조로 다시 만드는 테이블: (이름, CREATE TABLE, 옛 테이블 t에서 옮길 열, users u와의 조인, 인덱스)
+_USER_ID_TABLES = [
+    (
+        "chat_history",
+        """CREATE TABLE chat_history_new (
+            id INTEGER NOT NULL,
+            user_message VARCHAR NOT NULL,
+            bot_reply VARCHAR NOT NULL,
+            user_id INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )""",
+        "t.id, t.user_message, t.bot_reply, u.id, t.timestamp",
+        "LEFT JOIN",
+        ["CREATE INDEX ix_chat_history_user_id_timestamp ON chat_history (user_id, timestamp)"],
+    ),
+    (
+        "user_emotions",
+        """CREATE TABLE user_emotions_new (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            current_emotion VARCHAR,
+            emotion_intensity FLOAT,
+            last_updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )""",
+        "t.id, u.id, t.current_emotion, t.emotion_intensity, t.last_updated",
+        "JOIN",
+        ["CREATE UNIQUE INDEX ix_user_emotions_user_id ON user_emotions (user_id)"],
+    ),
+    (
+        "user_affection",
+        """CREATE TABLE user_affection_new (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            affection_level INTEGER,
+            total_conversations INTEGER,
+            first_met_date DATE,
+            last_interaction DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )""",
+        "t.id, u.id, t.affection_level, t.total_conversations, t.first_met_date, t.last_interaction",
+        "JOIN",
+        ["CREATE UNIQUE INDEX ix_user_affection_user_id ON user_affection (user_id)"],
+    ),
+    (
+        "emotion_history",
+        """CREATE TABLE emotion_history_new (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            emotion VARCHAR NOT NULL,
+            intensity INTEGER,
+            reason TEXT,
+            confidence FLOAT,
+            trigger_type VARCHAR,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )""",
+        "t.id, u.id, t.emotion, t.intensity, t.reason, t.confidence, t.trigger_type, t.timestamp",
+        "JOIN",
+        ["CREATE INDEX ix_emotion_history_user_id_timestamp ON emotion_history (user_id, timestamp)"],
+    ),
+]
+
+
+def _users_table(connection: Connection):
+    """user_name 문자열을 users 테이블의 정수 키로 옮기고, 사용자별 테이블을 user_id 참조로 다시 만듦"""
+    tables = _table_names(connection)
+    connection.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id)
+        )"""
+    )
+    connection.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_name ON users (name)")
+
+    # 기존 이름을 처음 등장한 순서대로 등록 (id 순서 = 첫 대화 순서)
+    sources = [
+        f"SELECT user_name, {first_seen} AS first_seen FROM {table} WHERE user_name IS NOT NULL"
+        for table, first_seen in (
+            ("chat_history", "timestamp"),
+            ("emotion_history", "timestamp"),
+            ("user_emotions", "NULL"),
+            ("user_affection", "NULL"),
+        )
+        if table in tables
+    ]
+    if sources:
+        connection.exec_driver_sql(
+            "INSERT OR IGNORE INTO users (name, created_at) "
+            "SELECT user_name, COALESCE(MIN(first_seen), CURRENT_TIMESTAMP) "
+            f"FROM ({' UNION ALL '.join(sources)}) "
+            "GROUP BY user_name ORDER BY MIN(first_seen), user_name"
+        )
+
+    # SQLite는 열 삭제/제약 변경이 제한적이라 새 테이블로 옮긴 뒤 이름을 바꿈 (행 id는 그대로 유지)
+    for table, create_sql, columns, join, indexes in _USER_ID_TABLES:
+        if table not in tables:
+            continue
+        connection.exec_driver_sql(create_sql)
+        connection.exec_driver_sql(
+            f"INSERT INTO {table}_new SELECT {columns} FROM {table} t {join} users u ON u.name = t.user_name"
+        )
+        connection.exec_driver_sql(f"DROP TABLE {table}")
+        connection.exec_driver_sql(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for statement in indexes:
+            connection.exec_driver_sql(statement)
+
+
+def _user_generations(connection: Connection):
+    """users에 retired_at(퇴역 표시)을 추가하고, 이름 유일성을 퇴역하지 않은 행으로 한정"""
+    connection.exec_driver_sql("ALTER TABLE users ADD COLUMN retired_at DATETIME")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_users_name")
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX ix_users_name_active ON users (name) WHERE retired_at IS NULL"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX ix_users_retired_at ON users (retired_at) WHERE retired_at IS NOT NULL"
+    )
+
+
+def _emotion_stats_table(connection: Connection):
+    """사용자별 감정 통계 롤업 테이블을 만들고 기존 emotion_history로 채움"""
+    connection.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS emotion_stats (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            emotion VARCHAR NOT NULL,
+            emotion_count INTEGER NOT NULL,
+            intensity_sum INTEGER NOT NULL,
+            last_recorded DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )"""
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_emotion_stats_user_id_emotion ON emotion_stats (user_id, emotion)"
+    )
+    if "emotion_history" in _table_names(connection):
+        connection.exec_driver_sql(
+            "INSERT INTO emotion_stats (user_id, emotion, emotion_count, intensity_sum, last_recorded) "
+            "SELECT user_id, emotion, COUNT(*), COALESCE(SUM(intensity), 0), MAX(timestamp) "
+            "FROM emotion_history GROUP BY user_id, emotion"
+        )
+
+
+# 0005 작성 당시의 models.TIMELINE_RESOLUTIONS
+_TIMELINE_FORMATS = (
+    ("minute", "%Y-%m-%d %H:%M:00"),
+    ("hour", "%Y-%m-%d %H:00:00"),
+    ("day", "%Y-%m-%d 00:00:00"),
+)
+
+
+def _timeline_tables(connection: Connection):
+    """감정/호감도 타임라인 버킷 테이블을 만들고 기존 기록으로 채움"""
+    connection.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS emotion_timeline (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            resolution VARCHAR NOT NULL,
+            bucket_start VARCHAR NOT NULL,
+            emotion VARCHAR NOT NULL,
+            emotion_count INTEGER NOT NULL,
+            intensity_sum INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )"""
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_emotion_timeline_bucket "
+        "ON emotion_timeline (user_id, resolution, bucket_start, emotion)"
+    )
+    connection.exec_driver_sql(
+        """CREATE TABLE IF NOT EXISTS affection_timeline (
+            id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            resolution VARCHAR NOT NULL,
+            bucket_start VARCHAR NOT NULL,
+            affection_level INTEGER NOT NULL,
+            affection_min INTEGER NOT NULL,
+            affection_max INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+        )"""
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_affection_timeline_bucket "
+        "ON affection_timeline (user_id, resolution, bucket_start)"
+    )
+
+    tables = _table_names(connection)
+    for resolution, fmt in _TIMELINE_FORMATS:
+        if "emotion_history" in tables:
+            connection.exec_driver_sql(
+                "INSERT INTO emotion_timeline (user_id, resolution, bucket_start, emotion, emotion_count, intensity_sum) "
+                f"SELECT user_id, '{resolution}', strftime('{fmt}', timestamp), emotion, COUNT(*), COALESCE(SUM(intensity), 0) "
+                "FROM emotion_history WHERE timestamp IS NOT NULL "
+                f"GROUP BY user_id, strftime('{fmt}', timestamp), emotion"
+            )
+        # 호감도 변화 기록은 없었으므로 마지막 대화 시각에 현재 값 하나만 남김
+        if "user_affection" in tables:
+            connection.exec_driver_sql(
+                "INSERT INTO affection_timeline "
+                "(user_id, resolution, bucket_start, affection_level, affection_min, affection_max) "
+                f"SELECT user_id, '{resolution}', strftime('{fmt}', last_interaction), "
+                "COALESCE(affection_level, 0), COALESCE(affection_level, 0), COALESCE(affection_level, 0) "
+                "FROM user_affection WHERE last_interaction IS NOT NULL"
+            )
+
+    # 이후의 기록은 트리거가 emotion_stats / 타임라인에 바로 반영
+    # (4번의 emotion_stats는 그동안 ORM 이벤트로 갱신했음)
+    resolutions = " UNION ALL ".join(
+        f"SELECT '{resolution}' AS resolution, '{fmt}' AS fmt" for resolution, fmt in _TIMELINE_FORMATS
+    )
+    connection.exec_driver_sql(
+        f"""CREATE TRIGGER IF NOT EXISTS tr_emotion_history_rollup AFTER INSERT ON emotion_history
+        BEGIN
+            INSERT INTO emotion_stats (user_id, emotion, emotion_count, intensity_sum, last_recorded)
+            VALUES (NEW.user_id, NEW.emotion, 1, COALESCE(NEW.intensity, 0), NEW.timestamp)
+            ON CONFLICT (user_id, emotion) DO UPDATE SET
+                emotion_count = emotion_count + 1,
+                intensity_sum = intensity_sum + excluded.intensity_sum,
+                last_recorded = excluded.last_recorded;
+            INSERT INTO emotion_timeline (user_id, resolution, bucket_start, emotion, emotion_count, intensity_sum)
+            SELECT NEW.user_id, resolution, strftime(fmt, NEW.timestamp), NEW.emotion, 1, COALESCE(NEW.intensity, 0)
+            FROM ({resolutions}) WHERE NEW.timestamp IS NOT NULL
+            ON CONFLICT (user_id, resolution, bucket_start, emotion) DO UPDATE SET
+                emotion_count = emotion_count + 1,
+                intensity_sum = intensity_sum + excluded.intensity_sum;
+        END"""
+    )
+    for name, event in (("insert", "INSERT"), ("update", "UPDATE OF affection_level, last_interaction")):
+        connection.exec_driver_sql(
+            f"""CREATE TRIGGER IF NOT EXISTS tr_user_affection_{name}_timeline AFTER {event} ON user_affection
+            WHEN NEW.last_interaction IS NOT NULL
+            BEGIN
+                INSERT INTO affection_timeline (user_id, resolution, bucket_start, affection_level, affection_min, affection_max)
+                SELECT NEW.user_id, resolution, strftime(fmt, NEW.last_interaction),
+                       COALESCE(NEW.affection_level, 0), COALESCE(NEW.affection_level, 0), COALESCE(NEW.affection_level, 0)
+                FROM ({resolutions}) WHERE true
+                ON CONFLICT (user_id, resolution, bucket_start) DO UPDATE SET
+                    affection_level = excluded.affection_level,
+                    affection_min = min(affection_min, excluded.affection_min),
+                    affection_max = max(affection_max, excluded.affection_max);
+            END"""
+        )
+
+
+def _chat_search_index(connection: Connection):
+    """대화 기록 전문 검색 인덱스(FTS5 trigram, 사용자 키 포함)와 동기화 트리거를 만들고 기존 기록을 색인"""
+    connection.exec_driver_sql(
+        """CREATE VIEW IF NOT EXISTS chat_history_search AS
+        SELECT id, '<' || user_id || '>' AS user_key, user_message, bot_reply FROM chat_history"""
+    )
+    connection.exec_driver_sql(
+        """CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+            user_key, user_message, bot_reply, content='chat_history_search', content_rowid='id', tokenize='trigram'
+        )"""
+    )
+    connection.exec_driver_sql(
+        """CREATE TRIGGER IF NOT EXISTS tr_chat_history_fts_insert AFTER INSERT ON chat_history
+        BEGIN
+            INSERT INTO chat_history_fts (rowid, user_key, user_message, bot_reply)
+            VALUES (NEW.id, '<' || NEW.user_id || '>', NEW.user_message, NEW.bot_reply);
+        END"""
+    )
+    connection.exec_driver_sql(
+        """CREATE TRIGGER IF NOT EXISTS tr_chat_history_fts_delete AFTER DELETE ON chat_history
+        BEGIN
+            INSERT INTO chat_history_fts (chat_history_fts, rowid, user_key, user_message, bot_reply)
+            VALUES ('delete', OLD.id, '<' || OLD.user_id || '>', OLD.user_message, OLD.bot_reply);
+        END"""
+    )
+    connection.exec_driver_sql(
+        """CREATE TRIGGER IF NOT EXISTS tr_chat_history_fts_update AFTER UPDATE OF user_id, user_message, bot_reply ON chat_history
+        BEGIN
+            INSERT INTO chat_history_fts (chat_history_fts, rowid, user_key, user_message, bot_reply)
+            VALUES ('delete', OLD.id, '<' || OLD.user_id || '>', OLD.user_message, OLD.bot_reply);
+            INSERT INTO chat_history_fts (rowid, user_key, user_message, bot_reply)
+            VALUES (NEW.id, '<' || NEW.user_id || '>', NEW.user_message, NEW.bot_reply);
+        END"""
+    )
+    # 기존 행으로 인덱스를 채움 (내용 뷰 chat_history_search를 읽음)
+    connection.exec_driver_sql("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('rebuild')")
+
+
+# (버전, 이름, 적용 함수) - 버전 순서대로, 한 번 배포한 항목은 고치지 말고 새 버전을 추가
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "hot query indexes", _hot_query_indexes),
+    (2, "users table with integer keys", _users_table),
+    (3, "retirable user data generations", _user_generations),
+    (4, "emotion stats rollup", _emotion_stats_table),
+    (5, "emotion and affection timelines", _timeline_tables),
+    (6, "chat history search index", _chat_search_index),
+]
+
+
+# --- 실행 ---
+
+@contextmanager
+def _migration_transaction(engine: Engine):
+    """마이그레이션 하나를 감싸는 트랜잭션 (DDL 포함)"""
+    if engine.dialect.name != "sqlite":
+        with engine.begin() as connection:
+            yield connection
+        return
+
+    # pysqlite는 DDL 앞에서 트랜잭션을 시작하지 않으므로 직접 BEGIN
+    # (IMMEDIATE: 쓰기 잠금을 먼저 잡아 여러 프로세스가 동시에 같은 마이그레이션을 적용하지 않도록)
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        # 테이블을 다시 만드는 동안에는 외래 키 검사를 끄고 커밋 직전에 한 번에 확인
+        # (foreign_keys는 트랜잭션 안에서 바꿀 수 없음)
+        foreign_keys = connection.exec_driver_sql("PRAGMA foreign_keys").scalar()
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                yield connection
+                violations = connection.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+                if violations:
+                    raise RuntimeError(f"외래 키 위반 {len(violations)}건: {violations[:5]}")
+            except BaseException:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+            connection.exec_driver_sql("COMMIT")
+        finally:
+            connection.exec_driver_sql(f"PRAGMA foreign_keys={foreign_keys}")
+
+
+def applied_versions(connection: Connection) -> Set[int]:
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def run_migrations(engine: Engine, metadata: MetaData) -> List[int]:
+    """
+    테이블을 만들고 밀린 마이그레이션을 적용합니다
+
+    Returns:
+        이번에 적용한 마이그레이션 버전 목록
+    """
+    with engine.begin() as connection:
+        existing_tables = set(inspect(connection).get_table_names())
+        schema_migrations.create(connection, checkfirst=True)
+        applied = applied_versions(connection)
+
+    # 새 DB는 최신 스키마로 만들어지므로 마이그레이션 없이 적용된 것으로 기록
+    if not existing_tables & set(metadata.tables):
+        metadata.create_all(bind=engine)
+        with engine.begin() as connection:
+            pending = [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+            if pending:
+                connection.execute(
+                    schema_migrations.insert(),
+                    [{"version": version, "name": name} for version, name in pending]
+                )
+        return []
+
+    newly_applied = []
+    for version, name, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        with _migration_transaction(engine) as connection:
+            # 잠금을 기다리는 동안 다른 프로세스가 적용했을 수 있음
+            if version in applied_versions(connection):
+                continue
+            print(f"Applying migration {version:04d}: {name}")
+            upgrade(connection)
+            connection.execute(schema_migrations.insert().values(version=version, name=name))
+        newly_applied.append(version)
+
+    metadata.create_all(bind=engine)
+    return newly_applied
+
+
+# --- 실행 계획 확인 ---
+
+def hot_queries():
+    """턴마다, 또는 사용자 단위로 실행되는 쿼리 [(이름, SQLAlchemy 문)]"""
+    import crud
+    import models
+    from emotion_system.emotion_analyzer import EmotionAnalyzer
+
+    user_id = 1
+    return [
+        ("user id", select(models.User.id).where(models.User.name == "사용자", models.User.retired_at.is_(None))),
+        ("recent chat history", crud.chat_history_query(user_id, limit=30)),
+        ("history page (before)", crud.chat_history_page_query(user_id, 50, before=("2026-01-01 00:00:00", 1000))),
+        ("history page (since)", crud.chat_history_page_query(user_id, 50, since=("2026-01-01 00:00:00", 1000))),
+        ("chat entry position", crud.chat_entry_position_query(user_id, 1000)),
+        ("chat entries by id", crud.chat_entries_query(user_id, [1000, 1001, 1002])),
+        ("chat search", crud.chat_search_query(user_id, ["케이크", "또"], 20)),
+        ("chat search (short terms)", crud.chat_search_query(user_id, ["또"], 20)),
+        ("last emotion", EmotionAnalyzer.last_emotion_query(user_id)),
+        ("emotion stats", EmotionAnalyzer.emotion_stats_query(user_id)),
+        ("emotion timeline", crud.emotion_timeline_query(user_id, "hour", "2026-01-01 00:00:00", "2026-01-02 23:00:00")),
+        ("affection timeline", crud.affection_timeline_query(user_id, "hour", "2026-01-01 00:00:00", "2026-01-02 23:00:00")),
+        ("affection before window", crud.affection_before_query(user_id, "hour", "2026-01-01 00:00:00")),
+        ("affection row", select(models.UserAffection).filter(models.UserAffection.user_id == user_id)),
+        ("emotion row", select(models.UserEmotion).filter(models.UserEmotion.user_id == user_id)),
+        ("retired users", crud.retired_user_ids_query()),
+        *(
+            (f"purge {model.__tablename__}", crud.delete_user_rows_batch_query(model, user_id, 500))
+            for model in crud.USER_DATA_TABLES
+        ),
+    ]
+
+
+def uses_index(plan: List[str]) -> bool:
+    """
+    전체 테이블 스캔이나 ORDER BY용 임시 정렬이 없는지
+    (FTS5 인덱스 검색은 "SCAN ... VIRTUAL TABLE INDEX"로 표시되고, 그 결과를 관련도로 정렬하는 것은 허용)
+    """
+    full_text = any("VIRTUAL TABLE INDEX" in line for line in plan)
+    return not any(
+        (line.startswith("SCAN ") and "VIRTUAL TABLE INDEX" not in line)
+        or ("USE TEMP B-TREE FOR ORDER BY" in line and not full_text)
+        for line in plan
+    )
+
+
+def explain_hot_queries(connection: Connection) -> List[Tuple[str, List[str], bool]]:
+    """hot_queries의 EXPLAIN QUERY PLAN 결과 [(이름, 계획 줄들, 인덱스 사용 여부)]"""
+    results = []
+    for name, statement in hot_queries():
+        sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+        plan = [row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+        results.append((name, plan, uses_index(plan)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="스키마 마이그레이션")
+    parser.add_argument("--status", action="store_true", help="적용 여부만 출력")
+    parser.add_argument("--explain", action="store_true", help="자주 쓰는 쿼리의 실행 계획 확인")
+    args = parser.parse_args()
+
+    import models  # noqa: F401  (Base.metadata에 테이블 등록)
+    from database import Base, engine
+
+    if args.status:
+        with engine.begin() as connection:
+            schema_migrations.create(connection, checkfirst=True)
+            applied = applied_versions(connection)
+        for version, name, _ in MIGRATIONS:
+            print(f"  {version:04d} {name}: {'적용됨' if version in applied else '대기'}")
+        return 0
+
+    if args.explain:
+        with engine.connect() as connection:
+            results = explain_hot_queries(connection)
+        for name, plan, ok in results:
+            print(f"[{'OK' if ok else 'SCAN'}] {name}")
+            for line in plan:
+                print(f"    {line}")
+        return 0 if all(ok for _, _, ok in results) else 1
+
+    applied = run_migrations(engine, Base.metadata)
+    print(f"마이그레이션 {len(applied)}개 적용" if applied else "적용할 마이그레이션이 없습니다.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
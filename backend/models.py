@@ -1,8 +1,9 @@
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Date
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, Date, Index, ForeignKey, event
+from sqlalchemy.sql import column, func, table, text
 from database import Base
-from typing import List, Dict
+from datetime import datetime
+from typing import List, Dict, Optional
 
 # --- Pydantic Models for API validation ---
 
@@ -26,6 +27,67 @@ class ChatResponse(BaseModel):
     affection_change: int = 0
     # 이벤트 시스템
     events: List[Dict] = []
+    # 지연 감정 분석 (emotion_pending이면 /chat/turns/{turn_id}/emotion에서 결과 조회)
+    turn_id: str = ""
+    emotion_pending: bool = False
+
+
+class TurnEmotion(BaseModel):
+    """턴별 지연 감정 분석 결과 응답 모델"""
+    turn_id: str
+    status: str  # pending, done, failed
+    emotion: str
+    emotion_intensity: int
+    emotion_emoji: str
+    emotion_color: str
+    emotion_reason: str = ""
+    emotion_confidence: float = 0.8
+
+
+class ChatHistoryItem(BaseModel):
+    """대화 기록 한 턴"""
+    id: int
+    user_message: str
+    bot_reply: str
+    timestamp: Optional[datetime] = None
+
+
+class ChatHistoryPage(BaseModel):
+    """대화 기록 페이지 응답 모델 (keyset 커서)"""
+    items: List[ChatHistoryItem]
+    next_cursor: Optional[str] = None  # 같은 방향(before 또는 since)으로 다음 페이지, 끝이면 None
+    latest_cursor: Optional[str] = None  # 지금까지 본 가장 최신 턴 (다음 증분 동기화의 since로 사용)
+
+
+class ChatSearchHit(ChatHistoryItem):
+    """대화 검색 결과 한 턴"""
+    score: Optional[float] = None  # 관련도 (클수록 관련 높음, 세 글자 미만 검색어만 있으면 None이고 최신 순)
+
+
+class ChatSearchPage(BaseModel):
+    """대화 검색 결과 페이지 응답 모델"""
+    items: List[ChatSearchHit]
+    next_offset: Optional[int] = None  # 다음 페이지를 요청할 offset, 끝이면 None
+
+
+class TimelineBucket(BaseModel):
+    """타임라인 버킷 하나 (데이터가 있는 버킷만 응답에 포함)"""
+    bucket_start: datetime
+    emotion_count: int = 0
+    dominant_emotion: Optional[str] = None
+    emotion_distribution: Dict[str, float] = {}  # 감정별 비율 (%)
+    mean_intensity: Optional[float] = None  # 평균 감정 강도 (1-10)
+    affection_level: Optional[int] = None  # 버킷이 끝날 때의 호감도 (변화가 없으면 직전 값)
+    affection_min: Optional[int] = None
+    affection_max: Optional[int] = None
+
+
+class Timeline(BaseModel):
+    """감정/호감도 타임라인 응답 모델"""
+    resolution: str  # minute, hour, day
+    start: datetime
+    end: datetime
+    buckets: List[TimelineBucket]
 
 
 # --- 감정 시스템 API 모델들 ---
@@ -47,13 +109,40 @@ class AffectionUpdate(BaseModel):
 
 # --- SQLAlchemy Model for Database ---
 
+class User(Base):
+    """
+    사용자 (이름 → 정수 키, 다른 테이블은 user_id로 참조)
+    행 하나가 그 이름의 데이터 세대 하나입니다. /new-user는 현재 행에 retired_at만 찍고,
+    다음 대화에서 같은 이름의 새 행이 만들어집니다. 퇴역한 행의 데이터는 UserDataPurger가 나눠서 지웁니다.
+    """
+    __tablename__ = "users"
+    __table_args__ = (
+        # 이름은 퇴역하지 않은 행 사이에서만 유일
+        Index("ix_users_name_active", "name", unique=True,
+              sqlite_where=text("retired_at IS NULL"), postgresql_where=text("retired_at IS NULL")),
+        # 정리할 퇴역 행만 담는 작은 인덱스
+        Index("ix_users_retired_at", "retired_at",
+              sqlite_where=text("retired_at IS NOT NULL"), postgresql_where=text("retired_at IS NOT NULL")),
+    )
+
+    # INTEGER PRIMARY KEY는 SQLite rowid 자체라 별도 인덱스가 필요 없음
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    retired_at = Column(DateTime(timezone=True), nullable=True)
+
+
 class ChatHistory(Base):
     __tablename__ = "chat_history"
+    __table_args__ = (
+        # 사용자별 최근 대화 조회 (user_id = ? ORDER BY timestamp DESC)
+        Index("ix_chat_history_user_id_timestamp", "user_id", "timestamp"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_message = Column(String, nullable=False)
     bot_reply = Column(String, nullable=False)
-    user_name = Column(String, nullable=True)  # 사용자 이름 추가
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -63,8 +152,8 @@ class UserEmotion(Base):
     """사용자별 현재 감정 상태"""
     __tablename__ = "user_emotions"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_name = Column(String, nullable=False, unique=True, index=True)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True, index=True)
     current_emotion = Column(String, default="수줍음")  # 기본 감정
     emotion_intensity = Column(Float, default=0.5)  # 감정 강도 (0.0-1.0)
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -74,8 +163,8 @@ class UserAffection(Base):
     """사용자별 호감도 정보"""
     __tablename__ = "user_affection"
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_name = Column(String, nullable=False, unique=True, index=True)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True, index=True)
     affection_level = Column(Integer, default=0)  # 호감도 (0-100)
     total_conversations = Column(Integer, default=0)  # 총 대화 횟수
     first_met_date = Column(Date, default=func.current_date())  # 첫 만남 날짜
@@ -85,12 +174,196 @@ class UserAffection(Base):
 class EmotionHistory(Base):
     """감정 분석 기록 (Stage 2)"""
     __tablename__ = "emotion_history"
+    __table_args__ = (
+        # 사용자별 최근 감정 / 감정 통계
+        # 오름차순 인덱스를 거꾸로 훑고 rowid가 마지막 키라 "timestamp DESC, id DESC" 정렬도 정렬 없이 처리됨
+        Index("ix_emotion_history_user_id_timestamp", "user_id", "timestamp"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
-    user_name = Column(String, nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     emotion = Column(String, nullable=False)  # 분석된 감정 (수줍음, 기쁨, 슬픔, 화남, 놀람, 설렘)
     intensity = Column(Integer, default=5)  # 감정 강도 (1-10)
     reason = Column(Text, nullable=True)  # 감정 분석 이유
     confidence = Column(Float, default=0.8)  # 분석 확신도 (0.0-1.0)
     trigger_type = Column(String, nullable=True)  # 감정 변화 원인  
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class EmotionStats(Base):
+    """
+    사용자별 감정 통계 (emotion_history 롤업)
+    EmotionHistory를 INSERT할 때마다 같은 트랜잭션에서 (user_id, emotion) 행에 횟수와 강도를 더하므로 (ROLLUP_TRIGGERS)
+    통계 조회는 기록 길이와 상관없이 감정 종류 수만큼의 행만 읽습니다.
+    처음부터 다시 계산하려면 backfill_emotion_stats.py를 실행하세요.
+    """
+    __tablename__ = "emotion_stats"
+    __table_args__ = (
+        Index("ix_emotion_stats_user_id_emotion", "user_id", "emotion", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    emotion = Column(String, nullable=False)
+    emotion_count = Column(Integer, nullable=False, default=0)  # 기록 수
+    intensity_sum = Column(Integer, nullable=False, default=0)  # 강도 합 (평균 = intensity_sum / emotion_count)
+    last_recorded = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# 타임라인 버킷 해상도 → 버킷 시작 시각 형식 (SQLite strftime 형식, Python strftime도 같은 문자열을 만듦)
+TIMELINE_RESOLUTIONS = {
+    "minute": "%Y-%m-%d %H:%M:00",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+}
+
+
+class EmotionTimeline(Base):
+    """
+    사용자별 감정 타임라인 (emotion_history를 분/시/일 버킷으로 미리 집계)
+    EmotionHistory INSERT와 같은 트랜잭션에서 해상도마다 (버킷, 감정) 행에 횟수와 강도를 더합니다.
+    """
+    __tablename__ = "emotion_timeline"
+    __table_args__ = (
+        # 타임라인 조회 (user_id = ? AND resolution = ? AND bucket_start 범위)
+        Index("ix_emotion_timeline_bucket", "user_id", "resolution", "bucket_start", "emotion", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    resolution = Column(String, nullable=False)  # minute, hour, day
+    bucket_start = Column(String, nullable=False)  # TIMELINE_RESOLUTIONS 형식의 버킷 시작 시각
+    emotion = Column(String, nullable=False)
+    emotion_count = Column(Integer, nullable=False, default=0)
+    intensity_sum = Column(Integer, nullable=False, default=0)
+
+
+class AffectionTimeline(Base):
+    """
+    사용자별 호감도 타임라인 (분/시/일 버킷마다 마지막 값과 최소/최대)
+    user_affection에 호감도가 기록되는 트랜잭션에서 함께 갱신합니다.
+    """
+    __tablename__ = "affection_timeline"
+    __table_args__ = (
+        Index("ix_affection_timeline_bucket", "user_id", "resolution", "bucket_start", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    resolution = Column(String, nullable=False)
+    bucket_start = Column(String, nullable=False)
+    affection_level = Column(Integer, nullable=False)  # 버킷 안에서 마지막으로 기록된 값
+    affection_min = Column(Integer, nullable=False)
+    affection_max = Column(Integer, nullable=False)
+
+
+# --- 롤업 트리거 (SQLite) ---
+# 롤업은 원본 행을 쓰는 문장 안에서 SQLite 트리거가 upsert로 갱신합니다.
+# 턴마다 Python에서 문장을 더 보내지 않아도 되고, ORM을 거치지 않은 INSERT(executemany 등)도 빠짐없이 반영됩니다.
+# 버킷은 저장된 timestamp 기준이라 backfill_emotion_stats.py로 다시 계산한 값과 같습니다.
+
+_TIMELINE_RESOLUTION_ROWS = " UNION ALL ".join(
+    f"SELECT '{resolution}' AS resolution, '{fmt}' AS fmt" for resolution, fmt in TIMELINE_RESOLUTIONS.items()
+)
+
+ROLLUP_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS tr_emotion_history_rollup AFTER INSERT ON emotion_history
+    BEGIN
+        INSERT INTO emotion_stats (user_id, emotion, emotion_count, intensity_sum, last_recorded)
+        VALUES (NEW.user_id, NEW.emotion, 1, COALESCE(NEW.intensity, 0), NEW.timestamp)
+        ON CONFLICT (user_id, emotion) DO UPDATE SET
+            emotion_count = emotion_count + 1,
+            intensity_sum = intensity_sum + excluded.intensity_sum,
+            last_recorded = excluded.last_recorded;
+        INSERT INTO emotion_timeline (user_id, resolution, bucket_start, emotion, emotion_count, intensity_sum)
+        SELECT NEW.user_id, resolution, strftime(fmt, NEW.timestamp), NEW.emotion, 1, COALESCE(NEW.intensity, 0)
+        FROM ({_TIMELINE_RESOLUTION_ROWS}) WHERE NEW.timestamp IS NOT NULL
+        ON CONFLICT (user_id, resolution, bucket_start, emotion) DO UPDATE SET
+            emotion_count = emotion_count + 1,
+            intensity_sum = intensity_sum + excluded.intensity_sum;
+    END""",
+    *(
+        f"""CREATE TRIGGER IF NOT EXISTS tr_user_affection_{event_name}_timeline AFTER {event_sql} ON user_affection
+    WHEN NEW.last_interaction IS NOT NULL
+    BEGIN
+        INSERT INTO affection_timeline (user_id, resolution, bucket_start, affection_level, affection_min, affection_max)
+        SELECT NEW.user_id, resolution, strftime(fmt, NEW.last_interaction),
+               COALESCE(NEW.affection_level, 0), COALESCE(NEW.affection_level, 0), COALESCE(NEW.affection_level, 0)
+        FROM ({_TIMELINE_RESOLUTION_ROWS}) WHERE true
+        ON CONFLICT (user_id, resolution, bucket_start) DO UPDATE SET
+            affection_level = excluded.affection_level,
+            affection_min = min(affection_min, excluded.affection_min),
+            affection_max = max(affection_max, excluded.affection_max);
+    END"""
+        for event_name, event_sql in (("insert", "INSERT"), ("update", "UPDATE OF affection_level, last_interaction"))
+    ),
+]
+
+
+# --- 대화 검색 인덱스 (SQLite FTS5) ---
+# chat_history를 내용으로 쓰는 external content 인덱스라 본문은 chat_history에만 저장됩니다.
+# trigram 토크나이저는 띄어쓰기/형태소와 상관없이 세 글자 단위로 색인하므로 조사가 붙은 한국어도 부분 문자열로 찾습니다.
+# user_key("<user_id>")도 함께 색인해 검색을 MATCH 안에서 한 사용자로 좁힙니다
+# (chat_history.user_id로 거르면 다른 사용자의 일치 항목까지 모두 읽은 뒤에 버리게 됨).
+# 인덱스는 chat_history의 INSERT/UPDATE/DELETE 트리거가 같은 트랜잭션에서 맞춥니다.
+
+# 쿼리에서 쓰는 가상 테이블 (메타데이터에 속하지 않아 create_all이 만들지 않음, 아래 DDL로 생성)
+chat_history_fts = table(
+    "chat_history_fts", column("rowid"), column("user_key"), column("user_message"), column("bot_reply")
+)
+
+CHAT_SEARCH_DDL = [
+    """CREATE VIEW IF NOT EXISTS chat_history_search AS
+    SELECT id, '<' || user_id || '>' AS user_key, user_message, bot_reply FROM chat_history""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+        user_key, user_message, bot_reply, content='chat_history_search', content_rowid='id', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS tr_chat_history_fts_insert AFTER INSERT ON chat_history
+    BEGIN
+        INSERT INTO chat_history_fts (rowid, user_key, user_message, bot_reply)
+        VALUES (NEW.id, '<' || NEW.user_id || '>', NEW.user_message, NEW.bot_reply);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tr_chat_history_fts_delete AFTER DELETE ON chat_history
+    BEGIN
+        INSERT INTO chat_history_fts (chat_history_fts, rowid, user_key, user_message, bot_reply)
+        VALUES ('delete', OLD.id, '<' || OLD.user_id || '>', OLD.user_message, OLD.bot_reply);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tr_chat_history_fts_update AFTER UPDATE OF user_id, user_message, bot_reply ON chat_history
+    BEGIN
+        INSERT INTO chat_history_fts (chat_history_fts, rowid, user_key, user_message, bot_reply)
+        VALUES ('delete', OLD.id, '<' || OLD.user_id || '>', OLD.user_message, OLD.bot_reply);
+        INSERT INTO chat_history_fts (rowid, user_key, user_message, bot_reply)
+        VALUES (NEW.id, '<' || NEW.user_id || '>', NEW.user_message, NEW.bot_reply);
+    END""",
+]
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_sqlite_objects(target, connection, **kw):
+    """create_all이 끝난 뒤 (참조하는 테이블이 모두 만들어진 뒤) 롤업 트리거와 검색 인덱스를 만듦"""
+    if connection.dialect.name == "sqlite":
+        for statement in ROLLUP_TRIGGERS + CHAT_SEARCH_DDL:
+            connection.exec_driver_sql(statement)
+    else:
+        print(f"{connection.dialect.name}: 롤업 트리거와 검색 인덱스를 만들지 않습니다 (감정 통계/타임라인/대화 검색은 SQLite에서만 지원)")
+
+
+def require_sqlite(bind, feature: str):
+    """
+    SQLite 트리거/FTS5로 유지되는 기능을 다른 DB에서 쓰려 하면 NotImplementedError
+    (롤업 테이블이 비어 있는 채로 빈 결과를 돌려주지 않도록)
+    """
+    if bind.dialect.name != "sqlite":
+        raise NotImplementedError(f"SQLite에서만 지원하는 기능입니다: {feature} (현재 DB: {bind.dialect.name})")
+
+
+class EmotionCacheEntry(Base):
+    """감정 분석 캐시 (재시작 간 유지용, EMOTION_CACHE_PERSIST)"""
+    __tablename__ = "emotion_cache"
+
+    cache_key = Column(String, primary_key=True)  # 정규화한 (사용자 메시지, 답변) 해시
+    emotion = Column(String, nullable=False)
+    intensity = Column(Integer, default=5)
+    reason = Column(Text, nullable=True)
+    confidence = Column(Float, default=0.8)
+    cached_at = Column(Float, nullable=False)  # epoch 초 (TTL 계산용)
@@ -0,0 +1,129 @@
+"""
+호감도 재계산(리플레이)
+
+AFFECTION_TRIGGERS 가중치, AFFECTION_LEVELS 구간, 트리거 패턴을 바꾼 뒤
+chat_history 전체를 다시 훑어 사용자별 호감도를 새 규칙으로 계산합니다.
+기본은 dry-run으로, 저장된 값과 재계산한 값의 차이(관계 단계 변화 포함)만 보여 줍니다.
+--apply를 주면 user_affection.affection_level을 재계산한 값으로 덮어씁니다.
+
+서버의 세션 상태 캐시가 메모리의 호감도를 다시 기록할 수 있으므로 --apply는 서버를 멈춘 상태에서 실행하세요.
+
+사용법 (backend 폴더에서):
+    python replay_affection.py
+    python replay_affection.py --workers 8 --show 50
+    python replay_affection.py --apply
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import bindparam, select, update
+
+from database import engine
+from emotion_system.affection_manager import AffectionManager
+from emotion_system.affection_replay import AffectionReplayEngine
+from emotion_system.trigger_detector import DEFAULT_BATCH_CHUNK_SIZE
+from models import ChatHistory, User, UserAffection
+
+
+def iter_history(user_name=None, batch_size=DEFAULT_BATCH_CHUNK_SIZE):
+    """chat_history를 시간(id) 순서로 (user_name, user_message) 스트리밍합니다"""
+    query = (
+        select(User.name, ChatHistory.user_message)
+        .join(User, User.id == ChatHistory.user_id)
+        # /new-user로 퇴역해 정리를 기다리는 기록은 제외
+        .where(User.retired_at.is_(None))
+        .order_by(ChatHistory.id)
+    )
+    if user_name is not None:
+        query = query.where(User.name == user_name)
+
+    with engine.connect() as connection:
+        yield from connection.execution_options(yield_per=batch_size).execute(query)
+
+
+def load_stored_levels(user_name=None):
+    """user_affection에 저장된 {user_name: affection_level}"""
+    query = (
+        select(User.name, UserAffection.affection_level)
+        .join(User, User.id == UserAffection.user_id)
+        .where(User.retired_at.is_(None))
+    )
+    if user_name is not None:
+        query = query.where(User.name == user_name)
+    with engine.connect() as connection:
+        return {name: level or 0 for name, level in connection.execute(query)}
+
+
+def build_diff(stored, replayed):
+    """저장값과 재계산값이 다른 사용자 목록 [(user_name, 저장값, 재계산값)]"""
+    return sorted(
+        (
+            (name, stored[name], level)
+            for name, level in replayed.items()
+            if name in stored and stored[name] != level
+        ),
+        key=lambda item: abs(item[2] - item[1]),
+        reverse=True
+    )
+
+
+def apply_levels(diff):
+    """재계산한 호감도를 한 트랜잭션에서 executemany로 기록합니다"""
+    affection_table = UserAffection.__table__
+    user_id = (
+        select(User.id)
+        .where(User.name == bindparam("b_user_name"), User.retired_at.is_(None))
+        .scalar_subquery()
+    )
+    with engine.begin() as connection:
+        connection.execute(
+            update(affection_table)
+            .where(affection_table.c.user_id == user_id)
+            .values(affection_level=bindparam("b_level")),
+            [{"b_user_name": name, "b_level": level} for name, _, level in diff]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chat_history로 호감도 재계산")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="트리거 감지 프로세스 수")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_BATCH_CHUNK_SIZE, help="워커에 한 번에 넘기는 메시지 수")
+    parser.add_argument("--user", default=None, help="이 사용자만 재계산")
+    parser.add_argument("--show", type=int, default=20, help="차이를 보여 줄 최대 사용자 수 (변화량이 큰 순)")
+    parser.add_argument("--apply", action="store_true", help="재계산한 값을 user_affection에 기록")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    replay_engine = AffectionReplayEngine()
+    replayed = replay_engine.replay(iter_history(args.user, args.chunk_size), args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    stored = load_stored_levels(args.user)
+    diff = build_diff(stored, replayed)
+    missing = [name for name in replayed if name not in stored]
+    stage_of = AffectionManager(None).get_relationship_stage
+    stage_changes = sum(1 for _, old, new in diff if stage_of(old) != stage_of(new))
+
+    print(f"재계산 완료: 사용자 {len(replayed)}명, {elapsed:.1f}초 (워커 {args.workers}개)")
+    print(f"  값이 달라진 사용자: {len(diff)}명 (관계 단계 변화 {stage_changes}명)")
+    if missing:
+        print(f"  user_affection 레코드가 없어 건너뜀: {len(missing)}명")
+
+    for name, old, new in diff[:args.show]:
+        print(f"  {name}: {old} ({stage_of(old)}) → {new} ({stage_of(new)})  [{new - old:+d}]")
+    if len(diff) > args.show:
+        print(f"  ... 외 {len(diff) - args.show}명")
+
+    if not args.apply:
+        print("dry-run: 기록하지 않았습니다 (--apply로 반영)")
+    elif diff:
+        apply_levels(diff)
+        print(f"{len(diff)}명의 호감도를 기록했습니다.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+chat_history 트리거 재채점
+
+TriggerDetector의 패턴 표가 바뀌었을 때 저장된 사용자 메시지 전체를 다시 분석합니다.
+chat_history를 id 순서로 스트리밍해 TriggerDetector.analyze_messages로 넘기고,
+청크 단위로 프로세스 풀(기본: 모든 코어)에 나눠 처리합니다.
+결과는 트리거별 집계로 출력하고, --output을 주면 행마다 JSON Lines로 저장합니다.
+
+사용법 (backend 폴더에서):
+    python rescore_triggers.py
+    python rescore_triggers.py --workers 8 --output rescored.jsonl
+    python rescore_triggers.py --user 홍길동 --limit 1000 --workers 1
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+
+from sqlalchemy import select
+
+from database import engine
+from emotion_system.trigger_detector import TriggerDetector, DEFAULT_BATCH_CHUNK_SIZE
+from models import ChatHistory, User
+
+
+def iter_chat_rows(user_name=None, limit=None, batch_size=DEFAULT_BATCH_CHUNK_SIZE):
+    """chat_history를 id 순서로 (id, user_name, user_message) 스트리밍합니다"""
+    query = (
+        select(ChatHistory.id, User.name, ChatHistory.user_message)
+        .outerjoin(User, User.id == ChatHistory.user_id)
+        # /new-user로 퇴역해 정리를 기다리는 기록은 제외
+        .where(User.retired_at.is_(None))
+        .order_by(ChatHistory.id)
+    )
+    if user_name is not None:
+        query = query.where(User.name == user_name)
+    if limit is not None:
+        query = query.limit(limit)
+
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=batch_size).execute(query)
+        yield from result
+
+
+def rescore(rows, workers, chunk_size, output=None):
+    """행마다 트리거를 다시 분석하고 집계를 반환합니다"""
+    detector = TriggerDetector()
+    # analyze_messages가 메시지를 앞서 읽어 가는 만큼만 (id, user_name)을 보관해 결과와 짝지음
+    row_keys = deque()
+
+    def messages():
+        for row_id, user_name, message in rows:
+            row_keys.append((row_id, user_name))
+            yield message
+
+    summary = {
+        "rows": 0,
+        "affection_triggers": Counter(),
+        "emotion_triggers": Counter(),
+        "special_context": Counter()
+    }
+    for result in detector.analyze_messages(messages(), workers=workers, chunk_size=chunk_size):
+        row_id, user_name = row_keys.popleft()
+        summary["rows"] += 1
+        summary["affection_triggers"].update(trigger for trigger, _ in result["affection_triggers"])
+        summary["emotion_triggers"].update(emotion for emotion, _ in result["emotion_triggers"])
+        summary["special_context"].update(result["special_context"])
+
+        if output is not None:
+            output.write(json.dumps({"id": row_id, "user_name": user_name, **result}, ensure_ascii=False) + "\n")
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chat_history 트리거 재채점")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="프로세스 수 (1이면 현재 프로세스에서 처리)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_BATCH_CHUNK_SIZE, help="워커에 한 번에 넘기는 메시지 수")
+    parser.add_argument("--user", default=None, help="이 사용자의 기록만 재채점")
+    parser.add_argument("--limit", type=int, default=None, help="최대 행 수")
+    parser.add_argument("--output", default=None, help="행별 결과를 저장할 JSON Lines 파일")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    start = time.perf_counter()
+    try:
+        summary = rescore(
+            iter_chat_rows(args.user, args.limit, args.chunk_size),
+            args.workers,
+            args.chunk_size,
+            output
+        )
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    rows = summary["rows"]
+    print(f"재채점 완료: {rows}행, {elapsed:.1f}초 ({rows / elapsed if elapsed else 0:.0f}행/초, 워커 {args.workers}개)")
+    for key in ("affection_triggers", "emotion_triggers", "special_context"):
+        print(f"  {key}:")
+        for name, count in summary[key].most_common():
+            print(f"    {name}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+사용자별 세션 상태 캐시 (write-behind)
+호감도, 현재 감정, 최근 대화 링 버퍼를 메모리에 보관해 자주 대화하는 사용자는 턴마다 DB를 읽지 않습니다.
+변경된 감정 상태는 주기적으로, 그리고 종료 시에 한 트랜잭션으로 모아서 SQLite에 기록합니다.
+호감도는 AffectionManager가 원자적 UPDATE로 바로 기록하고, 여기에는 기록된 최신 값만 반영합니다.
+"""
+
+import asyncio
+from collections import OrderedDict, deque, namedtuple
+from contextlib import nullcontext
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import crud
+from user_directory import user_directory
+
+# 프롬프트 구성에 쓰는 대화 한 턴 (ChatHistory와 같은 속성 이름)
+HistoryTurn = namedtuple("HistoryTurn", ["user_message", "bot_reply"])
+
+# 메모리 사용량 근사치 (바이트, 문자열은 글자당 2바이트 + 객체 오버헤드)
+STATE_BASE_SIZE = 600
+TURN_BASE_SIZE = 200
+
+
+def _turn_size(turn: HistoryTurn) -> int:
+    return TURN_BASE_SIZE + 2 * (len(turn.user_message) + len(turn.bot_reply))
+
+
+class UserSessionState:
+    """한 사용자의 메모리 상태"""
+    
+    def __init__(self, user_name: str, history_size: int,
+                 on_resize: Optional[Callable[["UserSessionState", int], None]] = None):
+        self.user_name = user_name
+        self.user_id: Optional[int] = None
+        # 호감도 (UserAffection)
+        self.affection_level = 0
+        self.total_conversations = 0
+        self.first_met_date = date.today()
+        self.last_interaction: Optional[datetime] = None
+        self.affection_persisted = False  # DB 값과 맞춰져 있는지 (아니면 AffectionManager가 DB에서 읽음)
+        # 현재 감정 (UserEmotion, 강도는 EmotionAnalyzer와 같은 1-10 척도)
+        self.current_emotion: Optional[str] = None
+        self.emotion_intensity = 5
+        self.emotion_persisted = False
+        self.emotion_dirty = False
+        # 최근 대화 (최신이 앞)
+        self.recent_history: deque = deque(maxlen=history_size)
+        # 메모리 사용량 근사치 (대화를 넣을 때마다 맞추고, 바뀐 만큼 on_resize로 알림)
+        self.size = STATE_BASE_SIZE
+        self._on_resize = on_resize
+    
+    @property
+    def dirty(self) -> bool:
+        return self.emotion_dirty
+    
+    def set_affection(self, level: int, total_conversations: int, last_interaction: Optional[datetime]):
+        """DB에 기록된 호감도 값을 반영합니다"""
+        self.affection_level = level
+        self.total_conversations = total_conversations
+        self.last_interaction = last_interaction
+        self.affection_persisted = True
+    
+    def set_emotion(self, emotion: str, intensity: int):
+        self.current_emotion = emotion
+        self.emotion_intensity = intensity
+        self.emotion_dirty = True
+    
+    def append_history(self, user_message: str, bot_reply: str):
+        self._add_turn(HistoryTurn(user_message, bot_reply), newest=True)
+    
+    def _add_turn(self, turn: HistoryTurn, newest: bool):
+        delta = _turn_size(turn)
+        if len(self.recent_history) == self.recent_history.maxlen:
+            # 꽉 찼으면 반대쪽 끝의 턴이 밀려남
+            delta -= _turn_size(self.recent_history[-1] if newest else self.recent_history[0])
+        if newest:
+            self.recent_history.appendleft(turn)
+        else:
+            self.recent_history.append(turn)
+        self.size += delta
+        if self._on_resize is not None:
+            self._on_resize(self, delta)
+    
+    def estimated_size(self) -> int:
+        """메모리 사용량 근사치 (바이트)"""
+        return self.size
+
+
+class SessionStateStore:
+    """
+    사용자 이름 → UserSessionState LRU 캐시
+
+    Args:
+        session_factory: AsyncSession 팩토리 (캐시 미스 시 로드, flush에 사용)
+        memory_budget_bytes: 상태 전체의 메모리 예산 (넘으면 오래된 깨끗한 상태부터 축출)
+        history_size: 사용자별 최근 대화 링 버퍼 크기
+        flush_interval: 변경 상태를 DB에 기록하는 주기 (초)
+        write_lock: 턴 커밋과 flush 쓰기 트랜잭션을 직렬화하는 잠금 (database.async_write_lock)
+        history_writer: 대화 기록 write-behind 큐 (있으면 불러올 때 아직 기록되지 않은 턴도 최근 대화에 넣음)
+    """
+    
+    def __init__(self, session_factory, memory_budget_bytes: int = 64 * 1024 * 1024,
+                 history_size: int = 30, flush_interval: float = 2.0, write_lock=None, history_writer=None):
+        self.session_factory = session_factory
+        self.write_lock = write_lock
+        self.history_writer = history_writer
+        self.memory_budget_bytes = memory_budget_bytes
+        self.history_size = history_size
+        self.flush_interval = flush_interval
+        self._states: "OrderedDict[str, UserSessionState]" = OrderedDict()
+        # 캐시된 상태 크기의 합 (넣기/크기 변화/축출/버리기 때마다 맞춤)
+        self._memory_bytes = 0
+        self._load_locks: Dict[str, asyncio.Lock] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.rows_dropped = 0
+        self._discards = 0
+    
+    # --- 조회 ---
+    
+    async def get(self, user_name: str) -> UserSessionState:
+        """사용자 상태를 반환합니다 (캐시에 없으면 DB에서 한 번 불러옴)"""
+        state = self._states.get(user_name)
+        if state is not None:
+            self._states.move_to_end(user_name)
+            self.hits += 1
+            return state
+        
+        # 같은 사용자의 동시 요청이 DB를 중복으로 읽지 않도록
+        lock = self._load_locks.setdefault(user_name, asyncio.Lock())
+        async with lock:
+            state = self._states.get(user_name)
+            if state is None:
+                self.misses += 1
+                discards = self._discards
+                state = await self._load(user_name)
+                # 불러오는 도중 데이터가 초기화되었으면 퇴역한 세대의 상태일 수 있으므로 캐시하지 않음
+                if discards == self._discards:
+                    cached = self._states.get(user_name)
+                    if cached is not None:
+                        # 다른 잠금으로 먼저 불러온 상태가 있으면 그것을 씀 (덮어쓰면 그 상태의 변경이 사라짐)
+                        state = cached
+                    else:
+                        self._states[user_name] = state
+                        self._memory_bytes += state.size
+                        self._evict_over_budget()
+            # 기다리는 요청이 있는 동안 다른 요청이 새 잠금을 만들지 않도록, 지금 잠금일 때만 잠금 안에서 지움
+            if self._load_locks.get(user_name) is lock:
+                del self._load_locks[user_name]
+        return state
+    
+    async def _load(self, user_name: str) -> UserSessionState:
+        from models import ChatHistory, UserAffection, UserEmotion
+        
+        state = UserSessionState(user_name, self.history_size, self._resized)
+        async with self.session_factory() as db:
+            state.user_id = await user_directory.resolve(db, user_name, create=False)
+            if state.user_id is None:
+                # 첫 대화: 턴 트랜잭션(쓰기 잠금 구간) 밖에서 users 행을 미리 만들어 둠
+                state.user_id = await user_directory.resolve(db, user_name)
+                await db.commit()
+            
+            affection = (await db.execute(
+                select(UserAffection).filter(UserAffection.user_id == state.user_id)
+            )).scalars().first()
+            if affection:
+                state.affection_level = affection.affection_level
+                state.total_conversations = affection.total_conversations or 0
+                state.first_met_date = affection.first_met_date or date.today()
+                state.last_interaction = affection.last_interaction
+                state.affection_persisted = True
+            
+            emotion = (await db.execute(
+                select(UserEmotion).filter(UserEmotion.user_id == state.user_id)
+            )).scalars().first()
+            if emotion:
+                state.current_emotion = emotion.current_emotion
+                # UserEmotion.emotion_intensity는 0.0-1.0 척도
+                state.emotion_intensity = max(1, min(10, round((emotion.emotion_intensity or 0.5) * 10)))
+                state.emotion_persisted = True
+            
+            # 방금 끝난 턴이 아직 기록 큐에 있을 수 있으므로 큐의 행을 DB 기록 앞(최신 쪽)에 합침
+            # (읽는 사이에 배치가 커밋되면 빠지거나 겹칠 수 있으므로 다시 읽음)
+            writer = self.history_writer
+            writes, unwritten = None, []
+            while True:
+                if writer is not None:
+                    writes, unwritten = await writer.snapshot(ChatHistory, state.user_id)
+                chats = await crud.get_chat_history(db, user_name=user_name, limit=self.history_size)
+                if writer is None or writer.writes == writes:
+                    break
+            turns = [HistoryTurn(values["user_message"], values["bot_reply"]) for values in reversed(unwritten)]
+            turns += [HistoryTurn(chat.user_message, chat.bot_reply) for chat in chats]
+            for turn in turns[:self.history_size]:
+                state._add_turn(turn, newest=False)
+        return state
+    
+    def _resized(self, state: UserSessionState, delta: int):
+        # 캐시에 들어 있는 상태만 합계에 반영 (불러오는 중이거나 이미 빠진 상태는 제외)
+        if self._states.get(state.user_name) is state:
+            self._memory_bytes += delta
+    
+    def _remove(self, user_name: str) -> Optional[UserSessionState]:
+        state = self._states.pop(user_name, None)
+        if state is not None:
+            self._memory_bytes -= state.size
+        return state
+    
+    def discard(self, user_name: str):
+        """사용자 상태를 버립니다 (데이터 초기화 시, 기록되지 않은 변경도 버림)"""
+        self._remove(user_name)
+        self._discards += 1
+    
+    def _evict_over_budget(self):
+        """메모리 예산을 넘으면 오래된 순으로 축출 (아직 기록되지 않은 상태는 남겨둠)"""
+        excess = self._memory_bytes - self.memory_budget_bytes
+        if excess <= 0:
+            return
+        # 오래된 쪽부터 필요한 만큼만 훑음
+        victims = []
+        for user_name, state in self._states.items():
+            if state.dirty:
+                continue
+            victims.append(user_name)
+            excess -= state.size
+            if excess <= 0:
+                break
+        for user_name in victims:
+            self._remove(user_name)
+            self.evictions += 1
+    
+    # --- write-behind ---
+    
+    async def flush(self) -> int:
+        """변경된 감정 상태를 한 트랜잭션으로 기록하고 기록한 사용자 수를 반환합니다"""
+        async with self._flush_lock:
+            dirty = [state for state in self._states.values() if state.dirty]
+            if not dirty:
+                return 0
+            
+            # (상태, UPDATE 여부, 값) 목록
+            rows: List[Tuple[UserSessionState, bool, Dict]] = []
+            
+            # 스냅샷을 뜬 뒤 플래그를 내려서, flush 도중의 변경은 다음 주기에 기록되도록
+            for state in dirty:
+                if state.emotion_dirty and state.current_emotion:
+                    if state.emotion_persisted:
+                        rows.append((state, True, {
+                            "b_user_id": state.user_id,
+                            "b_emotion": state.current_emotion,
+                            "b_intensity": state.emotion_intensity / 10.0,
+                        }))
+                    else:
+                        rows.append((state, False, {
+                            "user_id": state.user_id,
+                            "current_emotion": state.current_emotion,
+                            "emotion_intensity": state.emotion_intensity / 10.0,
+                        }))
+                    state.emotion_dirty = False
+            
+            try:
+                await self._write(rows)
+                written = rows
+            except IntegrityError as e:
+                # 퇴역한 사용자의 상태 등 한 행 때문에 모두가 막히지 않도록 행마다 다시 시도
+                print(f"세션 상태 flush 무결성 오류, 행 단위로 재시도: {e}")
+                written = await self._write_each(rows)
+            except Exception as e:
+                # 실패하면 다음 주기에 다시 기록
+                print(f"세션 상태 flush 오류: {e}")
+                for state, _, _ in rows:
+                    state.emotion_dirty = True
+                return 0
+            
+            # 새로 INSERT한 행은 이후로 UPDATE 대상
+            for state, _, _ in written:
+                state.emotion_persisted = True
+            
+            self.flushes += 1
+            return len(written)
+    
+    async def _write(self, rows: List[Tuple[UserSessionState, bool, Dict]]):
+        from models import UserEmotion
+        
+        emotion_table = UserEmotion.__table__
+        emotion_updates = [values for _, is_update, values in rows if is_update]
+        emotion_inserts = [values for _, is_update, values in rows if not is_update]
+        async with self.write_lock or nullcontext(), self.session_factory() as db:
+            if emotion_updates:
+                await db.execute(
+                    update(emotion_table)
+                    .where(emotion_table.c.user_id == bindparam("b_user_id"))
+                    .values(
+                        current_emotion=bindparam("b_emotion"),
+                        emotion_intensity=bindparam("b_intensity"),
+                        last_updated=datetime.now(),
+                    ),
+                    emotion_updates,
+                )
+            if emotion_inserts:
+                await db.execute(insert(emotion_table), emotion_inserts)
+            await db.commit()
+    
+    async def _write_each(self, rows: List[Tuple[UserSessionState, bool, Dict]]) -> List:
+        """
+        행마다 따로 기록하고 기록한 행을 반환합니다
+        무결성 오류가 나는 상태는 캐시에서 빼서 다음 조회 때 DB에서 다시 불러오고,
+        다른 오류면 남은 상태를 다음 주기에 다시 기록합니다.
+        """
+        written = []
+        for index, row in enumerate(rows):
+            state = row[0]
+            try:
+                await self._write([row])
+                written.append(row)
+            except IntegrityError as e:
+                self.rows_dropped += 1
+                print(f"기록할 수 없는 세션 상태를 버림 ({state.user_name}): {e}")
+                if self._states.get(state.user_name) is state:
+                    self._remove(state.user_name)
+            except Exception as e:
+                print(f"세션 상태 flush 오류: {e}")
+                for state, _, _ in rows[index:]:
+                    state.emotion_dirty = True
+                break
+        return written
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    def start(self):
+        """주기적 flush 태스크를 시작합니다"""
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush_periodically())
+    
+    async def stop(self):
+        """주기적 flush를 멈추고 남은 변경을 모두 기록합니다"""
+        if self._flusher is not None:
+            # 진행 중인 flush가 끝난 뒤 취소 (쓰기 도중 취소하면 커넥션이 쓰기 잠금을 쥔 채 남음)
+            async with self._flush_lock:
+                self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._states),
+            "dirty_users": sum(1 for state in self._states.values() if state.dirty),
+            "memory_bytes": self._memory_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "flushes": self.flushes,
+            "rows_dropped": self.rows_dropped
+        }
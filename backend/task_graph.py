@@ -0,0 +1,56 @@
+"""
+비동기 작업 의존성 그래프
+서로 의존하지 않는 작업들을 동시에 실행하고, 의존하는 작업은 선행 작업이 끝난 뒤에 실행합니다.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Sequence, Tuple
+
+
+class TaskGraph:
+    """
+    작은 DAG 실행기
+
+    각 노드는 선행 노드들의 결과를 위치 인자로 받는 async 함수입니다.
+    예)
+        graph = TaskGraph()
+        graph.add("a", fetch_a)
+        graph.add("b", fetch_b)
+        graph.add("c", combine, deps=("a", "b"))   # combine(result_a, result_b)
+        results = await graph.run()
+    """
+    
+    def __init__(self):
+        self._nodes: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {}
+    
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], deps: Sequence[str] = ()):
+        """노드를 추가합니다. 선행 노드는 먼저 추가되어 있어야 합니다."""
+        if name in self._nodes:
+            raise ValueError(f"duplicate task: {name}")
+        for dep in deps:
+            if dep not in self._nodes:
+                raise ValueError(f"unknown dependency '{dep}' for task '{name}'")
+        self._nodes[name] = (func, tuple(deps))
+        return self
+    
+    async def run(self) -> Dict[str, Any]:
+        """모든 노드를 실행하고 {노드 이름: 결과}를 반환합니다."""
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        async def run_node(name: str):
+            func, deps = self._nodes[name]
+            dep_results = [await tasks[dep] for dep in deps]
+            return await func(*dep_results)
+        
+        # 노드는 의존성 순서대로 추가되므로 선행 태스크가 항상 먼저 만들어집니다
+        for name in self._nodes:
+            tasks[name] = asyncio.ensure_future(run_node(name))
+        
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        
+        return {name: task.result() for name, task in tasks.items()}
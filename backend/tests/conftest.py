@@ -0,0 +1,5 @@
+import os
+import sys
+
+# backend 폴더의 모듈(main.py와 같은 방식의 최상위 import)을 테스트에서 그대로 불러오도록
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,43 @@
+"""
+로컬 감정 분류기(EmotionAnalyzer.classify_locally) 테스트
+
+사용법 (backend 폴더에서):
+    python -m pytest tests
+"""
+
+import pytest
+
+from emotion_system.emotion_analyzer import LOCAL_KEYWORD_SCANNER, EmotionAnalyzer
+
+
+@pytest.fixture
+def analyzer():
+    return EmotionAnalyzer(db_session=None, llm_backend=None)
+
+
+@pytest.mark.parametrize("reply", [
+    "전화로 대화 나눠요. 영화 재밌었어요?",
+    "서울 겨울은 정말 춥죠…",
+    "다시 와주셔서 감사해요, 와주셔서요",
+    "영화 보고 대화하면서 서울 구경해요",
+])
+def test_common_words_fall_through_to_llm(analyzer, reply):
+    # 한 글자 키워드가 든 평범한 단어만 있으면 로컬로 확정하지 않음
+    local = analyzer.classify_locally(reply)
+    assert local is None or local["confidence"] < EmotionAnalyzer.DEFAULT_LOCAL_CONFIDENCE_THRESHOLD
+
+
+def test_overlapping_keyword_counts_once():
+    assert LOCAL_KEYWORD_SCANNER.scan("화나요")["화남"] == 1
+
+
+def test_single_hit_is_not_accepted(analyzer):
+    local = analyzer.classify_locally("정말 화나요")
+    assert local["emotion"] == "화남"
+    assert local["confidence"] < EmotionAnalyzer.DEFAULT_LOCAL_CONFIDENCE_THRESHOLD
+
+
+def test_clear_reply_is_classified_locally(analyzer):
+    local = analyzer.classify_locally("와, 정말요?! 깜짝 놀랐어요. 너무 놀라서 어머 소리가 났어요")
+    assert local["emotion"] == "놀람"
+    assert local["confidence"] >= EmotionAnalyzer.DEFAULT_LOCAL_CONFIDENCE_THRESHOLD
@@ -0,0 +1,99 @@
+"""
+대화 한 턴의 작업 단위 (unit of work)
+한 턴에서 생기는 ChatHistory / EmotionHistory / UserAffection 쓰기를 하나의 세션에 모아
+flush 한 번, commit 한 번(= SQLite fsync 한 번)으로 기록합니다.
+HistoryWriter를 주면 기록 행(append)은 커밋이 성공한 뒤 그 큐로 넘겨 여러 턴을 모아서 INSERT합니다.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List
+
+
+class TurnUnitOfWork:
+    """
+    턴 하나의 DB 쓰기를 한 트랜잭션으로 묶는 작업 단위
+
+    - 동시에 도는 갈래들은 add()로 INSERT할 객체만 등록합니다 (I/O가 없어 같은 세션을 공유해도 안전).
+    - 대화/감정 기록처럼 결과를 기다릴 필요가 없는 행은 append()로 등록합니다.
+      history_writer가 있으면 커밋 뒤 그 큐로 넘기고 (write-behind), 없으면 add()와 같이 턴과 함께 INSERT합니다.
+    - 호감도 UPDATE처럼 실행이 필요한 쓰기는 갈래들이 합쳐진 뒤 session으로 실행하고 commit()합니다.
+    - 메모리 캐시 갱신은 after_commit()으로 등록해 커밋이 성공한 뒤에만 실행합니다.
+    - write_lock을 주면 writing() 구간(첫 쓰기 ~ 커밋)을 그 잠금으로 직렬화합니다.
+    - commit() 없이 블록을 벗어나거나 예외가 나면 턴 전체를 롤백합니다.
+
+    예)
+        async with TurnUnitOfWork(AsyncSessionLocal, async_write_lock) as uow:
+            uow.add(models.ChatHistory(...))
+            async with uow.writing():
+                await AffectionManager(uow.session, unit_of_work=uow).apply_triggers(...)
+                await uow.commit()
+    """
+
+    def __init__(self, session_factory, write_lock=None, history_writer=None):
+        self.session_factory = session_factory
+        self.write_lock = write_lock
+        self.history_writer = history_writer
+        self.session = None
+        self.committed = False
+        self._after_commit: List[Callable[[], None]] = []
+        self._appended: List = []
+
+    async def __aenter__(self) -> "TurnUnitOfWork":
+        if self.history_writer is not None:
+            # 기록 큐가 밀려 있으면 턴을 시작하기 전에 기다림 (커밋은 쓰기 잠금 안에서 하므로 거기서는 기다릴 수 없음)
+            await self.history_writer.wait_for_room()
+        self.session = self.session_factory()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if not self.committed:
+                await self.session.rollback()
+        finally:
+            await self.session.close()
+
+    @asynccontextmanager
+    async def writing(self):
+        """
+        쓰기 트랜잭션 구간 (write_lock이 있으면 잡은 채로 실행)
+
+        SQLite는 쓰기 트랜잭션이 한 번에 하나뿐이므로, 같은 프로세스의 턴들은 SQLite의 busy 대기
+        (잠자며 재시도) 대신 이 잠금에서 차례를 기다립니다. 구간 안에서 commit()까지 끝내야 합니다.
+        """
+        if self.write_lock is None:
+            yield self
+            return
+        async with self.write_lock:
+            yield self
+
+    def add(self, obj):
+        """INSERT할 ORM 객체를 등록합니다 (commit 때 한 번에 flush)"""
+        self.session.add(obj)
+
+    def append(self, model, values: Dict):
+        """INSERT할 기록 행을 등록합니다 (턴이 커밋되어야 기록됨)"""
+        if self.history_writer is None:
+            self.session.add(model(**values))
+        else:
+            self._appended.append((model, values))
+
+    def after_commit(self, callback: Callable[[], None]):
+        """커밋이 성공한 뒤 실행할 함수를 등록합니다"""
+        self._after_commit.append(callback)
+
+    async def commit(self):
+        """등록된 쓰기를 flush하고 한 번에 커밋합니다 (실패하면 롤백 후 예외 전달)"""
+        try:
+            await self.session.commit()
+        except Exception:
+            await self.session.rollback()
+            raise
+        self.committed = True
+
+        if self._appended:
+            rows, self._appended = self._appended, []
+            self.history_writer.extend(rows)
+
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            callback()
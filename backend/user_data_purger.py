@@ -0,0 +1,122 @@
+"""
+퇴역한 사용자 데이터 정리 (백그라운드)
+/new-user는 사용자의 현재 데이터 세대(users 행)에 retired_at만 찍고 바로 응답합니다.
+남은 대화/감정 기록은 여기서 작은 배치로 나눠 지우고, 배치 사이에는 쓰기 잠금을 놓아
+다른 사용자의 턴 커밋이 기다리지 않고 끼어들 수 있게 합니다.
+"""
+
+import asyncio
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Dict, Optional
+
+import crud
+
+
+class UserDataPurger:
+    """
+    퇴역한 users 행과 그 데이터를 배치 단위로 지우는 작업
+
+    Args:
+        session_factory: AsyncSession 팩토리
+        write_lock: 턴 커밋과 쓰기 트랜잭션을 직렬화하는 잠금 (database.async_write_lock)
+        batch_size: 한 트랜잭션에서 지우는 최대 행 수
+        batch_pause: 배치 사이에 쉬는 시간 (초)
+        idle_interval: 깨우는 요청이 없어도 남은 퇴역 행을 확인하는 주기 (초, 이전 실행에서 못 지운 것)
+        on_purge: users 행을 지우기 직전에 user_id로 부르는 비동기 콜백 (DB 밖의 파생 데이터 정리)
+    """
+
+    def __init__(self, session_factory, write_lock=None, batch_size: int = 500,
+                 batch_pause: float = 0.01, idle_interval: float = 60.0,
+                 on_purge: Optional[Callable[[int], Awaitable]] = None):
+        self.session_factory = session_factory
+        self.write_lock = write_lock
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.idle_interval = idle_interval
+        self.on_purge = on_purge
+        self._wakeup = asyncio.Event()
+        self._batch_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.users_purged = 0
+        self.rows_deleted = 0
+        self.batches = 0
+
+    def wake(self):
+        """새로 퇴역한 사용자가 있음을 알립니다"""
+        self._wakeup.set()
+
+    async def purge_pending(self) -> int:
+        """퇴역한 사용자를 모두 정리하고 정리한 사용자 수를 반환합니다"""
+        purged = 0
+        while True:
+            async with self.session_factory() as db:
+                user_ids = (await db.execute(crud.retired_user_ids_query())).scalars().all()
+            if not user_ids:
+                return purged
+            for user_id in user_ids:
+                await self._purge_user(user_id)
+                purged += 1
+
+    async def _purge_user(self, user_id: int):
+        for model in crud.USER_DATA_TABLES:
+            while True:
+                deleted = await self._write(crud.delete_user_rows_batch_query(model, user_id, self.batch_size))
+                self.rows_deleted += deleted
+                self.batches += 1
+                # 잠금을 놓은 상태에서 쉬어 대기 중인 턴 커밋이 먼저 들어가도록
+                await asyncio.sleep(self.batch_pause)
+                if deleted < self.batch_size:
+                    break
+        if self.on_purge:
+            # users 행이 남아 있는 동안 정리해야 중간에 멈춰도 다음 실행에서 다시 부름 (id가 재사용되기 전)
+            await self.on_purge(user_id)
+        await self._write(crud.delete_retired_user_query(user_id))
+        self.users_purged += 1
+
+    async def _write(self, statement) -> int:
+        """쓰기 한 건을 자체 트랜잭션으로 실행하고 영향받은 행 수를 반환합니다"""
+        async with self._batch_lock, self.write_lock or nullcontext(), self.session_factory() as db:
+            result = await db.execute(statement)
+            await db.commit()
+            return result.rowcount
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.idle_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                purged = await self.purge_pending()
+                if purged:
+                    print(f"퇴역 사용자 데이터 정리: {purged}명")
+            except Exception as e:
+                # 남은 행은 다음 주기에 다시 시도
+                print(f"사용자 데이터 정리 오류: {e}")
+
+    def start(self):
+        """정리 태스크를 시작합니다 (시작하자마자 이전 실행에서 남은 퇴역 행부터 정리)"""
+        if self._task is None:
+            self._wakeup.set()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """정리 태스크를 멈춥니다 (남은 행은 다음 실행에서 이어서 지움)"""
+        if self._task is not None:
+            # 진행 중인 배치가 끝난 뒤 취소 (쓰기 도중 취소하면 커넥션이 쓰기 잠금을 쥔 채 남음)
+            async with self._batch_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "users_purged": self.users_purged,
+            "rows_deleted": self.rows_deleted,
+            "batches": self.batches,
+            "batch_size": self.batch_size,
+        }
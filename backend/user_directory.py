@@ -0,0 +1,156 @@
+"""
+사용자 이름 → users.id 캐시
+모든 사용자별 테이블은 정수 user_id로 users를 참조합니다. 이름으로 들어온 요청은 여기서 id로 바꾸며,
+자주 대화하는 사용자는 DB 조회 없이 메모리에서 바로 찾습니다.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import event, select
+
+from database import conflict_insert
+
+
+class UserDirectory:
+    """
+    사용자 이름 → id LRU 캐시
+
+    캐시 미스면 호출한 세션으로 users를 조회하고, create=True이면 없는 사용자를 그 트랜잭션 안에서 만듭니다.
+    새로 만든 id는 그 세션이 커밋된 뒤에야 캐시에 넣습니다 (롤백되면 버림).
+    SQLite는 정수 키를 다시 쓸 수 있으므로, 롤백된 id가 캐시에 남으면 다른 사용자와 섞일 수 있습니다.
+    이름은 퇴역하지 않은 users 행(현재 데이터 세대)으로만 풀립니다.
+    """
+
+    def __init__(self, max_size: int = 50_000):
+        self.max_size = max_size
+        self._ids: "OrderedDict[str, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # forget 횟수: 조회 도중 forget이 있었으면 조회 결과(퇴역했을 수 있는 id)를 캐시하지 않음
+        self._forgets = 0
+
+    async def resolve(self, db, user_name: str, create: bool = True) -> Optional[int]:
+        """
+        사용자 id를 반환합니다
+
+        Args:
+            db: AsyncSession (캐시 미스 시 조회/생성에 사용)
+            create: 없는 사용자를 만들지 여부 (False면 None 반환)
+        """
+        user_id = self._lookup(db.sync_session, user_name)
+        if user_id is not None:
+            return user_id
+
+        self.misses += 1
+        forgets = self._forgets
+        user_id = (await db.execute(self._select_id(user_name))).scalar()
+        if user_id is None and create:
+            user_id = (await db.execute(self._insert_user(db, user_name))).scalar()
+            if user_id is not None:
+                self._remember_after_commit(db.sync_session, user_name, user_id)
+                return user_id
+            # 다른 트랜잭션이 먼저 만듦
+            user_id = (await db.execute(self._select_id(user_name))).scalar()
+
+        if user_id is not None and forgets == self._forgets:
+            self._remember(user_name, user_id)
+        return user_id
+
+    async def preload(self, session_factory, user_name: str) -> int:
+        """
+        사용자를 캐시에 올려 두고 id를 반환합니다 (없으면 만듦)
+        캐시 미스면 별도 세션에서 조회/생성하고 커밋하므로, 이후 같은 이름의 resolve는 DB를 쓰지 않습니다.
+        """
+        user_id = self._ids.get(user_name)
+        if user_id is not None:
+            return user_id
+        async with session_factory() as db:
+            user_id = await self.resolve(db, user_name)
+            await db.commit()
+        return user_id
+
+    def resolve_sync(self, db, user_name: str, create: bool = True) -> Optional[int]:
+        """resolve의 동기 Session 버전"""
+        user_id = self._lookup(db, user_name)
+        if user_id is not None:
+            return user_id
+
+        self.misses += 1
+        user_id = db.execute(self._select_id(user_name)).scalar()
+        if user_id is None and create:
+            user_id = db.execute(self._insert_user(db, user_name)).scalar()
+            if user_id is not None:
+                self._remember_after_commit(db, user_name, user_id)
+                return user_id
+            user_id = db.execute(self._select_id(user_name)).scalar()
+
+        if user_id is not None:
+            self._remember(user_name, user_id)
+        return user_id
+
+    @staticmethod
+    def _select_id(user_name: str):
+        from models import User
+        return select(User.id).where(User.name == user_name, User.retired_at.is_(None))
+
+    @staticmethod
+    def _insert_user(db, user_name: str):
+        from models import User
+        users = User.__table__
+        return (
+            conflict_insert(db, users)
+            .values(name=user_name)
+            .on_conflict_do_nothing(index_elements=["name"], index_where=users.c.retired_at.is_(None))
+            .returning(users.c.id)
+        )
+
+    def forget(self, user_name: str):
+        """캐시에서 사용자를 지웁니다 (데이터 세대를 퇴역시킨 뒤 호출)"""
+        self._ids.pop(user_name, None)
+        self._forgets += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def _lookup(self, session, user_name: str) -> Optional[int]:
+        user_id = self._ids.get(user_name)
+        if user_id is not None:
+            self._ids.move_to_end(user_name)
+            self.hits += 1
+            return user_id
+        # 이 세션이 만들고 아직 커밋하지 않은 사용자
+        return session.info.get("created_user_ids", {}).get(user_name)
+
+    def _remember(self, user_name: str, user_id: int):
+        self._ids[user_name] = user_id
+        self._ids.move_to_end(user_name)
+        while len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def _remember_after_commit(self, session, user_name: str, user_id: int):
+        created = session.info.get("created_user_ids")
+        if created is None:
+            created = session.info["created_user_ids"] = {}
+
+            def on_commit(_session):
+                for name, created_id in created.items():
+                    self._remember(name, created_id)
+                created.clear()
+
+            def on_rollback(_session, _previous_transaction):
+                created.clear()
+
+            event.listen(session, "after_commit", on_commit)
+            event.listen(session, "after_soft_rollback", on_rollback)
+        created[user_name] = user_id
+
+
+# 프로세스 전체에서 공유하는 캐시
+user_directory = UserDirectory()